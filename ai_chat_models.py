@@ -1,15 +1,26 @@
-from langchain_core.messages import SystemMessage, HumanMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_ollama import ChatOllama
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from llm_cache import llm_cache
+from llm_clients import llm_clients
+from job_queue import job_queue
+from model_routing import model_router, failure_kind, ModelOutputError
+from token_budget import fit_num_ctx, chunk_records, estimate_tokens
+from prompt_encoding import encode_json, encode_table, prompt_accounting
+from json_stream import JSONStreamValidator, JSONStreamError, parse_json_response
+from tracing import tracer, in_context
+from datetime import datetime
+from functools import lru_cache
 from dotenv import load_dotenv
-import os, re
+from typing import Callable
+import hashlib, json, re, time
 
+# LangChain clients are imported and built on first use, so importing this module stays fast
+# and a missing GOOGLE_API_KEY only matters if the Gemini model is actually used.
 load_dotenv()
-os.environ["GOOGLE_API_KEY"] = os.getenv("GOOGLE_API_KEY")
 
 # Thoughts: Avoid bias by being independent review summary assistant
 REVIEW_SUMMARY_TEMPLATE = """You are a concise review-summarization assistant.  
-Task: Given a list of json reviews produce a **brief review summary** for human readers.
+Task: Given reviews as a table (a header row, then one `|`-separated row per review) produce a **brief review summary** for human readers.
+If there is a `count` column, a row stands for that many reviews: identical or near-identical reviews are merged into one row, and reviews with a rating but no text are one row per rating with no text. An empty count means one review. Weigh themes by these counts.
 
 Requirements:
 1. No fluff, answer the question directly.
@@ -18,7 +29,7 @@ Requirements:
 4. Be specific on the car models if there are mentioned.
 5. Call out the most prominent customer themes (staff names, service experience, purchase process, common praise/complaint). Use exact short snippets (≤12 words) as quotes if helpful.
 6. If low-rating counts exist but no negative review text is provided, note that negative feedback exists but specifics are not available.
-7. If you are given an empty list, note that no reviews are available for summary.
+7. If you are given no review rows, note that no reviews are available for summary.
 8. Do **not** invent facts or add information not present in the input data.
 9. Tone: neutral-to-positive, professional. Avoid marketing language.
 10. Output format: one paragraph plain summary text only (no extra sections). Optionally include one short parenthetical with a representative quote.
@@ -27,40 +38,38 @@ Example output length: 1-4 sentences, ~25-100 words."""
 
 # Thoughts: Since this is a more complex task, use chain-of-thought/reasoning model.
 REVIEWS_ANALYSIS_TEMPLATE = """You are an assistant expert at review sentiment analysis.
-Task: Given an array of dictionaries/JSONs containing `title`, `review_count`, `review_rating`, `reviews_per_rating`, and `review_summary`, provide a meaningful insights/themes, prioritized recommendations, and measurable next steps based on customer feedback.
-This will be fed into a larger report.
+Task: Given a table of dealerships (a header row, then one `|`-separated row per dealership) with columns `title` and `review_summary`, provide a meaningful insights/themes, prioritized recommendations, and measurable next steps based on customer feedback.
+This will be fed into a larger report. Rating metrics are computed separately, so do not calculate any.
 
 Guide:
 1. Produce a **sentiment analysis summary** (1-2 sentences) that an internal team and client can scan quickly.
-2. Extract **top themes** (3-6) from the reviews (positive, negative, or mixed), explain why each theme matters, and show supporting evidence (counts where possible and 1-2 representative short quotes).
+2. Extract **top themes** (3-6) from the reviews (positive, negative, or mixed), explain why each theme matters, and show supporting evidence (the dealerships concerned and 1-2 representative short quotes).
 3. Provide **actionable recommendations**, prioritized (High / Medium / Low) and tied to concrete next steps the business can take.
 4. Optionally apply **KPIs / metrics** that are applicable.
-5. Report **confidence & data gaps** (e.g., “no negative review text available — only counts”).
+5. Report **confidence & data gaps** (e.g., “no negative review text available”).
 
 Required output would be a JSON object with these keys:
 - `brief_sentiment_analysis_summary` (string, 1-2 sentences)
-- `overall_metrics` (object: `average_rating`, `total_reviews`, `rating_distribution` copy of `reviews_per_rating`)
-- `themes` (array of objects): each `{ "theme": string, "sentiment": "positive|negative|mixed", "explanation": string, "supporting_count": int_or_null, "representative_quotes": [strings up to 2] }`
+- `themes` (array of objects): each `{ "theme": string, "sentiment": "positive|negative|mixed", "explanation": string, "representative_quotes": [strings up to 2] }`
 - `recommendations` (array): each `{ "priority": "High|Medium|Low", "action": string, "rationale": string, "suggested_kpis": [strings] }`
 - `confidence_and_gaps` (string): short note about confidence and any missing data
 
 Rules & constraints:
 - Pure JSON output starting with a left curly bracket { and ends with a right curly bracket }
 - Use only facts in `data`. Do **not** invent or infer details not present.
-- Counts are available (from `reviews_per_rating`), use them to quantify themes where reasonable (e.g., "% 5-star", "33 one-star reviews").
 - When representative quotes exists, maintain them and enclosed in quotes.
 - Tone: professional, concise, and actionable (neutral-to-positive)."""
 
 # Slightly modified to cater to car model reviews
 MODELS_ANALYSIS_TEMPLATE = """You are an assistant expert at review sentiment analysis for car models.
-Task: Given an array of dictionaries/JSONs useful data, provide a meaningful insights/themes, prioritized recommendations, and measurable next steps based on customer feedback.
+Task: Given a JSON object with `reviews` (an array of car model review summaries) and the models whose search found no review (`no_review_found`), `timed_out` or `failed`, provide a meaningful insights/themes, prioritized recommendations, and measurable next steps based on customer feedback.
 This will be fed into a larger report.
 
 Guide:
 1. Produce a **sentiment analysis summary** (1-2 sentences) that an internal team and client can scan quickly.
 2. Extract **top themes** (3-6) from the reviews (positive, negative, or mixed), explain why each theme matters, and show supporting evidence (counts where possible and 1 representative short quote).
 3. Provide **actionable recommendations**, prioritized (High / Medium / Low) and tied to concrete next steps the business can take.
-5. Report **confidence & data gaps** (e.g., “no negative review text available — only counts”).
+5. Report **confidence & data gaps** (e.g., “no negative review text available — only counts”), including the models without reviews.
 
 Required output would be a JSON object with these keys:
 - `brief_sentiment_analysis_summary` (string, 1-2 sentences)
@@ -75,6 +84,51 @@ Rules & constraints:
 - When representative quotes exists, maintain them and enclosed in quotes.
 - Tone: professional, concise, and actionable (neutral-to-positive)."""
 
+# Reduce step for dealers whose reviews had to be summarized in several batches
+REVIEW_SUMMARY_MERGE_TEMPLATE = """You are a concise review-summarization assistant.
+Task: You are given a JSON array of partial summaries, each written from a different batch of the same dealership's reviews. Merge them into **one brief review summary** for human readers.
+
+Requirements:
+1. Output **one to four sentences** (aim for ~25-125 words). Keep it short.
+2. Keep the themes that recur across batches and the most specific strengths, weaknesses, staff names and car models.
+3. Keep at most one short representative quote from the partial summaries.
+4. Do **not** invent facts or add information not present in the partial summaries.
+5. Tone: neutral-to-positive, professional. Avoid marketing language.
+6. Output format: one paragraph plain summary text only (no extra sections)."""
+
+# Reduce step when a region has too many dealers for one analysis call
+REVIEWS_ANALYSIS_MERGE_TEMPLATE = """You are an assistant expert at review sentiment analysis.
+Task: You are given an array of partial analysis JSON objects, each produced from a different subset of the same client's dealerships. Merge them into **one** analysis JSON object with exactly the same keys and structure as the partial analyses.
+
+Rules & constraints:
+- Pure JSON output starting with a left curly bracket { and ends with a right curly bracket }
+- `themes`: merge themes that describe the same thing, keep 3-6 themes and at most 2 quotes each.
+- `recommendations`: deduplicate and re-prioritize (High / Medium / Low).
+- `brief_sentiment_analysis_summary` and `confidence_and_gaps`: rewrite to cover all parts.
+- Use only facts in the partial analyses. Do **not** invent or infer details not present."""
+
+# Map step of the report for regions with too many dealerships for one report call
+REPORT_DIGEST_TEMPLATE = """You are an analyst preparing notes for a business report about customer reviews.
+Task: Given a table of dealerships (a header row, then one `|`-separated row per dealership) with their review summary and rating metrics, write a **compact digest** of these dealerships for the report writer.
+
+Requirements:
+1. One line per notable dealership: its name, its key numbers (review count, rating, period reviews and rating change) and its main strengths or complaints in a few words.
+2. Group dealerships with the same story into one line and name them all.
+3. Name the best and worst rated dealerships and the largest rating changes explicitly.
+4. Keep short quotes from the summaries only when they are specific.
+5. Use only facts in the table. Do **not** invent facts or numbers.
+6. Output format: a markdown bullet list only, at most ~600 words."""
+
+# Reduce step when the digests themselves are too large for one report call
+REPORT_DIGEST_MERGE_TEMPLATE = """You are an analyst preparing notes for a business report about customer reviews.
+Task: You are given a JSON array of partial digests, each written from a different subset of the same client's dealerships. Merge them into **one compact digest**.
+
+Requirements:
+1. Keep the best and worst rated dealerships, the largest rating changes and the most specific strengths and complaints, with their numbers.
+2. Group dealerships with the same story into one line and name them all.
+3. Use only facts in the partial digests. Do **not** invent facts or numbers.
+4. Output format: a markdown bullet list only, at most ~600 words."""
+
 # Similarly, use chain-of-thought/reasoning model.
 REPORT_WRITING_TEMPLATE = """You are a business researcher tasked with writing a cohesive report about customer reviews for the client.
 You will be provided with the report data containing original review data and some analysis from an analyst assistant.
@@ -101,62 +155,321 @@ def parse_reasoning_output(output: str) -> dict:
     }
 
 
+# Input budget per map call and expected output size per stage, in estimated tokens.
+# num_ctx for every call is sized from these and the actual prompt (see token_budget.fit_num_ctx).
+REVIEW_BATCH_TOKENS = 2048
+ANALYSIS_BATCH_TOKENS = 4096
+SUMMARY_OUTPUT_TOKENS = 256
+ANALYSIS_OUTPUT_TOKENS = 1536
+REPORT_OUTPUT_TOKENS = 4096
+# A report payload above this is too large for one call: its dealership rows and per-dealership metrics are
+# condensed into a digest first (see generate_md_report_from_data)
+REPORT_INPUT_TOKENS = 16384
+REPORT_DIGEST_BATCH_TOKENS = 6144
+REPORT_DIGEST_OUTPUT_TOKENS = 1024
+# Bump when the summary prompts get their reviews differently in a way the templates don't show,
+# e.g. a change to algorithms.dedupe_reviews or prompt_encoding.encode_table
+SUMMARY_PROMPT_VERSION = 1
+
+# Model calls as job runners: each takes the call's payload and the Ollama endpoint to use (None for the default),
+# so the same code runs here or in a job queue worker. Results are plain dicts that the queue can store.
+def run_chat_job(payload: dict, base_url: str | None = None) -> dict:
+    from langchain_core.messages import SystemMessage, HumanMessage
+    start = time.perf_counter()
+    message = get_chat_client(payload, base_url).invoke([
+        SystemMessage(content=payload["system_prompt"]),
+        HumanMessage(content=payload["user_prompt"])
+    ])
+    return {"content": message.text(), "metadata": dict(message.response_metadata or {}), "wall_s": time.perf_counter() - start}
+
+# The client of a job: Gemini for the "google" provider, otherwise a pooled ChatOllama on the endpoint
+def get_chat_client(payload: dict, base_url: str | None = None):
+    if payload.get("provider") == "google": return get_google_model(payload["model"], payload["temperature"], payload.get("timeout_s"))
+    return llm_clients.get(payload["model"], payload["temperature"], payload["num_ctx"], base_url, payload.get("timeout_s"))
+
+# Run a model call in this process, or as a job for the queue workers when the job queue is on (see job_queue.py).
+# Gemini calls need no Ollama endpoint and always run here. `max_attempts` overrides the queue's retries of the job,
+# and the route's timeout_s also limits the job's run time on a worker.
+def dispatch(runner: Callable[[dict, str | None], dict], payload: dict, max_attempts: int | None = None) -> dict:
+    if not job_queue.enabled or payload.get("provider") == "google": return runner(payload)
+    return job_queue.run(f"{runner.__module__}:{runner.__name__}", payload, max_attempts=max_attempts, max_seconds=payload.get("timeout_s"))
+
+# Gemini has no num_ctx to size (and a much larger context), so its calls are keyed and accounted with 0
+def fit_target_num_ctx(target: dict, system_prompt: str, user_prompt: str, output_tokens: int) -> int:
+    if target["provider"] == "google": return 0
+    return fit_num_ctx(system_prompt, user_prompt, output_tokens, llm_clients.min_num_ctx)
+
+# Answer a stage with `call(target, final)` on each model the router gives it (only `model` when the caller names one),
+# moving on to the next model when a call times out, fails or returns an unusable answer. `final` is set on the last
+# model, which has nothing to fall back to. `call` returns the response and whether a model was actually called
+# (not a cache hit); those calls are recorded per model in model_router for the routing statistics.
+def route_model_call(stage: str, model: str | None, call: Callable[[dict, bool], tuple[str, bool]]) -> str:
+    targets = model_router.targets(stage) if model is None else [model_router.target(model)]
+    for i, target in enumerate(targets):
+        final = i == len(targets) - 1
+        start = time.perf_counter()
+        try: response, called = call({**target, "fallback": i > 0}, final)
+        except Exception as e:
+            model_router.record(stage, target["model"], time.perf_counter() - start, failure_kind(e), i > 0)
+            if final: raise
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | {stage}: {target['model']} failed ({failure_kind(e)}: {e}), falling back to {targets[i + 1]['model']}")
+            continue
+        if called: model_router.record(stage, target["model"], time.perf_counter() - start, "ok", i > 0)
+        return response
+
+# Call the model routed to the stage (or `model`), going through the on-disk response cache first.
+# num_ctx is fitted to the prompt so Ollama never truncates it and small prompts don't pay for a large context.
+# Responses rejected by cache_if are returned but not stored, so a malformed answer is not replayed on the next run.
+# An empty answer goes to the fallback model when the stage has one. A call that will fall back is not retried by the job queue.
+def invoke_chat_model(stage: str, system_prompt: str, user_prompt: str, output_tokens: int, model: str | None = None, temperature: float = 0, cache_if: Callable[[str], bool] | None = None) -> str:
+    def call(target: dict, final: bool) -> tuple[str, bool]:
+        with tracer.span("llm", stage=stage, model=target["model"], tier=target["tier"], fallback=target["fallback"]) as span:
+            num_ctx = fit_target_num_ctx(target, system_prompt, user_prompt, output_tokens)
+            key = llm_cache.make_key(system_prompt, target["model"], temperature, num_ctx, user_prompt)
+            cached = llm_cache.get(key)
+            accounting = prompt_accounting.record(stage, system_prompt, user_prompt, num_ctx, cached is not None)
+            span.set(num_ctx=num_ctx, cache_hit=cached is not None, prompt_tokens=accounting["input_tokens"])
+            if cached is not None: return cached, False
+
+            with llm_clients.request_slot():
+                result = dispatch(run_chat_job, {"model": target["model"], "provider": target["provider"], "timeout_s": target["timeout_s"], "temperature": temperature, "num_ctx": num_ctx, "system_prompt": system_prompt, "user_prompt": user_prompt}, None if final else 1)
+            timing = llm_clients.record_timing(stage, target["model"], num_ctx, result["wall_s"], result["metadata"])
+            span.set(prompt_tokens=timing["prompt_tokens"] or accounting["input_tokens"], completion_tokens=timing["completion_tokens"])
+            response = result["content"]
+            if not final and not response.strip(): raise ModelOutputError(f"{stage}: {target['model']} returned an empty answer")
+            if cache_if is None or cache_if(response): llm_cache.set(key, target["model"], response)
+            return response, True
+    return route_model_call(stage, model, call)
+
+# Top-level keys and types of the dealers and models analysis JSON (see the analysis templates)
+ANALYSIS_SCHEMA = {"brief_sentiment_analysis_summary": str, "themes": list, "recommendations": list, "confidence_and_gaps": str}
+# Numbers the dealers analysis may still produce itself. They are allowed through the stream check and replaced by the
+# computed metrics in metrics.merge_metrics (which also drops the themes' supporting_count).
+ANALYSIS_IGNORED_KEYS = ["overall_metrics"]
+# Attempts per streamed JSON call. Retries run slightly warmer so they don't generate the same bad answer again.
+JSON_STREAM_ATTEMPTS = 3
+JSON_RETRY_TEMPERATURE = 0.3
+# Text allowed after the object closes before the rest of the generation is cut off
+MAX_TRAILING_CHARS = 16
+# Schema types by name, so a schema can travel in a job payload
+SCHEMA_TYPES = {"str": str, "list": list, "dict": dict}
+
+# One streamed attempt of stream_json_model, as a job runner. "content" is the validated JSON object text,
+# or None with the "error" that aborted the generation.
+def run_json_stream_job(payload: dict, base_url: str | None = None) -> dict:
+    from langchain_core.messages import SystemMessage, HumanMessage
+    validator = JSONStreamValidator({key: SCHEMA_TYPES.get(name, object) for key, name in payload["schema"].items()}, ignored_keys=payload.get("ignored_keys"))
+    response, error, first_token_at, chunks, metadata = None, None, None, 0, {}
+    start = time.perf_counter()
+    stream = get_chat_client(payload, base_url).stream([
+        SystemMessage(content=payload["system_prompt"]),
+        HumanMessage(content=payload["user_prompt"])
+    ])
+    try:
+        for chunk in stream:
+            text = chunk.text()
+            metadata.update(chunk.response_metadata or {})
+            if not text: continue
+            if first_token_at is None: first_token_at = time.perf_counter() - start
+            chunks += 1
+            validator.feed(text)
+            # Keep reading a short tail so Ollama's final chunk with its timings arrives; stop a longer epilogue
+            if validator.done and validator.trailing_chars > MAX_TRAILING_CHARS: break
+        response = validator.result()
+    except JSONStreamError as e: error = str(e)
+    finally:
+        # Closing the stream drops the HTTP request, which stops Ollama generating
+        stream.close()
+    return {"content": response, "error": error, "metadata": metadata, "first_token_s": first_token_at, "chunks": chunks, "wall_s": time.perf_counter() - start}
+
+# Like invoke_chat_model, but streams the answer through a JSONStreamValidator and aborts the generation as soon as
+# it turns into prose or leaves the schema, then retries. Returns the validated JSON object text, and raises
+# ModelOutputError (after trying the fallback model, if any) when no attempt produced one.
+# Time to first token and tokens/sec are recorded for every attempt, aborted or not. A retry's answer is cached under
+# the retry's temperature, so it is never replayed as the answer of the first attempt; a later run looks it up on retry.
+def stream_json_model(stage: str, system_prompt: str, user_prompt: str, output_tokens: int, schema: dict[str, type], model: str | None = None, temperature: float = 0, attempts: int = JSON_STREAM_ATTEMPTS, ignored_keys: list[str] | None = None) -> str:
+    def call(target: dict, final: bool) -> tuple[str, bool]:
+        with tracer.span("llm", stage=stage, model=target["model"], tier=target["tier"], fallback=target["fallback"]) as span:
+            num_ctx = fit_target_num_ctx(target, system_prompt, user_prompt, output_tokens)
+            key = llm_cache.make_key(system_prompt, target["model"], temperature, num_ctx, user_prompt)
+            cached = llm_cache.get(key)
+            accounting = prompt_accounting.record(stage, system_prompt, user_prompt, num_ctx, cached is not None)
+            span.set(num_ctx=num_ctx, cache_hit=cached is not None, prompt_tokens=accounting["input_tokens"])
+            if cached is not None:
+                # Answers cached before the schema check are validated again and regenerated if they fail
+                try: return parse_json_response(cached, schema, ignored_keys), False
+                except JSONStreamError: span.set(cache_hit=False)
+
+            error = None
+            for attempt in range(attempts):
+                attempt_temperature = temperature if attempt == 0 else max(temperature, JSON_RETRY_TEMPERATURE)
+                attempt_key = key if attempt_temperature == temperature else llm_cache.make_key(system_prompt, target["model"], attempt_temperature, num_ctx, user_prompt)
+                cached = llm_cache.get(attempt_key) if attempt_key != key else None
+                if cached is not None:
+                    try:
+                        response = parse_json_response(cached, schema, ignored_keys)
+                        span.set(attempts=attempt + 1, cache_hit=True)
+                        return response, False
+                    except JSONStreamError: pass
+                with llm_clients.request_slot():
+                    result = dispatch(run_json_stream_job, {"model": target["model"], "provider": target["provider"], "timeout_s": target["timeout_s"], "temperature": attempt_temperature, "num_ctx": num_ctx, "system_prompt": system_prompt, "user_prompt": user_prompt, "schema": {name: value_type.__name__ for name, value_type in schema.items()}, "ignored_keys": ignored_keys}, None if final else 1)
+                response, error = result["content"], result["error"]
+                timing = llm_clients.record_timing(stage, target["model"], num_ctx, result["wall_s"], result["metadata"], result["first_token_s"], result["chunks"], aborted=response is None)
+                span.set(attempts=attempt + 1, prompt_tokens=timing["prompt_tokens"] or accounting["input_tokens"], completion_tokens=span.attributes.get("completion_tokens", 0) + timing["completion_tokens"], ttft_s=timing["ttft_s"], tokens_per_s=timing["tokens_per_s"])
+                if response is not None:
+                    llm_cache.set(attempt_key, target["model"], response)
+                    return response, True
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | {stage}: {target['model']} attempt {attempt + 1}/{attempts} aborted after {result['chunks']} chunks: {error}")
+            raise ModelOutputError(f"{stage}: no valid JSON from {target['model']} after {attempts} attempts. Last error: {error}")
+    return route_model_call(stage, model, call)
+
+# Run fn over every item with a bounded number of parallel requests.
+# Output keeps the input order; a failed call leaves its exception in that slot instead of stopping the batch.
+def run_in_parallel(fn: Callable, items: list, max_workers: int = 4) -> list:
+    if max_workers < 1: raise ValueError(f"max_workers must be at least 1. Got {max_workers}")
+
+    results = [None] * len(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(in_context(fn), item): i for i, item in enumerate(items)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try: results[i] = future.result()
+            except Exception as e: results[i] = e
+    return results
+
+# A partial result as reduce prompts carry it: a JSON answer (analysis, digest) as its object rather than an escaped
+# string, anything else (e.g. a text summary) as is
+def decode_partial(part: str):
+    try: value = json.loads(part)
+    except ValueError: return part
+    return value if isinstance(value, (dict, list)) else part
+
+def encode_partials(parts: list[str]) -> str:
+    return encode_json([decode_partial(part) for part in parts])
+
+# Map-reduce over groups of records: each group is split into batches that fit `batch_tokens`,
+# every batch goes through map_fn, then groups with several partial results are merged with reduce_fn,
+# level by level in case the partials themselves exceed the budget. All calls share one worker pool size.
+# Map batches are rendered with `encode`; partial results are passed to reduce_fn as a JSON array (see decode_partial).
+# Within each level, calls are issued shortest prompt first so requests needing the same num_ctx run back to back.
+# `labels` name the groups (e.g. dealer titles) in the trace, so time can be attributed per group.
+def map_reduce(groups: list[list], map_fn: Callable[[str], str], reduce_fn: Callable[[str], str], batch_tokens: int, max_workers: int = 4, encode: Callable[[list], str] = encode_json, labels: list[str] | None = None) -> list[str | Exception]:
+    results: list[str | Exception] = [None] * len(groups)
+    pending = {i: chunk_records(records, batch_tokens, encode_json) or [[]] for i, records in enumerate(groups)}
+    reducing = False
+
+    while pending:
+        # (group index, prompt to send or None, partial passed through unchanged)
+        jobs = []
+        for i, batches in pending.items():
+            for batch in batches:
+                if reducing and len(batch) == 1: jobs.append((i, None, batch[0]))
+                else: jobs.append((i, encode_partials(batch) if reducing else encode(batch), None))
+        calls = sorted((j for j, job in enumerate(jobs) if job[1] is not None), key=lambda j: len(jobs[j][1]))
+        fn = reduce_fn if reducing else map_fn
+        def call(job: tuple) -> str:
+            if labels is None: return fn(job[1])
+            with tracer.attributes(item=labels[job[0]]): return fn(job[1])
+        outputs = dict(zip(calls, run_in_parallel(call, [jobs[j][:2] for j in calls], max_workers)))
+
+        partials: dict[int, list] = {i: [] for i in pending}
+        for j, (i, prompt, passthrough) in enumerate(jobs): partials[i].append(outputs[j] if prompt is not None else passthrough)
+
+        pending = {}
+        for i, parts in partials.items():
+            error = next((part for part in parts if isinstance(part, Exception)), None)
+            if error is not None: results[i] = error
+            elif len(parts) == 1: results[i] = parts[0]
+            else:
+                batches = chunk_records(parts, batch_tokens, lambda part: encode_json(decode_partial(part)))
+                # Always make progress, even if every partial is close to the budget
+                if len(batches) == len(parts): batches = [parts[j:j + 2] for j in range(0, len(parts), 2)]
+                pending[i] = batches
+        reducing = True
+    return results
+
 def generate_review_summary(user_prompt: str) -> str:
-    return ChatOllama(
-        model="qwen2.5:32b",
-        temperature=0,
-        num_ctx=1024
-    ).invoke([
-        SystemMessage(content=REVIEW_SUMMARY_TEMPLATE),
-        HumanMessage(content=user_prompt)
-    ]).text()
+    return invoke_chat_model("review_summary", REVIEW_SUMMARY_TEMPLATE, user_prompt, SUMMARY_OUTPUT_TOKENS)
+
+def generate_review_summary_merge(user_prompt: str) -> str:
+    return invoke_chat_model("review_summary_merge", REVIEW_SUMMARY_MERGE_TEMPLATE, user_prompt, SUMMARY_OUTPUT_TOKENS)
+
+# Everything besides the reviews that shapes a dealer's summary: the prompt version, both summary templates, the
+# batch size and the models the summary stages are routed to. Summaries made under another version are redone.
+def summary_version() -> str:
+    payload = [SUMMARY_PROMPT_VERSION, REVIEW_SUMMARY_TEMPLATE, REVIEW_SUMMARY_MERGE_TEMPLATE, REVIEW_BATCH_TOKENS, model_router.stage_models("review_summary"), model_router.stage_models("review_summary_merge")]
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+# Summarize many dealers' reviews at once. Busy dealers are split into batches that fit the context,
+# summarized in parallel and merged; output keeps the input order with exceptions in place of failed dealers.
+def generate_review_summaries(reviews_per_dealer: list[list[dict]], max_workers: int = 4, labels: list[str] | None = None) -> list[str | Exception]:
+    return map_reduce(reviews_per_dealer, generate_review_summary, generate_review_summary_merge, REVIEW_BATCH_TOKENS, max_workers, encode_table, labels)
 
 def generate_reviews_analysis(user_prompt: str) -> str:
-    response = ChatOllama(
-        model="qwen2.5:32b",
-        temperature=0,
-        num_ctx=4096
-    ).invoke([
-        SystemMessage(content=REVIEWS_ANALYSIS_TEMPLATE),
-        HumanMessage(content=user_prompt)
-    ]).text()
-
-    match = re.search(r'\{.*\}', response, re.DOTALL)
-    if match: response = match.group(0)
-    else: raise ValueError("Failed to extract JSON from dealers_input")
-    return response
+    return stream_json_model("reviews_analysis", REVIEWS_ANALYSIS_TEMPLATE, user_prompt, ANALYSIS_OUTPUT_TOKENS, ANALYSIS_SCHEMA, ignored_keys=ANALYSIS_IGNORED_KEYS)
+
+def generate_reviews_analysis_merge(user_prompt: str) -> str:
+    return stream_json_model("reviews_analysis_merge", REVIEWS_ANALYSIS_MERGE_TEMPLATE, user_prompt, ANALYSIS_OUTPUT_TOKENS, ANALYSIS_SCHEMA, ignored_keys=ANALYSIS_IGNORED_KEYS)
+
+# Analyze all dealers, splitting a large region into dealer subsets whose partial analyses are merged
+def generate_dealers_analysis(dealers: list[dict], max_workers: int = 4) -> str:
+    result = map_reduce([dealers], generate_reviews_analysis, generate_reviews_analysis_merge, ANALYSIS_BATCH_TOKENS, max_workers, encode_table)[0]
+    if isinstance(result, Exception): raise result
+    return result
 
 def generate_models_analysis(user_prompt: str) -> str:
-    response = ChatOllama(
-        model="qwen2.5:32b",
-        temperature=0,
-        num_ctx=4096
-    ).invoke([
-        SystemMessage(content=MODELS_ANALYSIS_TEMPLATE),
-        HumanMessage(content=user_prompt)
-    ]).text()
-
-    match = re.search(r'\{.*\}', response, re.DOTALL)
-    if match: response = match.group(0)
-    else: raise ValueError("Failed to extract JSON from models_analysis")
-    return response
+    return stream_json_model("models_analysis", MODELS_ANALYSIS_TEMPLATE, user_prompt, ANALYSIS_OUTPUT_TOKENS, ANALYSIS_SCHEMA)
 
 def generate_md_report(user_prompt: str) -> str:
-    return ChatOllama(
-        model="qwen2.5:32b",
-        temperature=0,
-        num_ctx=16384
-    ).invoke([
-        SystemMessage(content=REPORT_WRITING_TEMPLATE),
-        HumanMessage(content=user_prompt)
-    ]).text()
-
-model_google = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash",
-    temperature=0
-)
+    return invoke_chat_model("md_report", REPORT_WRITING_TEMPLATE, user_prompt, REPORT_OUTPUT_TOKENS)
+
+def generate_report_digest(user_prompt: str) -> str:
+    return invoke_chat_model("report_digest", REPORT_DIGEST_TEMPLATE, user_prompt, REPORT_DIGEST_OUTPUT_TOKENS)
+
+def generate_report_digest_merge(user_prompt: str) -> str:
+    return invoke_chat_model("report_digest_merge", REPORT_DIGEST_MERGE_TEMPLATE, user_prompt, REPORT_DIGEST_OUTPUT_TOKENS)
+
+# Write the markdown report from the report data (see algorithms.convert_to_report_data). A payload that fits
+# REPORT_INPUT_TOKENS goes to the writer as is. For a larger region, each dealership row is joined with its
+# `dealership_metrics` entry, the rows are map-reduced into one digest, and the writer gets the digest in place
+# of the rows and per-dealership metrics, the same way generate_dealers_analysis splits a large region.
+def generate_md_report_from_data(report_data: dict, max_workers: int = 4) -> str:
+    user_prompt = encode_json(report_data)
+    if estimate_tokens(user_prompt) <= REPORT_INPUT_TOKENS: return generate_md_report(user_prompt)
+
+    dealers = report_data.get("dealerships_with_reviews") or []
+    analysis = dict(report_data.get("analysis_of_rating_reviews") or {})
+    dealer_metrics = analysis.pop("dealership_metrics", None) or []
+    # Metrics are computed over the same dealers in the same order; fall back to matching by title otherwise
+    if len(dealer_metrics) != len(dealers):
+        by_title = {entry.get("title"): entry for entry in dealer_metrics}
+        dealer_metrics = [by_title.get(dealer.get("title"), {}) for dealer in dealers]
+    rows = [{**dealer, **{key: value for key, value in entry.items() if key not in dealer}} for dealer, entry in zip(dealers, dealer_metrics)]
+    digest = map_reduce([rows], generate_report_digest, generate_report_digest_merge, REPORT_DIGEST_BATCH_TOKENS, max_workers, encode_table)[0]
+    if isinstance(digest, Exception): raise digest
+
+    condensed = {key: value for key, value in report_data.items() if key != "dealerships_with_reviews"}
+    condensed["analysis_of_rating_reviews"] = analysis
+    condensed["dealerships_digest"] = digest
+    return generate_md_report(encode_json(condensed))
+
+# One Gemini client per (model, temperature, timeout), for the stages routed to the "google" provider
+@lru_cache(maxsize=8)
+def get_google_model(model: str = "gemini-2.0-flash", temperature: float = 0, timeout: float | None = None):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(
+        model=model,
+        temperature=temperature,
+        timeout=timeout
+    )
+
+# Keeps `ai_chat_models.model_google` working without building the client at import time
+def __getattr__(name: str):
+    if name == "model_google": return get_google_model()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 # Test usage here
 if __name__ == "__main__":
-    # print(ChatGoogleGenerativeAI(model="gemini-2.0-flash").invoke("Who is jose rizal?"))
+    from langchain_ollama import ChatOllama
+    # print(get_google_model().invoke("Who is jose rizal?"))
     print(ChatOllama(model="mistral-nemo:latest").invoke("Who is jose rizal?"))
\ No newline at end of file
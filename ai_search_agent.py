@@ -1,16 +1,15 @@
-from langgraph.graph.message import add_messages
-from langchain_core.messages import HumanMessage
-from langgraph.graph import StateGraph, END
-from langchain_tavily import TavilySearch
-from langgraph.prebuilt import ToolNode
-from langchain_openai import ChatOpenAI
 from typing import TypedDict, Annotated
+from functools import lru_cache
 from dotenv import load_dotenv
 from datetime import datetime
-import os
+from search_cache import search_cache
+from job_queue import job_queue
+from tracing import tracer
+import asyncio, json, os
 
+# LangGraph, Tavily and the OpenAI-compatible client are imported and built on first search,
+# so the pipeline doesn't pay for them (or need TAVILY_API_KEY) unless -include-car-models is set.
 load_dotenv()
-os.environ["TAVILY_API_KEY"] = os.getenv("TAVILY_API_KEY")
 
 # TODO: Future improvement, fetching/scraping the models automatically possibly through https://www.ldvautomotive.com.au/
 MODELS = [
@@ -29,65 +28,158 @@ MODELS = [
     "LDV Deliver 9 Bus"
 ]
 
-#* Uses Top 3 search
-tool_belt = [TavilySearch(max_results=3)]
-model = ChatOpenAI(
-  model="gpt-oss:20b",
-  api_key="ollama",
-  base_url="http://localhost:11434/v1",
-  temperature=0,
-)
-model = model.bind_tools(tool_belt)
-tool_node = ToolNode(tool_belt)
-
-class AgentState(TypedDict):
-  messages: Annotated[list, add_messages]
-
-def call_model(state):
-  messages = state["messages"]
-  response = model.invoke(messages)
-  return {"messages" : [response]}
-
-def should_continue(state):
-  last_message = state["messages"][-1]
-
-  if last_message.tool_calls:
-    return "action"
-
-  return END
-
-uncompiled_graph = StateGraph(AgentState)
-uncompiled_graph.add_node("agent", call_model)
-uncompiled_graph.add_node("action", tool_node)
-uncompiled_graph.set_entry_point("agent")
-uncompiled_graph.add_conditional_edges("agent", should_continue)
-uncompiled_graph.add_edge("action", "agent")
-
-search_agent_graph = uncompiled_graph.compile()
-
-
-# Finds reviews of the models in current year
-def search_and_summarize_model_reviews(models: list[str] = MODELS) -> list[dict]:
+# Per-model limits so one slow or looping search can't stall the report
+SEARCH_MAX_CONCURRENCY = 4
+SEARCH_TIMEOUT_SECONDS = 180
+SEARCH_MAX_TOOL_CALLS = 3
+# Each agent -> action round is two graph steps, plus the final answer
+SEARCH_RECURSION_LIMIT = 2 * SEARCH_MAX_TOOL_CALLS + 3
+
+SEARCH_MODEL = "gpt-oss:20b"
+
+# Ollama's OpenAI-compatible API on the given endpoint (default: $OLLAMA_HOST, or the local Ollama)
+def openai_base_url(host: str | None = None) -> str:
+  host = (host or os.getenv("OLLAMA_HOST") or "http://localhost:11434").rstrip("/")
+  return f"{host if '://' in host else f'http://{host}'}/v1"
+
+# The agent's tool-calling model, served by Ollama's OpenAI-compatible API (the benchmarks swap in a fake)
+def get_search_model(base_url: str | None = None):
+  from langchain_openai import ChatOpenAI
+  return ChatOpenAI(
+    model=SEARCH_MODEL,
+    api_key="ollama",
+    base_url=openai_base_url(base_url),
+    temperature=0,
+  )
+
+# After max_tool_calls searches, the agent must answer from what it already found.
+# One graph per Ollama endpoint (`base_url`, None for the default one).
+@lru_cache(maxsize=None)
+def get_search_agent_graph(max_tool_calls: int = SEARCH_MAX_TOOL_CALLS, base_url: str | None = None):
+  from langgraph.graph.message import add_messages
+  from langgraph.graph import StateGraph, END
+  from langchain_core.messages import ToolMessage
+  from langchain_tavily import TavilySearch
+
+  #* Uses Top 3 search
+  tool_belt = [TavilySearch(max_results=search_cache.max_results)]
+  model = get_search_model(base_url)
+  model_with_tools = model.bind_tools(tool_belt)
+
+  class AgentState(TypedDict):
+    messages: Annotated[list, add_messages]
+    car_model: str
+    # URLs and content hashes of the pages this conversation has read
+    seen_pages: list[str]
+
+  # Async so a timed-out search cancels its in-flight HTTP request instead of leaving a thread running
+  async def call_model(state):
+    messages = state["messages"]
+    tool_calls = sum(1 for message in messages if getattr(message, "type", None) == "tool")
+    response = await (model if tool_calls >= max_tool_calls else model_with_tools).ainvoke(messages)
+    return {"messages" : [response]}
+
+  # Stands in for ToolNode: searches go through the on-disk cache, and pages this conversation already read are dropped
+  async def call_tools(state):
+    results = []
+    seen = set(state.get("seen_pages") or [])
+    for tool_call in state["messages"][-1].tool_calls:
+      try: content = json.dumps(await asyncio.to_thread(search_cache.search_unseen, tool_call["args"], seen), ensure_ascii=False)
+      except Exception as e: content = f"Error: search failed ({e})"
+      results.append(ToolMessage(content=content, tool_call_id=tool_call["id"], name=tool_call["name"]))
+    return {"messages": results, "seen_pages": sorted(seen)}
+
+  def should_continue(state):
+    last_message = state["messages"][-1]
+
+    if last_message.tool_calls:
+      return "action"
+
+    return END
+
+  uncompiled_graph = StateGraph(AgentState)
+  uncompiled_graph.add_node("agent", call_model)
+  uncompiled_graph.add_node("action", call_tools)
+  uncompiled_graph.set_entry_point("agent")
+  uncompiled_graph.add_conditional_edges("agent", should_continue)
+  uncompiled_graph.add_edge("action", "agent")
+
+  return uncompiled_graph.compile()
+
+# Keeps `ai_search_agent.search_agent_graph` working without compiling the graph at import time
+def __getattr__(name: str):
+  if name == "search_agent_graph": return get_search_agent_graph()
+  raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# Runs the search agent for one model and returns its final answer
+async def search_model_review(model_name: str, year: int, recursion_limit: int = SEARCH_RECURSION_LIMIT, base_url: str | None = None) -> str:
+  from langchain_core.messages import HumanMessage
+  prompt = f"Search in Tavily to find latest ({year}) review/s of {model_name} and summarize all the review/s into one.\nMake sure *whole output* is brief (3-5 sentences) and only in *1 paragraph*.\nMake sure to include the website/s name and date/s of the review.\nIf no review is found, say 'No review found'."
+  input = {"messages": [HumanMessage(content=prompt)], "car_model": model_name, "seen_pages": []}
+  result = await get_search_agent_graph(SEARCH_MAX_TOOL_CALLS, base_url).ainvoke(input, config={"recursion_limit": recursion_limit})
+  return result["messages"][-1].text()  # Take only the last AIMessage
+
+# One model's search as a job queue runner. A timeout is a result, not a failure, so the queue doesn't retry it.
+# The job's search cache counters go back with the result, since the worker may be another process.
+def run_search_job(payload: dict, base_url: str | None = None) -> dict:
+  async def search():
+    try: return {"content": await asyncio.wait_for(search_model_review(payload["model_name"], payload["year"], payload["recursion_limit"], base_url), payload["timeout"]), "timed_out": False}
+    except asyncio.TimeoutError: return {"content": None, "timed_out": True}
+  with search_cache.run() as search_stats: result = asyncio.run(search())
+  return {**result, "search_stats": search_stats}
+
+async def search_models_concurrently(models: list[str], max_concurrency: int, timeout: float, recursion_limit: int) -> list[str | Exception]:
   year = datetime.now().year
-  results = []
-  for model_name in models:
-    prompt = f"Search in Tavily to find latest ({year}) review/s of {model_name} and summarize all the review/s into one.\nMake sure *whole output* is brief (3-5 sentences) and only in *1 paragraph*.\nMake sure to include the website/s name and date/s of the review.\nIf no review is found, say 'No review found'."
-    input = {"messages": [HumanMessage(content=prompt)]}
-    model_reviews = []
-    result = search_agent_graph.invoke(input)
-    msg = result["messages"][-1].text()  # Take only the last AIMessage
+  semaphore = asyncio.Semaphore(max_concurrency)
+
+  # The timeout starts once a model gets a slot (or, with the job queue, once a worker runs it), not while it waits
+  async def search(model_name: str) -> str | Exception:
+    async with semaphore:
+      with tracer.span("search.model", car_model=model_name) as span:
+        try:
+          if not job_queue.enabled: return await asyncio.wait_for(search_model_review(model_name, year, recursion_limit), timeout)
+          result = await asyncio.to_thread(job_queue.run, f"{__name__}:run_search_job", {"model_name": model_name, "year": year, "recursion_limit": recursion_limit, "timeout": timeout}, max_seconds=timeout)
+          search_cache.add_to_run(result.get("search_stats") or {})
+          if result["timed_out"]: raise asyncio.TimeoutError
+          return result["content"]
+        except asyncio.TimeoutError:
+          span.fail(f"timed out after {timeout}s")
+          return TimeoutError(f"Search for {model_name} timed out after {timeout}s")
+        except Exception as e:
+          span.fail(e)
+          return e
+
+  return await asyncio.gather(*(search(model_name) for model_name in models))
+
+# Finds reviews of the models in current year, searching up to max_concurrency models at once.
+# Returns the found reviews plus which models had no review, timed out or failed.
+def search_and_summarize_model_reviews(models: list[str] = MODELS, max_concurrency: int = SEARCH_MAX_CONCURRENCY, timeout: float = SEARCH_TIMEOUT_SECONDS, recursion_limit: int = SEARCH_RECURSION_LIMIT, verbose: bool = False) -> dict:
+  if max_concurrency < 1: raise ValueError(f"max_concurrency must be at least 1. Got {max_concurrency}")
+  with search_cache.run() as search_stats: messages = asyncio.run(search_models_concurrently(models, max_concurrency, timeout, recursion_limit))
+  print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Search cache: {search_stats}")
+
+  results = {"reviews": [], "no_review_found": [], "timed_out": [], "failed": []}
+  for model_name, msg in zip(models, messages):
+    if isinstance(msg, TimeoutError):
+      print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] {msg}")
+      results["timed_out"].append(model_name)
+      continue
+    if isinstance(msg, Exception):
+      print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Search for {model_name} failed: {msg}")
+      results["failed"].append(model_name)
+      continue
 
-    print(f"MESSAGE: {msg}")
+    if verbose: print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] Review of {model_name}:\n{msg}")
 
     if not msg or "no review found" in msg.lower():
       print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] No review found for {model_name}")
-      model_reviews = ["No review found"]
+      results["no_review_found"].append(model_name)
       continue
 
-    model_reviews.append(msg)
-    results.append({
+    results["reviews"].append({
       "model": model_name,
-      "model_review": model_reviews
+      "model_review": [msg]
     })
   return results
 
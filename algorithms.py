@@ -1,7 +1,28 @@
-from markdown_pdf import MarkdownPdf, Section
-from api_queries import fetch_reviews
-from datetime import datetime
-import json, subprocess, platform, os
+from api_queries import serpapi_client
+from tracing import tracer
+from datetime import datetime, date, timedelta
+from typing import Callable, Iterator
+from review_store import ReviewStore, Period, month_period
+from place_store import load_place_store, save_place_store, merge_places, merge_reviews, stale_places, refresh_since
+from prompt_encoding import encode_table
+from token_budget import estimate_tokens
+import json, subprocess, platform, os, hashlib, re, zlib
+
+SUMMARY_STATE_PATH = "./cache_data/summary_state.json"
+# Summaries not used for this long are dropped from the summary state
+SUMMARY_STATE_RETENTION_DAYS = 365
+PLACE_FIELDS = ["categories", "title", "review_count", "review_rating", "reviews_per_rating", "user_reviews_extended"]
+REVIEW_FIELDS = ["When", "Rating", "Description"]
+_json_decoder = json.JSONDecoder()
+
+# Near-duplicate reviews: texts are compared as sets of character shingles, estimated with MinHash signatures
+# and bucketed by band (LSH), then every candidate pair is confirmed with the exact Jaccard similarity
+SHINGLE_CHARS = 4
+MINHASH_PERMUTATIONS = 64
+MINHASH_BANDS = 16
+NEAR_DUPLICATE_SIMILARITY = 0.7
+MINHASH_SEED = 0
+_MINHASH_PRIME = (1 << 61) - 1
 
 # Turn multiple JSON lines into an array of dicts
 def parse_json_lines(file_path: str) -> list[dict]:    
@@ -17,8 +38,43 @@ def parse_json_lines(file_path: str) -> list[dict]:
                     raise ValueError(f"Error parsing line: {e}")
     return results
 
-# Scrape LDV places with reviews, or use cache if available
-def scrape_LDV_places(file_path: str, reuse_cache: bool = False) -> list[dict]:
+# Decode only the top-level "categories" value of a raw JSON line.
+# Returns None when it can't be located, so the caller falls back to a full decode.
+def peek_categories(line: str) -> list[str] | None:
+    idx = line.find('"categories":')
+    if idx == -1: return None
+    idx += len('"categories":')
+    while idx < len(line) and line[idx].isspace(): idx += 1
+    try: categories, _ = _json_decoder.raw_decode(line, idx)
+    except json.JSONDecodeError: return None
+    return categories if isinstance(categories, list) else None
+
+# Stream places one at a time, keeping only `fields` (and `review_fields` of each extended review).
+# With dealers_only, non-dealer lines are rejected from their categories before the rest of the line is decoded.
+def iter_places(file_path: str, fields: list[str] = PLACE_FIELDS, review_fields: list[str] | None = REVIEW_FIELDS, dealers_only: bool = False) -> Iterator[dict]:
+    with open(file_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line: continue
+            if dealers_only:
+                categories = peek_categories(line)
+                if categories is not None and not is_dealership({"categories": categories}): continue
+            try: place = json.loads(line)
+            except json.JSONDecodeError as e: raise ValueError(f"Error parsing line: {e}")
+            if dealers_only and not is_dealership(place): continue
+
+            projected = {key: place[key] for key in fields if key in place}
+            if review_fields is not None and projected.get("user_reviews_extended"):
+                projected["user_reviews_extended"] = [
+                    {key: review[key] for key in review_fields if key in review}
+                    for review in projected["user_reviews_extended"]
+                ]
+            yield projected
+
+# Scrape LDV places with reviews, or use cache if available.
+# A fresh scrape is merged into the existing file by place cid: only unseen reviews are appended and each
+# scraped place is stamped with `last_scraped_at`. `incremental=False` rebuilds the file from this scrape alone.
+def scrape_LDV_places(file_path: str, reuse_cache: bool = False, since: date | None = None, incremental: bool = True) -> list[dict]:
     if not file_path or file_path.strip() == "":
         raise ValueError("file_path must be a non-empty string.")
     
@@ -27,47 +83,69 @@ def scrape_LDV_places(file_path: str, reuse_cache: bool = False) -> list[dict]:
         return parse_json_lines(file_path)
 
     print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Scraping LDV places with reviews...")
-    # Check if file exists and rename it
-    if os.path.exists(file_path):
-        backup_suffix = f"_backup_{datetime.now().strftime('%Y-%m-%d_%H-%M')}"
-        base, ext = os.path.splitext(file_path)
-        new_path = f"{base}{backup_suffix}{ext}"
-        os.rename(file_path, new_path)
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Cache data already exists. Backed up {file_path} to {new_path}")
+    base, ext = os.path.splitext(file_path)
+    scrape_path = f"{base}_scrape{ext}"
+    if os.path.exists(scrape_path): os.remove(scrape_path)
 
-    command = ["./utils/google_maps_scraper", "-input", "./utils/gms_input.txt", "-results", file_path, "-json", "-extra-reviews", "-geo", "-31.5253323,148.6922628", "-zoom", "7"]
+    command = ["./utils/google_maps_scraper", "-input", "./utils/gms_input.txt", "-results", scrape_path, "-json", "-extra-reviews", "-geo", "-31.5253323,148.6922628", "-zoom", "7"]
 
     #! Must have WSL Installed
     if platform.system() == "Windows": command =  ["cmd", "/c", "wsl"] + command
     
-    result = subprocess.run(command, capture_output=True, text=True, encoding="utf-8")
+    with tracer.span("scrape"): result = subprocess.run(command, capture_output=True, text=True, encoding="utf-8")
     print(result.stdout)
     if result.returncode != 0:
         raise RuntimeError(f"Error occurred while scraping reviews: {result.stderr}")
 
-    #* Fallback for null reviews
-    ldv_places = parse_json_lines(file_path)
+    store = load_place_store(file_path) if incremental else {}
+    stats = merge_places(store, parse_json_lines(scrape_path))
+    os.remove(scrape_path)
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Merged scrape into {file_path}: {stats['new_places']} new places, {stats['updated_places']} updated, {stats['new_reviews']} new reviews")
+
+    #* Fallback for null reviews, fetched concurrently back to `since`
+    places = list(store.values())
+    backfill_reviews_with_serpapi(places, since)
+    #* Dealerships the scraper missed for a while only need the reviews posted since each one's last scrape
+    stale = [place for place in stale_places(store) if place.get("user_reviews_extended") and is_dealership(place)]
+    if stale: backfill_reviews_with_serpapi(stale, refresh=True, since_of=refresh_since)
+
+    save_place_store(store, file_path)
+    return places
+
+# Using SerpAPI's Google Maps Reviews API as contingency if initial review scrape fails.
+# Merges fetched reviews into every place without reviews (or every given place with `refresh`), in place.
+# Reviews are fetched back to `since`, or to `since_of(place)` per place. Returns whether any place was updated.
+def backfill_reviews_with_serpapi(places: list[dict], since: date | None = None, refresh: bool = False, since_of: Callable[[dict], date | None] | None = None) -> bool:
+    targets = [place for place in places if (refresh or not place.get("user_reviews_extended")) and place.get("data_id")]
+    if not targets: return False
+    since_by_id = {place["data_id"]: since_of(place) for place in targets} if since_of else None
+    cutoff = f"since {min(since_by_id.values(), key=lambda day: day or date.min)} at the earliest" if since_by_id else f"since {since or 'the first page'}"
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Re-attempting to scrape reviews for {len(targets)} places using SerpAPI ({cutoff})")
+    with tracer.span("serpapi.backfill", places=len(targets), refresh=refresh) as span:
+        results = serpapi_client.backfill([place["data_id"] for place in targets], since, since_by_id)
+        span.set(errors=sum(isinstance(reviews, Exception) for reviews in results.values()))
+
     updated_flag = False
-    for place in ldv_places:
-        if not place.get("user_reviews_extended"):
-            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Re-attempting to scrape reviews for place: {place.get('title', 'Unknown')}")
-            place["user_reviews_extended"] = scrape_reviews_with_serpapi(place.get("data_id"))
-            if place["user_reviews_extended"]: updated_flag = True
-
-    # If any place was updated, overwrite the file with new data
-    if updated_flag:
-        with open(file_path, "w", encoding="utf-8") as f:
-            for place in ldv_places:
-                f.write(json.dumps(place, ensure_ascii=False) + "\n")
-
-    return ldv_places
-
-# Using SerpAPI's Google Maps Reviews API as contingency if initial review scrape fails
-def scrape_reviews_with_serpapi(data_id: str) -> list[dict]:
-    reviews = fetch_reviews(data_id)
+    for place in targets:
+        reviews = results[place["data_id"]]
+        if isinstance(reviews, Exception):
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | SerpAPI failed for {place.get('title', 'Unknown')}: {reviews}")
+            continue
+        place["last_scraped_at"] = datetime.now().isoformat(timespec="seconds")
+        if not reviews:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | No reviews found for {place['data_id']} using SerpAPI.")
+            continue
+        place["user_reviews_extended"], added = merge_reviews(place.get("user_reviews_extended"), convert_serpapi_reviews(reviews))
+        updated_flag = updated_flag or added > 0
+    return updated_flag
+
+def scrape_reviews_with_serpapi(data_id: str, since: date | None = None) -> list[dict]:
+    reviews = serpapi_client.fetch_reviews(data_id, since)
     if not reviews:
         print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | No reviews found for {data_id} using SerpAPI.")
+    return convert_serpapi_reviews(reviews)
 
+def convert_serpapi_reviews(reviews: list[dict]) -> list[dict]:
     # Renaming keys according to the original format of 'user_reviews_extended'
     # Original keys: "Name", "Rating", "Description", "When"
     # SerpAPI's equivalent keys: "user" (dict) -> "name", "rating", "snippet", "iso_date"
@@ -82,16 +160,19 @@ def check_places(places: list[dict]) -> None:
     if not places: raise ValueError("No places found.")
     [print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Missing user_reviews in place: {place.get('title', 'Unknown')}\nLink: {place.get('link', 'Unknown')}\n") for place in places if not place.get("user_reviews_extended")]
 
+def is_dealership(place: dict) -> bool:
+    categories = place.get("categories")
+    if categories is None: raise KeyError(f"Missing 'categories' in place: {place}")
+    return any("dealer" in cat.lower() for cat in categories)
+
 # Reduce the places by selecting only those who are dealerships
 def filter_dealerships(places: list[dict]) -> list[dict]:
-    def has_dealer(categories, place):
-        if categories is None: raise KeyError(f"Missing 'categories' in place: {place}")
-        return any("dealer" in cat.lower() for cat in categories)
     if not places: return []
-    return [place for place in places if has_dealer(place.get("categories"), place)]
+    return [place for place in places if is_dealership(place)]
 
-# Reduce the number of reviews by filtering selected month
-def filter_reviews_by_month(reviews: list[dict], month: int | str) -> list[dict]:
+# Reduce the number of reviews by filtering selected month (of any year unless `year` is given).
+# process_input uses ReviewStore instead, which indexes dates once for any period.
+def filter_reviews_by_month(reviews: list[dict], month: int | str, year: int | None = None) -> list[dict]:
     if not reviews: return []
     
     # Accept month as int or str, convert to int
@@ -109,7 +190,7 @@ def filter_reviews_by_month(reviews: list[dict], month: int | str) -> list[dict]
             if len(parts) < 2: continue
             try:
                 review_month = int(parts[1])
-                if review_month == month_int:
+                if review_month == month_int and (year is None or int(parts[0]) == year):
                     filtered.append(review)
             except Exception: continue
             
@@ -126,28 +207,149 @@ def filter_keys(d: dict, keys: list[str]) -> dict:
 def filter_out_keys(d: dict, keys: list[str]) -> dict:
     return {key: d[key] for key in d if key not in keys}
 
-# Return an array of dealerships json ready to feed by batch
-def process_input(month: str | int, file_path: str, reuse_cache: bool) -> list[dict]:
-    raw_ldv_places = scrape_LDV_places(file_path, reuse_cache)
-    filtered_ldv_dealerships = filter_dealerships(raw_ldv_places)
-    filtered_ldv_dealerships_keys = [filter_keys(dealership, [
-        "title",
-        "review_count",
-        "review_rating",
-        "reviews_per_rating",
-        "user_reviews_extended"
-    ]) for dealership in filtered_ldv_dealerships]
-
-    for dealership in filtered_ldv_dealerships_keys: 
-        dealership["user_reviews_extended"] = filter_reviews_by_month(dealership.get("user_reviews_extended"), month)
-        dealership["user_reviews_extended"] = [
-            filter_keys(review, [
-            "Rating",
-            "Description"
-            ]) for review in dealership["user_reviews_extended"]
-        ]
-    
-    return filtered_ldv_dealerships_keys
+# Load every dealership once with all of its dated reviews, indexed for period queries
+def load_review_store(file_path: str, reuse_cache: bool, since: date | None = None, incremental_scrape: bool = True) -> ReviewStore:
+    with tracer.span("load_reviews", file_path=file_path, reuse_cache=reuse_cache) as span:
+        # Scrape (or confirm the cache), then stream back only the dealerships and the fields we use
+        if reuse_cache and file_path and os.path.exists(file_path):
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Using cached LDV places data.")
+        else: scrape_LDV_places(file_path, reuse_cache, since, incremental_scrape)
+        filtered_ldv_dealerships = iter_places(file_path, dealers_only=True)
+        filtered_ldv_dealerships_keys = [filter_keys(dealership, [
+            "title",
+            "review_count",
+            "review_rating",
+            "reviews_per_rating",
+            "user_reviews_extended"
+        ]) for dealership in filtered_ldv_dealerships]
+
+        store = ReviewStore(filtered_ldv_dealerships_keys)
+        span.set(dealers=len(store.dealerships), undated_reviews=store.undated_count)
+        if store.undated_count:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Skipped {store.undated_count} reviews without a valid date.")
+        return store
+
+# Return an array of dealerships json ready to feed by batch.
+# `period` overrides `month`; without it the latest occurrence of `month` is used.
+def process_input(month: str | int, file_path: str, reuse_cache: bool, period: Period | None = None, incremental_scrape: bool = True) -> list[dict]:
+    with tracer.span("process_input"):
+        if period is None: period = month_period(month)
+        return load_review_store(file_path, reuse_cache, period.start, incremental_scrape).query(period)
+
+# Hash a dealer's filtered reviews so unchanged dealers can reuse their previous summary.
+# Review order is ignored; only the title and each review's rating and text matter.
+def fingerprint_reviews(dealer: dict) -> str:
+    reviews = sorted(json.dumps([review.get("Rating"), review.get("Description")], ensure_ascii=False) for review in dealer.get("user_reviews_extended") or [])
+    payload = json.dumps([dealer.get("title"), reviews], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# Lowercase words only, so reviews differing in case, punctuation or spacing hash the same
+def normalize_review_text(text: str | None) -> str:
+    return " ".join(re.findall(r"\w+", (text or "").lower()))
+
+# 32-bit hashes of the text's character shingles
+def shingle_hashes(text: str, size: int = SHINGLE_CHARS) -> set[int]:
+    return {zlib.crc32(text[i:i + size].encode("utf-8")) for i in range(max(len(text) - size + 1, 1))}
+
+# MinHash signature of every shingle set, one row each, with MINHASH_PERMUTATIONS hash functions (a * x + b) mod p
+def minhash_signatures(shingle_sets: list[set[int]]):
+    import numpy as np
+    rng = np.random.default_rng(MINHASH_SEED)
+    a = rng.integers(1, _MINHASH_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+    b = rng.integers(0, _MINHASH_PRIME, MINHASH_PERMUTATIONS, dtype=np.uint64)
+    signatures = np.empty((len(shingle_sets), MINHASH_PERMUTATIONS), dtype=np.uint64)
+    for i, hashes in enumerate(shingle_sets):
+        values = np.fromiter(hashes, dtype=np.uint64, count=len(hashes))
+        # The product wraps around 2**64 like any uint64 arithmetic; the result is still a fixed, well-mixed permutation
+        signatures[i] = (((np.outer(values, a) + b) % _MINHASH_PRIME) & 0xFFFFFFFF).min(axis=0)
+    return signatures
+
+# Group texts whose shingle sets have a Jaccard similarity of at least `threshold` (transitively).
+# Returns groups of indices in input order.
+def near_duplicate_groups(texts: list[str], threshold: float = NEAR_DUPLICATE_SIMILARITY) -> list[list[int]]:
+    if len(texts) < 2: return [[i] for i in range(len(texts))]
+    shingles = [shingle_hashes(text) for text in texts]
+    rows = MINHASH_PERMUTATIONS // MINHASH_BANDS
+    buckets = {}
+    for i, signature in enumerate(minhash_signatures(shingles)):
+        for band in range(MINHASH_BANDS): buckets.setdefault((band, signature[band * rows:(band + 1) * rows].tobytes()), []).append(i)
+
+    parent = list(range(len(texts)))
+    def root(i: int) -> int:
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+    checked = set()
+    for members in buckets.values():
+        for k, i in enumerate(members):
+            for j in members[k + 1:]:
+                if (i, j) in checked or root(i) == root(j): continue
+                checked.add((i, j))
+                if len(shingles[i] & shingles[j]) / len(shingles[i] | shingles[j]) >= threshold: parent[root(j)] = root(i)
+
+    groups = {}
+    for i in range(len(texts)): groups.setdefault(root(i), []).append(i)
+    return list(groups.values())
+
+# Collapse a dealer's reviews before summarization. Reviews with the same rating and the same (normalized) text,
+# or near-identical text, become one row with a `count`; the longest text of each group represents it.
+# Reviews with a rating but no text become one row per rating. Rows keep the order of the reviews they stand for;
+# `count` is left empty for single reviews. When the extra column costs more than collapsing saves (e.g. only a few
+# rating-only reviews), the reviews are returned unchanged.
+# Returns the rows and what was collapsed, with the estimated prompt tokens before and after.
+def dedupe_reviews(reviews: list[dict], threshold: float = NEAR_DUPLICATE_SIMILARITY) -> tuple[list[dict], dict]:
+    exact, rating_only = {}, {}
+    for position, review in enumerate(reviews):
+        text = normalize_review_text(review.get("Description"))
+        if text: exact.setdefault((review.get("Rating"), text), []).append(position)
+        else: rating_only.setdefault(review.get("Rating"), []).append(position)
+
+    keys_per_rating = {}
+    for key in exact: keys_per_rating.setdefault(key[0], []).append(key)
+    groups = []
+    for keys in keys_per_rating.values():
+        groups += [sorted(position for k in group for position in exact[keys[k]]) for group in near_duplicate_groups([key[1] for key in keys], threshold)]
+
+    empty = {key: None for key in reviews[0]} if reviews else {}
+    count = lambda positions: len(positions) if len(positions) > 1 else None
+    rows = [(group[0], {**max((reviews[position] for position in group), key=lambda review: len(review.get("Description") or "")), "count": count(group)}) for group in groups]
+    rows += [(positions[0], {**empty, "Rating": rating, "count": count(positions)}) for rating, positions in rating_only.items()]
+    rows = [row for _, row in sorted(rows, key=lambda entry: entry[0])]
+
+    stats = {
+        "reviews": len(reviews),
+        "rows": len(rows),
+        "exact_duplicates": sum(len(positions) - 1 for positions in exact.values()),
+        "near_duplicates": len(exact) - len(groups),
+        "rating_only": sum(len(positions) for positions in rating_only.values()),
+        "tokens_before": estimate_tokens(encode_table(reviews)),
+        "tokens_after": estimate_tokens(encode_table(rows))
+    }
+    if stats["tokens_after"] >= stats["tokens_before"]: return reviews, {**stats, "rows": len(reviews), "tokens_after": stats["tokens_before"]}
+    return rows, stats
+
+# State store of summaries by the fingerprint of the reviews they were made from (see fingerprint_reviews), so a
+# dealer's summary is found again whichever client, period or batch job it was made for
+def load_summary_state(file_path: str = SUMMARY_STATE_PATH) -> dict:
+    if not os.path.exists(file_path): return {}
+    with open(file_path, "r", encoding="utf-8") as f:
+        try: return json.load(f)
+        except json.JSONDecodeError:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Ignoring unreadable summary state at {file_path}")
+            return {}
+
+def save_summary_state(state: dict, file_path: str = SUMMARY_STATE_PATH) -> None:
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, file_path)
+
+# Drop the entries not used within `days` (entries from before used_at count from when they were made)
+def prune_summary_state(state: dict, days: float = SUMMARY_STATE_RETENTION_DAYS) -> dict:
+    cutoff = (datetime.now() - timedelta(days=days)).isoformat(timespec="seconds")
+    return {key: entry for key, entry in state.items() if (entry.get("used_at") or entry.get("updated_at") or "") >= cutoff}
 
 def convert_to_report_data(
     client: str,
@@ -170,16 +372,21 @@ def convert_to_report_data(
     if analysis_of_car_models: report_data["analysis_of_car_models_reviews"] = analysis_of_car_models
     return report_data
 
-def make_pdf(month: str | int, md: str) -> None:
+def make_pdf(month: str | int, md: str, client: str | None = None) -> str:
     # Convert month number to month name
     try:
         month_int = int(month)
         month_name = datetime(1900, month_int, 1).strftime('%B').lower()
-    except Exception: month_name = str(month)
+    except Exception: month_name = str(month).lower().replace(" ", "_")
+    if client: month_name = f"{client.lower().replace(' ', '_')}_{month_name}"
     
-    pdf = MarkdownPdf()
-    pdf.add_section(Section(md, toc=False))
-    pdf.save(f"./reports/{month_name}_report_{datetime.now().strftime('%Y-%m-%d_%H-%M')}.pdf")
+    with tracer.span("make_pdf", markdown_chars=len(md)):
+        from markdown_pdf import MarkdownPdf, Section
+        pdf = MarkdownPdf()
+        pdf.add_section(Section(md, toc=False))
+        path = f"./reports/{month_name}_report_{datetime.now().strftime('%Y-%m-%d_%H-%M')}.pdf"
+        pdf.save(path)
+    return path
 
 
 # Test usage by running this
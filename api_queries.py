@@ -1,24 +1,128 @@
-from serpapi import GoogleSearch
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
 from dotenv import load_dotenv
-import os
+from review_store import parse_review_date
+from tracing import tracer, in_context
+import os, threading, time
 
 load_dotenv()
 
+SERPAPI_URL = os.getenv("SERPAPI_URL", "https://serpapi.com/search.json")
+SERPAPI_MAX_WORKERS = 4
+SERPAPI_REQUESTS_PER_SECOND = 2.0
+SERPAPI_MAX_PAGES = 20
+SERPAPI_RETRIES = 3
+SERPAPI_TIMEOUT_SECONDS = 30
+
+# Spaces requests at least 1 / requests_per_second apart across all threads
+class RateLimiter:
+    def __init__(self, requests_per_second: float):
+        self.requests_per_second = requests_per_second
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if self.requests_per_second <= 0: return
+        with self._lock:
+            now = time.monotonic()
+            wait_until = max(now, self._next_at)
+            self._next_at = wait_until + 1 / self.requests_per_second
+        if wait_until > now: time.sleep(wait_until - now)
+
+
+# SerpAPI's Google Maps Reviews API over one pooled HTTP session, shared by every backfill thread.
+# Pages are followed through `next_page_token` until the reviews (sorted newest first) pass `since`;
+# without `since` only the first (newest) page is read.
+class SerpApiClient:
+    def __init__(self, api_key: str | None = os.getenv("SERP_API_KEY"), base_url: str = SERPAPI_URL, requests_per_second: float = SERPAPI_REQUESTS_PER_SECOND, max_workers: int = SERPAPI_MAX_WORKERS, retries: int = SERPAPI_RETRIES, timeout: float = SERPAPI_TIMEOUT_SECONDS, backoff_seconds: float = 1.0):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.rate_limiter = RateLimiter(requests_per_second)
+        self.max_workers = max_workers
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff_seconds = backoff_seconds
+        self.requests_made = 0
+        self._session = None
+        self._lock = threading.Lock()
+
+    @property
+    def requests_per_second(self) -> float:
+        return self.rate_limiter.requests_per_second
+
+    @requests_per_second.setter
+    def requests_per_second(self, value: float) -> None:
+        self.rate_limiter.requests_per_second = value
+
+    def get_session(self):
+        with self._lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                self._session = requests.Session()
+                self._session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers))
+                self._session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers))
+            return self._session
+
+    # One API request. Rate limits (429), server errors and network errors are retried with exponential backoff.
+    def get(self, params: dict) -> dict:
+        import requests
+        params = {**params, "api_key": self.api_key}
+        for attempt in range(self.retries + 1):
+            self.rate_limiter.wait()
+            with self._lock: self.requests_made += 1
+            try:
+                response = self.get_session().get(self.base_url, params=params, timeout=self.timeout)
+                retry_after = response.headers.get("Retry-After")
+                if response.status_code != 429 and response.status_code < 500:
+                    if response.status_code >= 400:
+                        raise RuntimeError(f"SerpAPI request failed with status {response.status_code}: {response.text[:200]}")
+                    return response.json()
+                error = RuntimeError(f"SerpAPI request failed with status {response.status_code}")
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error, retry_after = e, None
+            if attempt == self.retries: raise error
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else self.backoff_seconds * 2 ** attempt
+            time.sleep(delay)
+
+    # Reviews of one place, newest first, down to the first page that reaches back past `since` (just the first page without it)
+    def fetch_reviews(self, data_id: str, since: date | None = None, max_pages: int = SERPAPI_MAX_PAGES) -> list[dict]:
+        params = {"engine": "google_maps_reviews", "data_id": data_id, "sort_by": "newestFirst"}
+        reviews = []
+        with tracer.span("serpapi.fetch_reviews", data_id=data_id) as span:
+            for pages in range(1, max_pages + 1):
+                results = self.get(params)
+                page = results.get("reviews") or []
+                reviews.extend(page)
+                span.set(pages=pages, reviews=len(reviews))
+                next_page_token = (results.get("serpapi_pagination") or {}).get("next_page_token")
+                if not page or not next_page_token or since is None: break
+                oldest = parse_review_date(page[-1].get("iso_date"))
+                if since is not None and oldest is not None and oldest < since: break
+                params = {**params, "next_page_token": next_page_token}
+        return reviews
+
+    # Fetch reviews for many places concurrently, back to `since` or to each place's own date in `since_by_id`.
+    # A place that still fails after the retries maps to its exception.
+    def backfill(self, data_ids: list[str], since: date | None = None, since_by_id: dict[str, date | None] | None = None) -> dict[str, list[dict] | Exception]:
+        def fetch(data_id):
+            try: return self.fetch_reviews(data_id, since_by_id.get(data_id, since) if since_by_id else since)
+            except Exception as e: return e
+        if not data_ids: return {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(data_ids, executor.map(in_context(fetch), data_ids)))
+
+
+# Shared instance used by the scrape fallback
+serpapi_client = SerpApiClient()
+
 # Using SerpAPI's Google Maps Reviews API
-def fetch_reviews(data_id: str):
-    params = {
-        "engine": "google_maps_reviews",
-        "data_id": data_id,
-        "sort_by": "newestFirst",
-        "api_key": os.getenv("SERP_API_KEY"),
-    }
-    search = GoogleSearch(params)
-    results = search.get_dict()
-    return results.get("reviews", [])
+def fetch_reviews(data_id: str, since: date | None = None) -> list[dict]:
+    return serpapi_client.fetch_reviews(data_id, since)
 
 # Example usage
 if __name__ == "__main__":
     place_id = "0x6b9c0f1d986269cd:0x1001f7bfaaba10b2"
     reviews = fetch_reviews(place_id)
     for review in reviews:
-        print(f"Review by {review['author_name']}: {review['text']}")
\ No newline at end of file
+        print(f"Review by {review['user']['name']}: {review['snippet']}")
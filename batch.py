@@ -0,0 +1,77 @@
+from concurrent.futures import ThreadPoolExecutor
+from algorithms import load_review_store
+from llm_clients import OLLAMA_KEEP_ALIVE
+from token_budget import MIN_NUM_CTX
+from search_cache import SEARCH_CACHE_TTL_HOURS
+from api_queries import SERPAPI_MAX_WORKERS, SERPAPI_REQUESTS_PER_SECOND
+from report import generate_report, configure_clients, preload_models, print_run_stats, DEFAULT_CLIENT, DEFAULT_LOCATION
+from review_store import parse_period_args, previous_period
+from datetime import datetime
+import json
+
+DEFAULT_FILE_PATH = "./cache_data/LDV_places.jsonl"
+BATCH_JOB_WORKERS = 4
+# Matches OLLAMA_NUM_PARALLEL's usual setting; requests of every job wait in one queue for these slots
+BATCH_MAX_LLM_REQUESTS = 4
+
+# A jobs file is a JSON list of objects such as
+#   {"client": "LDV", "location": "New South Wales, Australia", "file_path": "./cache_data/LDV_places.jsonl", "month": 9, "year": 2025}
+# Periods take the same options as main.py: month/year, quarter/year, last_days, or from/to.
+# "car_models" (a list of model names) also searches and analyses those models for the job.
+def load_jobs(file_path: str) -> list[dict]:
+    with open(file_path, "r", encoding="utf-8") as f: raw_jobs = json.load(f)
+    if not isinstance(raw_jobs, list) or not raw_jobs: raise ValueError(f"{file_path} must contain a non-empty JSON list of jobs.")
+    return [parse_job(raw_job) for raw_job in raw_jobs]
+
+def parse_job(raw_job: dict) -> dict:
+    unknown = set(raw_job) - {"client", "location", "file_path", "month", "year", "quarter", "last_days", "from", "to", "car_models"}
+    if unknown: raise KeyError(f"Unknown job keys {sorted(unknown)} in {raw_job}")
+    return {
+        "client": raw_job.get("client", DEFAULT_CLIENT),
+        "location": raw_job.get("location", DEFAULT_LOCATION),
+        "file_path": raw_job.get("file_path", DEFAULT_FILE_PATH),
+        "period": parse_period_args(raw_job.get("month"), raw_job.get("year"), raw_job.get("quarter"), raw_job.get("last_days"), raw_job.get("from"), raw_job.get("to")),
+        "car_models": raw_job.get("car_models")
+    }
+
+# Run many (client, input file, period) reports in one process.
+# Each input file is loaded and indexed once and shared by every period that reads it; jobs run concurrently and
+# all their model requests go through one queue of `max_llm_requests` slots, so the GPU is never idle between
+# one job's stages. A failed job is reported and doesn't stop the others. Returns the run id (or error) per job.
+def run_batch(jobs: list[dict], reuse_cache: bool = False, job_workers: int = BATCH_JOB_WORKERS, max_llm_requests: int = BATCH_MAX_LLM_REQUESTS, summary_workers: int = 4, use_llm_cache: bool = True, incremental: bool = True, keep_alive: str | int = OLLAMA_KEEP_ALIVE, min_num_ctx: int = MIN_NUM_CTX, preload: bool = False, car_model_workers: int = 4, car_model_timeout: float = 180, search_cache_ttl_hours: float = SEARCH_CACHE_TTL_HOURS, serpapi_workers: int = SERPAPI_MAX_WORKERS, serpapi_rate: float = SERPAPI_REQUESTS_PER_SECOND, incremental_scrape: bool = True, verbose: bool = False, metrics_dir: str | None = None, ollama_hosts: list[tuple[str, int]] | None = None, external_workers: bool = False, routing: dict | None = None) -> list[str | Exception]:
+    if job_workers < 1: raise ValueError(f"job_workers must be at least 1. Got {job_workers}")
+    configure_clients(use_llm_cache, keep_alive, min_num_ctx, max_llm_requests, search_cache_ttl_hours, serpapi_workers, serpapi_rate, metrics_dir, ollama_hosts, external_workers, routing)
+    if preload: preload_models(min_num_ctx)
+
+    #* Load every input once; a scrape backfills far enough for the earliest period (and the one before it, for metrics)
+    stores = {}
+    for file_path in dict.fromkeys(job["file_path"] for job in jobs):
+        since = min(previous_period(job["period"]).start for job in jobs if job["file_path"] == file_path)
+        stores[file_path] = load_review_store(file_path, reuse_cache, since, incremental_scrape)
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Batch of {len(jobs)} jobs over {len(stores)} inputs ({job_workers} jobs at once, {max_llm_requests} model requests at once)")
+
+    def run_job(job: dict) -> str | Exception:
+        try:
+            return generate_report(
+                job["period"], job["client"], job["location"], job["file_path"],
+                search_car_models=bool(job["car_models"]),
+                car_models=job["car_models"],
+                summary_workers=summary_workers,
+                incremental=incremental,
+                car_model_workers=car_model_workers,
+                car_model_timeout=car_model_timeout,
+                review_store=stores[job["file_path"]],
+                verbose=verbose
+            )
+        except Exception as e:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Job {job['client']} {job['period'].label} failed: {e}")
+            return e
+
+    with ThreadPoolExecutor(max_workers=job_workers) as executor:
+        results = list(executor.map(run_job, jobs))
+
+    for job, result in zip(jobs, results):
+        status = f"failed: {result}" if isinstance(result, Exception) else f"run {result}"
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | {job['client']} {job['period'].label}: {status}")
+    print_run_stats()
+    return results
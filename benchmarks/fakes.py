@@ -0,0 +1,217 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from token_budget import estimate_tokens, CHARS_PER_TOKEN
+import asyncio, itertools, json, re, threading, time
+
+# Offline stand-ins for Ollama, Tavily and SerpAPI, so the pipeline can be measured on a CPU-only box with no network.
+# Latency and token throughput are configurable; outputs have the shape (and roughly the size) the real services return.
+
+SUMMARY_TOKENS = 120
+REPORT_TOKENS = 1500
+# Tokens per streamed chunk; Ollama sends one token per chunk, but sleeping per token is too coarse to be accurate
+STREAM_CHUNK_TOKENS = 8
+# Call counters are shared by every fake model of a FakeLLM
+_count_lock = threading.Lock()
+
+def filler_text(tokens: int, seed: str = "") -> str:
+    sentence = f"Customers mention {seed or 'the dealership'} for friendly staff, quick service and clear pricing, while a few report slow follow-up. "
+    return (sentence * (tokens * CHARS_PER_TOKEN // len(sentence) + 1))[:tokens * CHARS_PER_TOKEN].strip()
+
+def fake_analysis(seed: str) -> str:
+    return json.dumps({
+        "brief_sentiment_analysis_summary": filler_text(40, seed),
+        "themes": [{"theme": f"Theme {i}", "sentiment": sentiment, "explanation": filler_text(40, seed), "representative_quotes": [filler_text(10)]} for i, sentiment in enumerate(["positive", "negative", "mixed", "positive"])],
+        "recommendations": [{"priority": priority, "action": filler_text(20), "rationale": filler_text(30), "suggested_kpis": ["Response time", "Average rating"]} for priority in ["High", "Medium", "Low"]],
+        "confidence_and_gaps": filler_text(30)
+    }, indent=2)
+
+def fake_report(tokens: int = REPORT_TOKENS) -> str:
+    sections = ["Executive Summary", "Dealership Reviews", "Themes", "Recommendations", "Next Steps"]
+    per_section = tokens // len(sections)
+    return "\n\n".join(f"## {section}\n\n{filler_text(per_section, section.lower())}" for section in sections)
+
+
+class FakeMessage:
+    def __init__(self, content: str, response_metadata: dict | None = None):
+        self.content = content
+        self.response_metadata = response_metadata or {}
+
+    def text(self) -> str:
+        return self.content
+
+
+# Stands in for ChatOllama. Generation takes latency + prompt tokens / prefill rate + output tokens / token rate,
+# and is reported in Ollama's response metadata format so the timing summary works unchanged.
+class FakeChatModel:
+    def __init__(self, model: str, latency_s: float = 0.02, tokens_per_second: float = 2000, prefill_tokens_per_second: float = 20000, counter: dict | None = None, endpoint_counter: dict | None = None):
+        self.model = model
+        self.latency_s = latency_s
+        self.tokens_per_second = tokens_per_second
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.counter = counter if counter is not None else {"calls": 0}
+        self.endpoint_counter = endpoint_counter if endpoint_counter is not None else {"calls": 0}
+
+    # The answer is picked from the system prompt, so every stage gets output of the right kind
+    def answer(self, messages: list) -> str:
+        from ai_chat_models import REVIEWS_ANALYSIS_TEMPLATE, REVIEWS_ANALYSIS_MERGE_TEMPLATE, MODELS_ANALYSIS_TEMPLATE, REPORT_WRITING_TEMPLATE
+        system_prompt, user_prompt = messages[0].content, messages[-1].content
+        seed = re.sub(r"\W+", " ", user_prompt[:40]).strip()
+        if system_prompt in [REVIEWS_ANALYSIS_TEMPLATE, REVIEWS_ANALYSIS_MERGE_TEMPLATE, MODELS_ANALYSIS_TEMPLATE]: return fake_analysis(seed)
+        if system_prompt == REPORT_WRITING_TEMPLATE: return fake_report()
+        return filler_text(SUMMARY_TOKENS, seed)
+
+    def metadata(self, prompt_tokens: int, output_tokens: int) -> dict:
+        return {
+            "load_duration": 0,
+            "prompt_eval_count": prompt_tokens,
+            "prompt_eval_duration": int(prompt_tokens / self.prefill_tokens_per_second * 1e9),
+            "eval_count": output_tokens,
+            "eval_duration": int(output_tokens / self.tokens_per_second * 1e9)
+        }
+
+    def start(self, messages: list) -> tuple[str, int]:
+        with _count_lock:
+            self.counter["calls"] += 1
+            self.endpoint_counter["calls"] += 1
+        prompt_tokens = sum(estimate_tokens(message.content) for message in messages)
+        time.sleep(self.latency_s + prompt_tokens / self.prefill_tokens_per_second)
+        return self.answer(messages), prompt_tokens
+
+    def invoke(self, messages: list, **kwargs) -> FakeMessage:
+        content, prompt_tokens = self.start(messages)
+        output_tokens = estimate_tokens(content)
+        time.sleep(output_tokens / self.tokens_per_second)
+        return FakeMessage(content, self.metadata(prompt_tokens, output_tokens))
+
+    def stream(self, messages: list, **kwargs):
+        content, prompt_tokens = self.start(messages)
+        chunk_chars = STREAM_CHUNK_TOKENS * CHARS_PER_TOKEN
+        for i in range(0, len(content), chunk_chars):
+            time.sleep(STREAM_CHUNK_TOKENS / self.tokens_per_second)
+            yield FakeMessage(content[i:i + chunk_chars])
+        yield FakeMessage("", self.metadata(prompt_tokens, estimate_tokens(content)))
+
+
+# Builds one FakeChatModel per (model, temperature, num_ctx, endpoint, timeout) for LLMClientRegistry.client_factory,
+# counting calls across all of them and per endpoint. The timeout is not simulated.
+class FakeLLM:
+    def __init__(self, latency_s: float = 0.02, tokens_per_second: float = 2000, prefill_tokens_per_second: float = 20000):
+        self.latency_s = latency_s
+        self.tokens_per_second = tokens_per_second
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.counter = {"calls": 0}
+        self.endpoint_counters = {}
+
+    def __call__(self, model: str, temperature: float, num_ctx: int, base_url: str | None = None, timeout: float | None = None) -> FakeChatModel:
+        return FakeChatModel(model, self.latency_s, self.tokens_per_second, self.prefill_tokens_per_second, self.counter, self.endpoint_counters.setdefault(base_url, {"calls": 0}))
+
+    @property
+    def calls(self) -> int:
+        return self.counter["calls"]
+
+    @property
+    def calls_per_endpoint(self) -> dict:
+        return {str(base_url): counter["calls"] for base_url, counter in self.endpoint_counters.items()}
+
+
+# Stands in for the search agent's tool-calling model: one search, then a short answer from its results
+class FakeSearchModel:
+    def __init__(self, latency_s: float = 0.02):
+        self.latency_s = latency_s
+        self.calls = 0
+        self._ids = itertools.count()
+
+    def bind_tools(self, tools: list):
+        return self
+
+    async def ainvoke(self, messages: list):
+        from langchain_core.messages import AIMessage
+        self.calls += 1
+        await asyncio.sleep(self.latency_s)
+        if not any(getattr(message, "type", None) == "tool" for message in messages):
+            query = re.search(r"review/s of (.+?) and summarize", messages[0].content)
+            return AIMessage(content="", tool_calls=[{"name": "tavily_search", "args": {"query": f"{query.group(1) if query else 'car'} review"}, "id": f"call_{next(self._ids)}"}])
+        return AIMessage(content=filler_text(SUMMARY_TOKENS, "the model") + " (Example Motoring, 2025-08-01)")
+
+
+# Stands in for TavilySearch.invoke as search_cache's backend
+class FakeTavily:
+    def __init__(self, latency_s: float = 0.2, max_results: int = 3):
+        self.latency_s = latency_s
+        self.max_results = max_results
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, args: dict) -> dict:
+        with self._lock: self.calls += 1
+        time.sleep(self.latency_s)
+        query = args.get("query", "")
+        slug = re.sub(r"\W+", "-", query.lower()).strip("-")
+        return {"query": query, "results": [{"url": f"https://reviews.example.com/{slug}/{i}", "title": f"{query} #{i}", "content": filler_text(150, query), "score": 0.9} for i in range(self.max_results)]}
+
+
+# Serves SerpAPI's Google Maps Reviews responses for the reviews of `places` on 127.0.0.1, newest first and paginated
+# like the real API. Point SerpApiClient.base_url at `url`. `fail_statuses` are answered, in order, to the first
+# requests instead of a page (429 comes with `Retry-After: 0`), to exercise the client's retries.
+class FakeSerpApiServer:
+    def __init__(self, places: list[dict], latency_s: float = 0.1, page_size: int = 10, fail_statuses: list[int] | None = None):
+        self.latency_s = latency_s
+        self.page_size = page_size
+        self.fail_statuses = list(fail_statuses or [])
+        self.requests = 0
+        self.reviews = {}
+        for place in places:
+            if not place.get("data_id"): continue
+            reviews = [{"user": {"name": review.get("Name")}, "rating": review.get("Rating"), "snippet": review.get("Description"), "iso_date": review.get("When")} for review in place.get("user_reviews_extended") or []]
+            self.reviews[place["data_id"]] = sorted(reviews, key=lambda review: review["iso_date"] or "", reverse=True)
+        self._server = None
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/search.json"
+
+    def page(self, data_id: str, offset: int) -> dict:
+        reviews = self.reviews.get(data_id, [])
+        page = reviews[offset:offset + self.page_size]
+        response = {"search_metadata": {"status": "Success"}, "reviews": page}
+        if offset + self.page_size < len(reviews): response["serpapi_pagination"] = {"next_page_token": str(offset + self.page_size)}
+        return response
+
+    def __enter__(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                with fake._lock:
+                    fake.requests += 1
+                    status = fake.fail_statuses.pop(0) if fake.fail_statuses else None
+                time.sleep(fake.latency_s)
+                if status is not None:
+                    body = json.dumps({"error": f"Fake status {status}"}).encode("utf-8")
+                    self.send_response(status)
+                    if status == 429: self.send_header("Retry-After", "0")
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                    return
+                query = parse_qs(urlparse(self.path).query)
+                body = json.dumps(fake.page(query.get("data_id", [""])[0], int(query.get("next_page_token", ["0"])[0]))).encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
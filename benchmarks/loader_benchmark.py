@@ -0,0 +1,80 @@
+from algorithms import parse_json_lines, filter_dealerships, filter_keys, iter_places, PLACE_FIELDS
+import argparse, json, os, tempfile, time, tracemalloc
+
+# Compares the full-decode loader with the streaming projection loader.
+# Run from the repository root: python -m benchmarks.loader_benchmark
+
+CACHE_FILES = [
+    "./cache_data/LDV_places.jsonl",
+    "./cache_data/LDV_places_backup_2025-09-07_21-43.jsonl"
+]
+
+# What process_input did before iter_places: decode everything, then drop what isn't used
+def load_full(file_path: str) -> list[dict]:
+    return [filter_keys(place, PLACE_FIELDS) for place in filter_dealerships(parse_json_lines(file_path))]
+
+def load_streaming(file_path: str) -> list[dict]:
+    return list(iter_places(file_path, dealers_only=True))
+
+# Repeat every line of a cache file `factor` times to simulate national coverage
+def make_synthetic_file(source_path: str, factor: int, dir_path: str) -> str:
+    target_path = os.path.join(dir_path, f"synthetic_x{factor}.jsonl")
+    with open(source_path, "r", encoding="utf-8") as src:
+        lines = [line for line in src if line.strip()]
+    with open(target_path, "w", encoding="utf-8") as dst:
+        for _ in range(factor): dst.writelines(lines)
+    return target_path
+
+def measure(loader, file_path: str, repeats: int) -> dict:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        places = loader(file_path)
+        timings.append(time.perf_counter() - start)
+        del places
+
+    # Peak memory is measured on a separate run because tracemalloc slows allocation down
+    tracemalloc.start()
+    places = loader(file_path)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "places": len(places),
+        "best_seconds": round(min(timings), 4),
+        "peak_mib": round(peak / 2**20, 2)
+    }
+
+def run(repeats: int = 5, factor: int = 100) -> list[dict]:
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = [path for path in CACHE_FILES if os.path.exists(path)]
+        if files: files.append(make_synthetic_file(files[0], factor, tmp_dir))
+        for file_path in files:
+            size_mib = os.path.getsize(file_path) / 2**20
+            # The synthetic file takes long enough that one timed run is representative
+            file_repeats = 1 if size_mib > 10 else repeats
+            full = measure(load_full, file_path, file_repeats)
+            streaming = measure(load_streaming, file_path, file_repeats)
+            results.append({
+                "file": os.path.basename(file_path),
+                "size_mib": round(size_mib, 2),
+                "full": full,
+                "streaming": streaming,
+                "speedup": round(full["best_seconds"] / streaming["best_seconds"], 2) if streaming["best_seconds"] else None,
+                "memory_ratio": round(full["peak_mib"] / streaming["peak_mib"], 2) if streaming["peak_mib"] else None
+            })
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the JSONL place loaders")
+    parser.add_argument("-repeats", type=int, default=5, help="Timed runs per loader and file (best is reported)")
+    parser.add_argument("-factor", type=int, default=100, help="Scale factor of the synthetic file")
+    parser.add_argument("-json", type=str, default=None, help="Optional path to save the results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.repeats, args.factor)
+    print(f"{'file':<45} {'MiB':>7} {'full s':>8} {'stream s':>9} {'full MiB':>9} {'stream MiB':>11} {'speedup':>8} {'mem x':>6}")
+    for r in results:
+        print(f"{r['file']:<45} {r['size_mib']:>7} {r['full']['best_seconds']:>8} {r['streaming']['best_seconds']:>9} {r['full']['peak_mib']:>9} {r['streaming']['peak_mib']:>11} {r['speedup']:>8} {r['memory_ratio']:>6}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f: json.dump(results, f, indent=2)
@@ -0,0 +1,212 @@
+import argparse, json, os, platform, subprocess, sys, tempfile, time
+
+# Runs report.pipeline end to end with fake Ollama, Tavily and SerpAPI (see benchmarks/fakes.py), on the cached scrape
+# and on synthetic copies with 10x / 100x the dealerships and reviews. Reports per-stage wall time, peak RSS,
+# prompt sizes and model calls per run. No GPU or network is needed. Every scale runs in its own process, so
+# peak RSS is per run. Run from the repository root: python -m benchmarks.pipeline_benchmark -json results.json
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SOURCE_FILE = os.path.join(REPO_ROOT, "cache_data", "LDV_places.jsonl")
+DEFAULT_SCALES = [1, 10, 100]
+# The cached scrape ends in September 2025; most of its dated reviews fall in the 15 months before that
+DEFAULT_FROM, DEFAULT_TO = "2024-07-01", "2025-09-30"
+
+# Copy every place `factor` times; copies get their own cid, data_id and title so they count as separate dealerships
+def make_synthetic_file(source_path: str, factor: int, target_path: str) -> str:
+    with open(source_path, "r", encoding="utf-8") as src, open(target_path, "w", encoding="utf-8") as dst:
+        for line in src:
+            if not line.strip(): continue
+            place = json.loads(line)
+            for i in range(factor):
+                copy = place if i == 0 else {**place, "title": f"{place.get('title')} #{i}", "cid": f"{place.get('cid')}-{i}", "data_id": f"{place.get('data_id')}-{i}" if place.get("data_id") else None}
+                dst.write(json.dumps(copy, ensure_ascii=False) + "\n")
+    return target_path
+
+def count_places(file_path: str) -> dict:
+    places = reviews = 0
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip(): continue
+            places += 1
+            reviews += len(json.loads(line).get("user_reviews_extended") or [])
+    return {"places": places, "reviews": reviews}
+
+# ru_maxrss is KiB on Linux and bytes on macOS; not available on Windows
+def peak_rss_mib() -> float | None:
+    try: import resource
+    except ImportError: return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (2**20 if sys.platform == "darwin" else 2**10), 1)
+
+def noop_make_pdf(month: str | int, md: str, client: str | None = None) -> str:
+    return f"./reports/{client or 'report'}_{month}_benchmark.pdf"
+
+# One pipeline run in this process, with the fakes in place. Every cache and run artifact goes to `work_dir`.
+def run_one(file_path: str, work_dir: str, args: argparse.Namespace) -> dict:
+    sys.path.insert(0, REPO_ROOT)
+    os.environ.setdefault("TAVILY_API_KEY", "benchmark")
+    from benchmarks.fakes import FakeLLM, FakeSearchModel, FakeTavily, FakeSerpApiServer
+    from contextlib import redirect_stdout
+    from review_store import parse_period_args, previous_period
+    from algorithms import backfill_reviews_with_serpapi
+    from llm_clients import llm_clients
+    from search_cache import search_cache
+    from api_queries import serpapi_client
+    from prompt_encoding import prompt_accounting
+    from run_store import PipelineRun, latest_run_id
+    from model_routing import model_router, load_routing
+    import ai_chat_models, ai_search_agent, report
+
+    fake_llm = FakeLLM(args.llm_latency, args.llm_tps, args.llm_prefill_tps)
+    fake_tavily = FakeTavily(args.search_latency)
+    fake_search_model = FakeSearchModel(args.llm_latency)
+    llm_clients.client_factory = fake_llm
+    search_cache.backend = fake_tavily
+    ai_search_agent.get_search_model = lambda base_url=None: fake_search_model
+    ai_chat_models.get_google_model = lambda model, temperature, timeout=None: fake_llm(model, temperature, 0)
+    if not args.real_pdf: report.make_pdf = noop_make_pdf
+    period = parse_period_args(date_from=args.date_from, date_to=args.date_to)
+
+    os.makedirs(os.path.join(work_dir, "reports"), exist_ok=True)
+    os.chdir(work_dir)
+    result = {**count_places(file_path)}
+    with open("pipeline.log", "w", encoding="utf-8") as log, redirect_stdout(log):
+        #* SerpAPI backfill of every place, as if the scraper had returned them without reviews
+        if args.serpapi:
+            with open(file_path, "r", encoding="utf-8") as f: places = [json.loads(line) for line in f if line.strip()]
+            with FakeSerpApiServer(places, args.serpapi_latency) as server:
+                serpapi_client.base_url, serpapi_client.api_key = server.url, "benchmark"
+                serpapi_client.max_workers, serpapi_client.requests_per_second = args.serpapi_workers, args.serpapi_rate
+                for place in places: place["user_reviews_extended"] = []
+                start = time.perf_counter()
+                backfill_reviews_with_serpapi(places, previous_period(period).start)
+                result["serpapi_backfill"] = {"seconds": round(time.perf_counter() - start, 4), "requests": server.requests, "reviews": sum(len(place["user_reviews_extended"]) for place in places)}
+
+        # A failing run is still reported, with the stages it completed and the error
+        start = time.perf_counter()
+        try:
+            run_id = report.pipeline(
+                file_path=file_path,
+                reuse_cache=True,
+                period=period,
+                search_car_models=args.car_models,
+                summary_workers=args.summary_workers,
+                use_llm_cache=False,
+                car_model_workers=args.car_model_workers,
+                max_llm_requests=args.max_llm_requests,
+                # Fake endpoints only name the fake model clients; the model calls go through the SQLite job queue
+                ollama_hosts=[(f"http://fake-ollama-{i}:11434", args.host_slots) for i in range(args.hosts)] or None,
+                routing=load_routing(args.routing) if args.routing else None
+            )
+        except Exception as e:
+            run_id, result["error"] = latest_run_id(), f"{type(e).__name__}: {e}"
+        wall_seconds = time.perf_counter() - start
+
+    run = PipelineRun(run_id)
+    prompts = prompt_accounting.summary()
+    return {
+        **result,
+        "dealers": len(run.load("input")) if run.has("input") else None,
+        "wall_s": round(wall_seconds, 4),
+        "stages_s": run.stage_seconds(),
+        "peak_rss_mib": peak_rss_mib(),
+        "llm_calls": fake_llm.calls,
+        "llm_calls_per_endpoint": fake_llm.calls_per_endpoint,
+        "prompt_tokens": sum(stage["input_tokens"] for stage in prompts.values()),
+        "prompts": prompts,
+        "llm_timings": llm_clients.timing_summary(),
+        "models": model_router.summary(),
+        "search": {"agent_model_calls": fake_search_model.calls, "tavily_calls": fake_tavily.calls, **search_cache.stats()}
+    }
+
+# Options forwarded from the parent to every child run
+FORWARDED = ["llm_latency", "llm_tps", "llm_prefill_tps", "search_latency", "serpapi_latency", "serpapi_workers", "serpapi_rate", "summary_workers", "car_model_workers", "max_llm_requests", "hosts", "host_slots", "routing", "date_from", "date_to"]
+FLAGS = ["car_models", "serpapi", "real_pdf"]
+FLAG_NAMES = {"date_from": "-from", "date_to": "-to"}
+
+def child_args(args: argparse.Namespace) -> list[str]:
+    forwarded = []
+    for name in FORWARDED:
+        value = getattr(args, name)
+        if value is not None: forwarded += [FLAG_NAMES.get(name, f"-{name.replace('_', '-')}"), str(value)]
+    return forwarded + [f"-{name.replace('_', '-')}" for name in FLAGS if getattr(args, name)]
+
+def run(args: argparse.Namespace) -> list[dict]:
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for scale in args.scales:
+            file_path = args.source if scale == 1 else make_synthetic_file(args.source, scale, os.path.join(tmp_dir, f"synthetic_x{scale}.jsonl"))
+            work_dir = os.path.join(tmp_dir, f"run_x{scale}")
+            result_path = os.path.join(tmp_dir, f"result_x{scale}.json")
+            command = [sys.executable, "-m", "benchmarks.pipeline_benchmark", "-child", os.path.abspath(file_path), "-work-dir", work_dir, "-result", result_path, *child_args(args)]
+            completed = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True)
+            if completed.returncode != 0:
+                raise RuntimeError(f"Benchmark run x{scale} failed:\n{completed.stderr[-4000:]}")
+            with open(result_path, "r", encoding="utf-8") as f: results.append({"scale": scale, **json.load(f)})
+    return results
+
+# Pipeline wall time and stage times against a previous results file; returns the scales slower than max_regression
+# percent or failing, whether or not the baseline run failed too
+def compare(results: list[dict], baseline_path: str, max_regression: float) -> list[int]:
+    with open(baseline_path, "r", encoding="utf-8") as f: baseline = {r["scale"]: r for r in json.load(f)["runs"]}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result["scale"])
+        if previous is None:
+            if "error" in result: regressions.append(result["scale"])
+            continue
+        change = (result["wall_s"] - previous["wall_s"]) / previous["wall_s"] * 100 if previous["wall_s"] else 0.0
+        stages = ", ".join(f"{stage} {previous['stages_s'].get(stage)} -> {seconds}" for stage, seconds in result["stages_s"].items())
+        print(f"x{result['scale']}: {previous['wall_s']}s -> {result['wall_s']}s ({change:+.1f}%) | {stages}")
+        if change > max_regression or "error" in result: regressions.append(result["scale"])
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark report.pipeline offline with fake Ollama, Tavily and SerpAPI")
+    parser.add_argument("-scales", type=lambda value: [int(scale) for scale in value.split(",")], default=DEFAULT_SCALES, help="Comma-separated scale factors of the dealerships and reviews (1 is the cached scrape as is)")
+    parser.add_argument("-source", type=str, default=SOURCE_FILE, help="Scrape file the runs are built from")
+    parser.add_argument("-from", dest="date_from", type=str, default=DEFAULT_FROM, help="Report period start (YYYY-MM-DD)")
+    parser.add_argument("-to", dest="date_to", type=str, default=DEFAULT_TO, help="Report period end (YYYY-MM-DD)")
+    parser.add_argument("-llm-latency", type=float, default=0.02, help="Fake model latency per call in seconds")
+    parser.add_argument("-llm-tps", type=float, default=2000, help="Fake model generation speed in tokens/sec")
+    parser.add_argument("-llm-prefill-tps", type=float, default=20000, help="Fake model prompt processing speed in tokens/sec")
+    parser.add_argument("-search-latency", type=float, default=0.2, help="Fake Tavily latency per search in seconds")
+    parser.add_argument("-serpapi-latency", type=float, default=0.1, help="Fake SerpAPI latency per page in seconds")
+    parser.add_argument("-serpapi-workers", type=int, default=4, help="Concurrent SerpAPI requests in the backfill")
+    parser.add_argument("-serpapi-rate", type=float, default=0, help="SerpAPI requests per second in the backfill (0 is unlimited)")
+    parser.add_argument("-summary-workers", type=int, default=4, help="Parallel review summaries")
+    parser.add_argument("-car-model-workers", type=int, default=4, help="Car models searched at once")
+    parser.add_argument("-max-llm-requests", type=int, default=None, help="Model requests at once across all stages")
+    parser.add_argument("-hosts", type=int, default=0, help="Fake Ollama endpoints served through the job queue (0 calls the model directly)")
+    parser.add_argument("-host-slots", type=int, default=2, help="Jobs each fake endpoint runs at once")
+    parser.add_argument("-routing", type=os.path.abspath, default=None, help="Model routing file (see model_routing.py); every model tier is served by the fake model")
+    parser.add_argument("-car-models", action="store_true", help="Include the car model search and analysis stages")
+    parser.add_argument("-serpapi", action="store_true", help="Also time a SerpAPI backfill of every place")
+    parser.add_argument("-real-pdf", action="store_true", help="Render the PDF with markdown-pdf instead of skipping it")
+    parser.add_argument("-json", type=str, default=None, help="Optional path to save the results as JSON")
+    parser.add_argument("-baseline", type=str, default=None, help="Previous results JSON to compare against")
+    parser.add_argument("-max-regression", type=float, default=20, help="With -baseline, exit with status 1 if a run is this many percent slower")
+    parser.add_argument("-child", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("-work-dir", type=str, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("-result", type=str, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        result = run_one(args.child, args.work_dir, args)
+        with open(args.result, "w", encoding="utf-8") as f: json.dump(result, f)
+        sys.exit(0)
+
+    results = run(args)
+    print(f"{'scale':>6} {'dealers':>8} {'reviews':>8} {'wall s':>8} {'RSS MiB':>8} {'LLM calls':>10} {'prompt tok':>11}  stages (s)")
+    for r in results:
+        stages = " ".join(f"{stage}={seconds}" for stage, seconds in r["stages_s"].items())
+        print(f"{'x' + str(r['scale']):>6} {r['dealers']:>8} {r['reviews']:>8} {r['wall_s']:>8} {r['peak_rss_mib']:>8} {r['llm_calls']:>10} {r['prompt_tokens']:>11}  {stages}")
+        if "serpapi_backfill" in r: print(f"{'':>6} SerpAPI backfill: {r['serpapi_backfill']}")
+        if "error" in r: print(f"{'':>6} FAILED: {r['error']}")
+    if args.json:
+        options = {name: getattr(args, name) for name in FORWARDED + FLAGS + ["scales", "source"]}
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(), "platform": platform.platform(), "options": options, "runs": results}, f, indent=2)
+    # A failing run fails the benchmark, with or without a baseline
+    failed = any("error" in r for r in results)
+    if (args.baseline and compare(results, args.baseline, args.max_regression)) or failed: sys.exit(1)
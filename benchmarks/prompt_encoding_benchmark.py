@@ -0,0 +1,35 @@
+from algorithms import load_review_store
+from prompt_encoding import compare_encodings
+from review_store import custom_period
+import argparse, json
+
+# Prompt size of the step 1 and step 2 inputs under each encoding, on the cached scrape.
+# Run from the repository root: python -m benchmarks.prompt_encoding_benchmark
+
+def run(file_path: str, date_from: str, date_to: str) -> dict:
+    dealers = load_review_store(file_path, reuse_cache=True).query(custom_period(date_from, date_to))
+    totals = {}
+    for dealer in dealers:
+        for name, size in compare_encodings(dealer["user_reviews_extended"]).items():
+            total = totals.setdefault(name, {"chars": 0, "tokens": 0})
+            total["chars"] += size["chars"]
+            total["tokens"] += size["tokens"]
+
+    # Step 2 sends the dealer rows with a summary in place of the reviews; a fixed placeholder keeps it offline
+    dealer_rows = [{**{key: value for key, value in dealer.items() if key != "user_reviews_extended"}, "review_summary": "Placeholder summary of about twenty words describing service, staff and purchase experience at this dealership."} for dealer in dealers]
+    return {"review_summary_inputs": totals, "reviews_analysis_input": compare_encodings(dealer_rows)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare prompt encodings on cached review data")
+    parser.add_argument("-scrape_dir", type=str, default="./cache_data/LDV_places.jsonl")
+    parser.add_argument("-from", dest="date_from", type=str, default="2000-01-01")
+    parser.add_argument("-to", dest="date_to", type=str, default="2100-01-01")
+    args = parser.parse_args()
+
+    results = run(args.scrape_dir, args.date_from, args.date_to)
+    for stage, sizes in results.items():
+        baseline = sizes["python_repr"]["tokens"]
+        print(stage)
+        for name, size in sizes.items():
+            print(f"  {name:<12} {size['chars']:>9} chars {size['tokens']:>8} tokens ({size['tokens'] / baseline:.0%} of repr)")
+    print(json.dumps(results))
@@ -0,0 +1,49 @@
+import argparse, json, subprocess, sys, time
+
+# Measures CLI startup: wall time of `main.py -h` and `import report`, plus the slowest imports
+# reported by `python -X importtime`. Run from the repository root: python -m benchmarks.startup_benchmark
+
+def wall_time(args: list[str], repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, *args], capture_output=True, check=True)
+        timings.append(time.perf_counter() - start)
+    return round(min(timings), 4)
+
+# Parse `-X importtime` stderr lines: "import time: self [us] | cumulative | imported package"
+def import_times(module: str) -> list[dict]:
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], capture_output=True, text=True, check=True)
+    entries = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line: continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        entries.append({"module": name.strip(), "depth": (len(name) - len(name.lstrip())) // 2, "self_ms": int(self_us) / 1000, "cumulative_ms": int(cumulative_us) / 1000})
+    return entries
+
+def run(repeats: int = 5, top: int = 10) -> dict:
+    imports = import_times("report")
+    top_level = [entry for entry in imports if entry["depth"] == 0]
+    # Direct imports of the repo modules show which dependency is responsible for the time
+    direct = [entry for entry in imports if entry["depth"] == 1]
+    return {
+        "main_help_seconds": wall_time(["main.py", "-h"], repeats),
+        "import_report_seconds": wall_time(["-c", "import report"], repeats),
+        "import_report_total_ms": round(sum(entry["cumulative_ms"] for entry in top_level), 2),
+        "slowest_imports": sorted(direct, key=lambda entry: entry["cumulative_ms"], reverse=True)[:top]
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark CLI startup and import time")
+    parser.add_argument("-repeats", type=int, default=5, help="Runs per wall-time measurement (best is reported)")
+    parser.add_argument("-top", type=int, default=10, help="Number of slowest direct imports to list")
+    parser.add_argument("-json", type=str, default=None, help="Optional path to save the results as JSON")
+    args = parser.parse_args()
+
+    results = run(args.repeats, args.top)
+    print(f"main.py -h:     {results['main_help_seconds']}s")
+    print(f"import report:  {results['import_report_seconds']}s ({results['import_report_total_ms']} ms in imports)")
+    for entry in results["slowest_imports"]:
+        print(f"  {entry['cumulative_ms']:>9.2f} ms  {entry['module']}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f: json.dump(results, f, indent=2)
@@ -0,0 +1,378 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Callable, Iterator
+from tracing import tracer
+import argparse, importlib, json, os, socket, sqlite3, threading, time, uuid
+
+# Durable queue of model calls in SQLite, served by workers spread over several Ollama endpoints.
+# The pipeline submits every summary, analysis and search-agent call as a job and waits for its result; workers
+# (threads in the pipeline process, or `python job_queue.py` processes) lease jobs for one endpoint at a time.
+# A worker renews the leases of its running jobs with a heartbeat, up to the job's run time limit. A job whose lease
+# runs out (its worker crashed, or it hung past its limit) goes back to the queue for any worker, and a failed job is
+# retried with backoff up to JOB_MAX_ATTEMPTS.
+# Running jobs per endpoint are counted in the database, so an endpoint's limit holds across worker processes.
+# Workers, and runs waiting on their jobs, record that they are alive. A caller gives up on a job that no live worker
+# could run, and queued jobs of a run that stopped waiting (it crashed or was killed) are cancelled, not run.
+
+JOB_QUEUE_PATH = "./cache_data/llm_jobs.db"
+LEASE_SECONDS = 60
+HEARTBEAT_SECONDS = 15
+JOB_MAX_ATTEMPTS = 3
+# Run time limit of a job that sets none: its lease is no longer renewed after this long
+JOB_MAX_SECONDS = 30 * 60
+RETRY_BACKOFF_SECONDS = 2
+# How often idle workers and waiting callers check the database for jobs from other processes
+POLL_SECONDS = 0.1
+# A worker or run not seen for this long is gone
+STALE_SECONDS = 4 * HEARTBEAT_SECONDS
+# How long a queued job waits for a live worker before its caller gives up
+NO_WORKER_SECONDS = 60
+# Finished jobs are kept this long for `python job_queue.py -stats`
+JOB_RETENTION_DAYS = 7
+
+# "http://gpu1:11434=2,http://gpu2:11434" -> [("http://gpu1:11434", 2), ("http://gpu2:11434", 1)].
+# The number after "=" is how many jobs the endpoint runs at once; match it to its OLLAMA_NUM_PARALLEL.
+def parse_endpoints(value: str | None) -> list[tuple[str, int]]:
+    endpoints = []
+    for entry in (value or "").split(","):
+        if not entry.strip(): continue
+        url, _, slots = entry.strip().rpartition("=") if "=" in entry else (entry.strip(), "", "1")
+        if not slots.isdigit() or int(slots) < 1: raise ValueError(f"Invalid endpoint {entry!r}. Expected URL or URL=slots with slots at least 1")
+        endpoints.append((url if "://" in url else f"http://{url}", int(slots)))
+    return endpoints
+
+OLLAMA_ENDPOINTS = os.getenv("OLLAMA_ENDPOINTS")
+
+class JobFailed(RuntimeError):
+    pass
+
+# "module:function" of a job runner, called as runner(payload, endpoint_url) and returning a JSON-serializable result
+def resolve_runner(name: str) -> Callable[[dict, str], dict]:
+    module, _, function = name.partition(":")
+    return getattr(importlib.import_module(module), function)
+
+
+class JobQueue:
+    def __init__(self, path: str = JOB_QUEUE_PATH, lease_seconds: float = LEASE_SECONDS, max_attempts: int = JOB_MAX_ATTEMPTS, enabled: bool = False, stale_seconds: float = STALE_SECONDS, no_worker_seconds: float = NO_WORKER_SECONDS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.stale_seconds = stale_seconds
+        self.no_worker_seconds = no_worker_seconds
+        # Tags the jobs this process submits; a new one per configure()
+        self.run_id = uuid.uuid4().hex[:12]
+        self._run_seen_at = 0
+        # Off by default: model calls then go straight to the single Ollama host of llm_clients
+        self.enabled = enabled
+        self.local_worker = None
+        # Wakes waiting callers and idle workers of this process as soon as a job is submitted or finishes
+        self._changed = threading.Condition()
+        self._initialized = False
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        if not self._initialized: os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            if not self._initialized:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    runner TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    max_attempts INTEGER NOT NULL,
+                    available_at REAL NOT NULL,
+                    host TEXT,
+                    worker TEXT,
+                    lease_expires_at REAL,
+                    started_at REAL,
+                    seconds REAL,
+                    result TEXT,
+                    error TEXT,
+                    created_at TEXT NOT NULL,
+                    finished_at TEXT,
+                    run_id TEXT,
+                    max_seconds REAL
+                )""")
+                # Databases from before run ids and run time limits
+                columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+                for column, column_type in [("run_id", "TEXT"), ("max_seconds", "REAL")]:
+                    if column not in columns: conn.execute(f"ALTER TABLE jobs ADD COLUMN {column} {column_type}")
+                conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, available_at)")
+                conn.execute("CREATE TABLE IF NOT EXISTS workers (id TEXT PRIMARY KEY, endpoints TEXT NOT NULL, last_seen REAL NOT NULL)")
+                conn.execute("CREATE TABLE IF NOT EXISTS runs (id TEXT PRIMARY KEY, last_seen REAL NOT NULL)")
+                self._initialized = True
+            with conn: yield conn
+        finally:
+            conn.close()
+
+    def notify(self) -> None:
+        with self._changed: self._changed.notify_all()
+
+    def wait_for_change(self, seconds: float = POLL_SECONDS) -> None:
+        with self._changed: self._changed.wait(seconds)
+
+    # Record that this process's run is still waiting on its jobs, at most every quarter of stale_seconds
+    def _touch_run(self, conn: sqlite3.Connection, force: bool = False) -> None:
+        now = time.time()
+        if not force and now - self._run_seen_at < self.stale_seconds / 4: return
+        conn.execute("INSERT OR REPLACE INTO runs (id, last_seen) VALUES (?, ?)", (self.run_id, now))
+        self._run_seen_at = now
+
+    # `max_seconds` limits each attempt's run time (default JOB_MAX_SECONDS)
+    def submit(self, runner: str, payload: dict, max_attempts: int | None = None, max_seconds: float | None = None) -> int:
+        with self._connect() as conn:
+            self._touch_run(conn)
+            job_id = conn.execute(
+                "INSERT INTO jobs (runner, payload, status, max_attempts, available_at, created_at, run_id, max_seconds) VALUES (?, ?, 'queued', ?, ?, ?, ?, ?)",
+                (runner, json.dumps(payload, ensure_ascii=False), max_attempts or self.max_attempts, time.time(), datetime.now().isoformat(timespec="seconds"), self.run_id, max_seconds or JOB_MAX_SECONDS)
+            ).lastrowid
+        self.notify()
+        return job_id
+
+    # Claim the oldest available job for `host` if it runs fewer than `slots` jobs. Expired leases are released and
+    # orphaned jobs cancelled first.
+    def lease(self, worker: str, host: str, slots: int) -> dict | None:
+        with self._connect() as conn:
+            now = time.time()
+            # Idle workers poll often, so only take the write lock when there is something to claim or release
+            if conn.execute("SELECT 1 FROM jobs WHERE (status = 'queued' AND available_at <= ?) OR (status = 'running' AND lease_expires_at < ?) LIMIT 1", (now, now)).fetchone() is None: return None
+            conn.execute("BEGIN IMMEDIATE")
+            self._release_expired(conn, now)
+            self._cancel_orphans(conn, now)
+            running = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'running' AND host = ?", (host,)).fetchone()[0]
+            if running >= slots: return None
+            row = conn.execute("SELECT id, runner, payload, attempts FROM jobs WHERE status = 'queued' AND available_at <= ? ORDER BY id LIMIT 1", (now,)).fetchone()
+            if row is None: return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', host = ?, worker = ?, attempts = attempts + 1, lease_expires_at = ?, started_at = ? WHERE id = ?",
+                (host, worker, now + self.lease_seconds, now, row[0])
+            )
+        return {"id": row[0], "runner": row[1], "payload": json.loads(row[2]), "attempt": row[3] + 1, "host": host}
+
+    def _release_expired(self, conn: sqlite3.Connection, now: float) -> None:
+        conn.execute(
+            """UPDATE jobs SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+                error = 'Lease expired on ' || host || ' (worker ' || worker || ')', available_at = ?,
+                finished_at = CASE WHEN attempts >= max_attempts THEN ? ELSE NULL END
+            WHERE status = 'running' AND lease_expires_at < ?""",
+            (now, datetime.now().isoformat(timespec="seconds"), now)
+        )
+
+    # Queued jobs of runs no longer waiting on them (jobs from before run ids included). Running ones are left to finish.
+    def _cancel_orphans(self, conn: sqlite3.Connection, now: float) -> int:
+        return conn.execute(
+            """UPDATE jobs SET status = 'cancelled', error = 'Run ' || COALESCE(run_id, '(none)') || ' stopped waiting', finished_at = ?
+            WHERE status = 'queued' AND (run_id IS NULL OR run_id NOT IN (SELECT id FROM runs WHERE last_seen >= ?))""",
+            (datetime.now().isoformat(timespec="seconds"), now - self.stale_seconds)
+        ).rowcount
+
+    def cancel_orphans(self) -> int:
+        with self._connect() as conn: return self._cancel_orphans(conn, time.time())
+
+    def register_worker(self, worker: str, endpoints: list[tuple[str, int]]) -> None:
+        with self._connect() as conn: conn.execute("INSERT OR REPLACE INTO workers (id, endpoints, last_seen) VALUES (?, ?, ?)", (worker, json.dumps(endpoints), time.time()))
+
+    def remove_worker(self, worker: str) -> None:
+        with self._connect() as conn: conn.execute("DELETE FROM workers WHERE id = ?", (worker,))
+
+    def live_workers(self) -> dict[str, list]:
+        with self._connect() as conn:
+            return {worker: json.loads(endpoints) for worker, endpoints in conn.execute("SELECT id, endpoints FROM workers WHERE last_seen >= ?", (time.time() - self.stale_seconds,))}
+
+    # URLs of the Ollama endpoints jobs can run on: the local worker's and every live worker's. Empty when the queue is off.
+    def hosts(self) -> list[str]:
+        if not self.enabled: return []
+        endpoints = list(self.local_worker.endpoints) if self.local_worker is not None else []
+        for worker_endpoints in self.live_workers().values(): endpoints += worker_endpoints
+        return list(dict.fromkeys(url for url, _ in endpoints))
+
+    # Record that the worker is alive and extend the leases of its running jobs, except those past their run time
+    # limit: a hung job then loses its lease like a crashed worker's. Returns the ids it still holds.
+    def heartbeat(self, worker: str, job_ids: list[int]) -> list[int]:
+        with self._connect() as conn: conn.execute("UPDATE workers SET last_seen = ? WHERE id = ?", (time.time(), worker))
+        if not job_ids: return []
+        marks = ",".join("?" * len(job_ids))
+        with self._connect() as conn:
+            now = time.time()
+            conn.execute(f"UPDATE jobs SET lease_expires_at = ? WHERE worker = ? AND status = 'running' AND (max_seconds IS NULL OR started_at + max_seconds > ?) AND id IN ({marks})", (now + self.lease_seconds, worker, now, *job_ids))
+            return [row[0] for row in conn.execute(f"SELECT id FROM jobs WHERE worker = ? AND status = 'running' AND id IN ({marks})", (worker, *job_ids))]
+
+    # Store the result unless the lease was lost (the job then belongs to another worker). Returns whether it was stored.
+    def complete(self, job_id: int, worker: str, result: dict) -> bool:
+        with self._connect() as conn:
+            stored = conn.execute(
+                "UPDATE jobs SET status = 'done', result = ?, error = NULL, seconds = ? - started_at, finished_at = ? WHERE id = ? AND worker = ? AND status = 'running'",
+                (json.dumps(result, ensure_ascii=False), time.time(), datetime.now().isoformat(timespec="seconds"), job_id, worker)
+            ).rowcount == 1
+        self.notify()
+        return stored
+
+    # Queue the job again after a backoff that doubles per attempt, or fail it after its last attempt
+    def fail(self, job_id: int, worker: str, error: str) -> None:
+        with self._connect() as conn:
+            row = conn.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ? AND worker = ? AND status = 'running'", (job_id, worker)).fetchone()
+            if row is None: return
+            attempts, max_attempts = row
+            if attempts >= max_attempts:
+                conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ? WHERE id = ?", (error, datetime.now().isoformat(timespec="seconds"), job_id))
+            else:
+                conn.execute("UPDATE jobs SET status = 'queued', error = ?, available_at = ? WHERE id = ?", (error, time.time() + RETRY_BACKOFF_SECONDS * 2 ** (attempts - 1), job_id))
+        self.notify()
+
+    # A queued job is dropped; a running one finishes but its result is no longer waited for
+    def cancel(self, job_id: int) -> None:
+        with self._connect() as conn:
+            conn.execute("UPDATE jobs SET status = 'cancelled', finished_at = ? WHERE id = ? AND status = 'queued'", (datetime.now().isoformat(timespec="seconds"), job_id))
+
+    # Block until the job finishes. Returns its result and the endpoint that ran it; raises JobFailed or TimeoutError.
+    # Gives up (JobFailed) once the job has been queued for no_worker_seconds without any live worker.
+    def wait(self, job_id: int, timeout: float | None = None) -> tuple[dict, str]:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        no_worker_since = None
+        select = "SELECT status, result, error, host, attempts, lease_expires_at FROM jobs WHERE id = ?"
+        while True:
+            with self._connect() as conn:
+                self._touch_run(conn)
+                status, result, error, host, attempts, lease_expires_at = conn.execute(select, (job_id,)).fetchone()
+                # Release it here too: with its worker gone, there may be no worker left to call lease()
+                if status == "running" and lease_expires_at < time.time():
+                    self._release_expired(conn, time.time())
+                    status, result, error, host, attempts, lease_expires_at = conn.execute(select, (job_id,)).fetchone()
+                workers = conn.execute("SELECT COUNT(*) FROM workers WHERE last_seen >= ?", (time.time() - self.stale_seconds,)).fetchone()[0] if status == "queued" else 1
+            if status == "done": return json.loads(result), host
+            if status in ["failed", "cancelled"]: raise JobFailed(f"Job {job_id} {status} after {attempts} attempts: {error}")
+            if deadline is not None and time.monotonic() >= deadline:
+                self.cancel(job_id)
+                raise TimeoutError(f"Job {job_id} did not finish within {timeout}s")
+            no_worker_since = None if workers else no_worker_since or time.monotonic()
+            if no_worker_since is not None and time.monotonic() - no_worker_since >= self.no_worker_seconds:
+                self.cancel(job_id)
+                raise JobFailed(f"Job {job_id} cancelled: no job queue worker was alive for {self.no_worker_seconds}s. Start one with `python job_queue.py -endpoints ...`")
+            self.wait_for_change(POLL_SECONDS if deadline is None else min(POLL_SECONDS, max(deadline - time.monotonic(), 0)))
+
+    # Submit and wait, as one traced step of the caller
+    def run(self, runner: str, payload: dict, timeout: float | None = None, max_attempts: int | None = None, max_seconds: float | None = None) -> dict:
+        with tracer.span("queue.job", runner=runner) as span:
+            job_id = self.submit(runner, payload, max_attempts, max_seconds)
+            span.set(job_id=job_id)
+            result, host = self.wait(job_id, timeout)
+            span.set(host=host)
+            return result
+
+    # Jobs per status, and finished jobs, failures and mean run time per endpoint
+    def stats(self) -> dict:
+        with self._connect() as conn:
+            statuses = dict(conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+            hosts = {host: {"done": done, "failed": failed, "retried": retried, "mean_s": round(mean_s, 2) if mean_s is not None else None} for host, done, failed, retried, mean_s in conn.execute(
+                "SELECT host, SUM(status = 'done'), SUM(status = 'failed'), SUM(attempts > 1), AVG(seconds) FROM jobs WHERE host IS NOT NULL GROUP BY host"
+            )}
+        return {"jobs": statuses, "hosts": hosts, "workers": self.live_workers()}
+
+    def purge(self, days: float = JOB_RETENTION_DAYS) -> int:
+        cutoff = (datetime.now() - timedelta(days=days)).isoformat(timespec="seconds")
+        with self._connect() as conn:
+            for table in ["workers", "runs"]: conn.execute(f"DELETE FROM {table} WHERE last_seen < ?", (time.time() - days * 86400,))
+            return conn.execute("DELETE FROM jobs WHERE status IN ('done', 'failed', 'cancelled') AND finished_at < ?", (cutoff,)).rowcount
+
+    # Turn the queue on for this process, under a new run id. Jobs are run by a worker started here over `endpoints`, or,
+    # with `external_workers`, only by separate `python job_queue.py` processes. No endpoints and no external workers turns it off.
+    def configure(self, endpoints: list[tuple[str, int]] | None, external_workers: bool = False) -> None:
+        if self.local_worker is not None:
+            self.local_worker.stop()
+            self.local_worker = None
+        self.enabled = bool(endpoints) or external_workers
+        if not self.enabled: return
+        self.run_id = uuid.uuid4().hex[:12]
+        with self._connect() as conn: self._touch_run(conn, force=True)
+        self.purge()
+        cancelled = self.cancel_orphans()
+        if endpoints and not external_workers: self.local_worker = QueueWorker(self, endpoints).start()
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Job queue {self.path}: {'external workers' if external_workers else ', '.join(f'{url} ({slots} at once)' for url, slots in endpoints)}" + (f" ({cancelled} queued jobs of earlier runs cancelled)" if cancelled else ""))
+
+
+# Pulls jobs for every endpoint with one thread per slot, and renews the leases of the jobs it runs
+class QueueWorker:
+    def __init__(self, queue: JobQueue, endpoints: list[tuple[str, int]], worker_id: str | None = None, heartbeat_seconds: float = HEARTBEAT_SECONDS):
+        if not endpoints: raise ValueError("A worker needs at least one endpoint")
+        self.queue = queue
+        self.endpoints = endpoints
+        self.heartbeat_seconds = heartbeat_seconds
+        self.worker_id = worker_id or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._running = set()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def start(self) -> "QueueWorker":
+        self.queue.register_worker(self.worker_id, self.endpoints)
+        targets = [(self.run_slot, (url, slots)) for url, slots in self.endpoints for _ in range(slots)] + [(self.heartbeat, ())]
+        for target, args in targets:
+            thread = threading.Thread(target=target, args=args, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def stop(self, timeout: float | None = None) -> None:
+        self._stop.set()
+        self.queue.notify()
+        for thread in self._threads: thread.join(timeout)
+
+    def run_slot(self, host: str, slots: int) -> None:
+        while not self._stop.is_set():
+            try: job = self.queue.lease(self.worker_id, host, slots)
+            except sqlite3.OperationalError as e:
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Worker {self.worker_id} could not lease a job: {e}")
+                job = None
+            if job is None:
+                self.queue.wait_for_change()
+                continue
+            self.run_job(job)
+
+    def run_job(self, job: dict) -> None:
+        with self._lock: self._running.add(job["id"])
+        try:
+            result = resolve_runner(job["runner"])(job["payload"], job["host"])
+            self.queue.complete(job["id"], self.worker_id, result)
+        except Exception as e:
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Job {job['id']} failed on {job['host']} (attempt {job['attempt']}): {type(e).__name__}: {e}")
+            self.queue.fail(job["id"], self.worker_id, f"{type(e).__name__}: {e}")
+        finally:
+            with self._lock: self._running.discard(job["id"])
+
+    # Until stopped; then the worker is no longer counted as alive
+    def heartbeat(self) -> None:
+        while not self._stop.wait(self.heartbeat_seconds):
+            with self._lock: job_ids = list(self._running)
+            try: self.queue.heartbeat(self.worker_id, job_ids)
+            except sqlite3.OperationalError as e: print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Worker {self.worker_id} heartbeat failed: {e}")
+        try: self.queue.remove_worker(self.worker_id)
+        except sqlite3.OperationalError: pass
+
+    def run_forever(self) -> None:
+        self.start()
+        try:
+            while not self._stop.wait(1): pass
+        except KeyboardInterrupt: self.stop(timeout=5)
+
+
+# Shared instance used by ai_chat_models and ai_search_agent
+job_queue = JobQueue()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run model jobs from the job queue on one or more Ollama endpoints")
+    parser.add_argument("-endpoints", type=str, help="Comma-separated Ollama endpoints, each URL or URL=jobs at once (default: $OLLAMA_ENDPOINTS)", default=OLLAMA_ENDPOINTS)
+    parser.add_argument("-db", type=str, help="Job queue database", default=JOB_QUEUE_PATH)
+    parser.add_argument("-stats", action="store_true", help="Print the jobs per status and per endpoint, then exit")
+    args = parser.parse_args()
+
+    queue = JobQueue(args.db)
+    if args.stats: print(json.dumps(queue.stats(), indent=2))
+    else:
+        endpoints = parse_endpoints(args.endpoints)
+        if not endpoints: parser.error("-endpoints (or $OLLAMA_ENDPOINTS) is required")
+        worker = QueueWorker(queue, endpoints)
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Worker {worker.worker_id} serving {queue.path} on {', '.join(f'{url} ({slots} at once)' for url, slots in endpoints)}")
+        worker.run_forever()
@@ -0,0 +1,132 @@
+import json
+
+# Incremental check of a streamed JSON object answer, so a call can be aborted on the first token that
+# makes it invalid instead of after the whole generation. Only the top-level object is checked as it streams:
+# keys must be in the schema (or ignored) and each value must start with the schema's type. The full object is parsed
+# and checked once it closes.
+
+# Text allowed before the opening bracket besides whitespace and a ``` fence, e.g. "Here is the JSON:"
+MAX_PREFIX_CHARS = 40
+
+# First character of a JSON value of each schema type
+VALUE_STARTS = {str: '"', list: "[", dict: "{"}
+CLOSERS = {"{": "}", "[": "]"}
+
+class JSONStreamError(ValueError):
+    pass
+
+
+class JSONStreamValidator:
+    # `schema` maps every expected top-level key to its type (str, list, dict or anything else to skip the check).
+    # `ignored_keys` may also appear, with any value; the caller drops them.
+    def __init__(self, schema: dict[str, type], max_prefix_chars: int = MAX_PREFIX_CHARS, ignored_keys: list[str] | None = None):
+        self.schema = schema
+        self.ignored_keys = set(ignored_keys or [])
+        self.max_prefix_chars = max_prefix_chars
+        self.prefix = ""
+        self.text = []
+        self.stack = []
+        self.in_string = False
+        self.escaped = False
+        # Position inside the top-level object: key, colon, value, scalar (a number or literal value) or after_value
+        self.expect = "key"
+        self.key = None
+        self.key_chars = []
+        self.keys = []
+        self.done = False
+        self.trailing = ""
+
+    def feed(self, chunk: str) -> None:
+        for char in chunk: self.feed_char(char)
+
+    def feed_char(self, char: str) -> None:
+        if self.done:
+            self.trailing += char
+            return
+        if not self.stack:
+            if char == "{":
+                self.stack.append("{")
+                self.text.append(char)
+                return
+            self.prefix += char
+            # A ```json fence line is not prose
+            prose = "\n".join(line for line in self.prefix.splitlines() if not line.strip().startswith("```")).strip()
+            if len(prose) > self.max_prefix_chars: raise JSONStreamError(f"Output starts with prose instead of a JSON object: {prose[:80]!r}")
+            if char in "[}]": raise JSONStreamError(f"Output is not a JSON object (starts with {char!r})")
+            return
+
+        self.text.append(char)
+        top_level = len(self.stack) == 1
+        if self.in_string:
+            if self.escaped: self.escaped = False
+            elif char == "\\": self.escaped = True
+            elif char == '"':
+                self.in_string = False
+                if top_level and self.expect == "key": self.end_key()
+                elif top_level and self.expect == "value": self.expect = "after_value"
+            elif top_level and self.expect == "key": self.key_chars.append(char)
+            return
+
+        if top_level and char.isspace(): return
+        if top_level and self.expect == "key":
+            if char == '"': self.in_string = True
+            elif char == "}" and not self.keys: self.close("}")
+            else: raise JSONStreamError(f"Expected a key in the JSON object, got {char!r}")
+        elif top_level and self.expect == "colon":
+            if char != ":": raise JSONStreamError(f"Expected ':' after key '{self.key}', got {char!r}")
+            self.expect = "value"
+        elif top_level and self.expect == "value":
+            expected_start = VALUE_STARTS.get(self.schema.get(self.key))
+            if expected_start and char != expected_start:
+                raise JSONStreamError(f"Key '{self.key}' should be {self.schema[self.key].__name__}, got a value starting with {char!r}")
+            if char == '"': self.in_string = True
+            elif char in CLOSERS: self.stack.append(char)
+            elif char in ",}]": raise JSONStreamError(f"Key '{self.key}' has no value")
+            else: self.expect = "scalar"
+        elif top_level and self.expect in ["scalar", "after_value"]:
+            if char == ",": self.expect = "key"
+            elif char == "}": self.close("}")
+            elif self.expect == "after_value": raise JSONStreamError(f"Expected ',' or '}}' after the value of '{self.key}', got {char!r}")
+        # Inside a value: only brackets and strings are tracked
+        elif char == '"': self.in_string = True
+        elif char in CLOSERS: self.stack.append(char)
+        elif char in "}]": self.close(char)
+
+    def end_key(self) -> None:
+        self.key = "".join(self.key_chars)
+        self.key_chars = []
+        if self.key not in self.schema and self.key not in self.ignored_keys: raise JSONStreamError(f"Unexpected key '{self.key}' (expected {', '.join(self.schema)})")
+        if self.key in self.keys: raise JSONStreamError(f"Duplicate key '{self.key}'")
+        self.keys.append(self.key)
+        self.expect = "colon"
+
+    def close(self, char: str) -> None:
+        opener = self.stack.pop()
+        if CLOSERS[opener] != char: raise JSONStreamError(f"Mismatched {char!r} closing {opener!r}")
+        if len(self.stack) == 1: self.expect = "after_value"
+        elif not self.stack: self.done = True
+
+    # Non-whitespace text generated after the object closed, other than a closing ``` fence
+    @property
+    def trailing_chars(self) -> int:
+        return len(self.trailing.replace("```", "").strip())
+
+    # The object's JSON text once the stream has ended, after a full parse and check of every expected key
+    def result(self) -> str:
+        if not self.done:
+            raise JSONStreamError("Output ended before the JSON object was closed" if self.stack else "Output contains no JSON object")
+        text = "".join(self.text)
+        try: obj = json.loads(text, strict=False)
+        except json.JSONDecodeError as e: raise JSONStreamError(f"Invalid JSON: {e}")
+        missing = [key for key in self.schema if key not in obj]
+        if missing: raise JSONStreamError(f"Missing keys: {', '.join(missing)}")
+        for key, expected_type in self.schema.items():
+            if expected_type in VALUE_STARTS and not isinstance(obj[key], expected_type):
+                raise JSONStreamError(f"Key '{key}' should be {expected_type.__name__}")
+        return text
+
+# Validate a complete response (e.g. from the cache) the same way as a streamed one
+def parse_json_response(response: str, schema: dict[str, type], ignored_keys: list[str] | None = None) -> str:
+    validator = JSONStreamValidator(schema, ignored_keys=ignored_keys)
+    validator.feed(response)
+    return validator.result()
@@ -0,0 +1,91 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from typing import Iterator
+import hashlib, json, os, sqlite3, threading
+
+LLM_CACHE_PATH = "./cache_data/llm_cache.db"
+LLM_CACHE_MAX_ENTRIES = 5000
+LLM_CACHE_MAX_AGE_DAYS = 90
+
+# On-disk cache of model responses, keyed by a hash of everything that affects the output.
+# Only worth it because every stage runs with temperature=0, so the same inputs give the same answer.
+class LLMCache:
+    def __init__(self, path: str = LLM_CACHE_PATH, max_entries: int = LLM_CACHE_MAX_ENTRIES, max_age_days: int = LLM_CACHE_MAX_AGE_DAYS, enabled: bool = True):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    @staticmethod
+    def make_key(system_prompt: str, model: str, temperature: float, num_ctx: int, user_prompt: str) -> str:
+        payload = json.dumps([system_prompt, model, temperature, num_ctx, user_prompt], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # Open a short-lived connection per call so the cache can be used from worker threads
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        if not self._initialized: os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            if not self._initialized:
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("""CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    last_used_at TEXT NOT NULL
+                )""")
+                self._initialized = True
+            with conn: yield conn
+        finally:
+            conn.close()
+
+    def get(self, key: str) -> str | None:
+        if not self.enabled: return None
+        now = datetime.now()
+        cutoff = (now - timedelta(days=self.max_age_days)).isoformat()
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT response FROM llm_cache WHERE key = ? AND created_at >= ?", (key, cutoff)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE llm_cache SET last_used_at = ? WHERE key = ?", (now.isoformat(), key))
+            self.hits += 1
+            return row[0]
+
+    def set(self, key: str, model: str, response: str) -> None:
+        if not self.enabled: return
+        now = datetime.now().isoformat()
+        with self._lock, self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?)", (key, model, response, now, now))
+            self._evict(conn)
+
+    # Drop entries past max_age_days, then the least recently used ones beyond max_entries
+    def _evict(self, conn: sqlite3.Connection) -> None:
+        cutoff = (datetime.now() - timedelta(days=self.max_age_days)).isoformat()
+        conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (cutoff,))
+        conn.execute("""DELETE FROM llm_cache WHERE key NOT IN (
+            SELECT key FROM llm_cache ORDER BY last_used_at DESC LIMIT ?
+        )""", (self.max_entries,))
+
+    def clear(self) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM llm_cache")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0
+        }
+
+
+# Shared instance used by ai_chat_models
+llm_cache = LLMCache()
@@ -0,0 +1,133 @@
+from contextlib import contextmanager
+from datetime import datetime
+from token_budget import MIN_NUM_CTX
+from typing import Callable, Iterator
+import os, threading
+
+# Ollama takes a duration string ("30m") or a number of seconds (-1 keeps the model loaded forever)
+def parse_keep_alive(value: str | int) -> str | int:
+    if isinstance(value, str) and value.lstrip("-").isdigit(): return int(value)
+    return value
+
+# Ollama unloads a model 5 minutes after its last request by default, which is shorter than
+# a full pipeline run with the car-model search; keep it resident for the whole run instead.
+OLLAMA_KEEP_ALIVE = parse_keep_alive(os.getenv("OLLAMA_KEEP_ALIVE", "30m"))
+
+# One ChatOllama per (model, temperature, num_ctx, endpoint, timeout), reused across calls and threads so their HTTP
+# connections are pooled. Also records Ollama's own timings so model loads are visible apart from generation.
+# `client_factory(model, temperature, num_ctx, base_url, timeout)` replaces ChatOllama, e.g. with the fake model of the benchmarks.
+class LLMClientRegistry:
+    def __init__(self, keep_alive: str | int = OLLAMA_KEEP_ALIVE, base_url: str | None = os.getenv("OLLAMA_HOST"), min_num_ctx: int = MIN_NUM_CTX, max_concurrent_requests: int | None = None, client_factory: Callable | None = None):
+        self.keep_alive = keep_alive
+        self.base_url = base_url
+        self.client_factory = client_factory
+        # Raising this makes every stage share one context size, so Ollama never reloads the model to resize it
+        self.min_num_ctx = min_num_ctx
+        self.timings = []
+        self._clients = {}
+        self._lock = threading.Lock()
+        self.set_max_concurrent_requests(max_concurrent_requests)
+
+    # Every model request waits for a slot, so requests from all stages and batch jobs share one queue
+    # in front of Ollama. None leaves requests unlimited (each stage still bounds its own workers).
+    def set_max_concurrent_requests(self, max_concurrent_requests: int | None) -> None:
+        if max_concurrent_requests is not None and max_concurrent_requests < 1:
+            raise ValueError(f"max_concurrent_requests must be at least 1. Got {max_concurrent_requests}")
+        self.max_concurrent_requests = max_concurrent_requests
+        self._slots = threading.BoundedSemaphore(max_concurrent_requests) if max_concurrent_requests else None
+
+    @contextmanager
+    def request_slot(self) -> Iterator[None]:
+        slots = self._slots
+        if slots is None:
+            yield
+            return
+        with slots: yield
+
+    # `base_url` picks another Ollama endpoint than the default one (see job_queue.py), and `timeout` bounds each
+    # HTTP read in seconds so a stuck model fails over to its fallback (see model_routing.py)
+    def get(self, model: str, temperature: float, num_ctx: int, base_url: str | None = None, timeout: float | None = None):
+        base_url = base_url or self.base_url
+        key = (model, temperature, num_ctx, base_url, timeout)
+        with self._lock:
+            if key not in self._clients and self.client_factory is not None:
+                self._clients[key] = self.client_factory(model, temperature, num_ctx, base_url, timeout)
+            if key not in self._clients:
+                from langchain_ollama import ChatOllama
+                self._clients[key] = ChatOllama(
+                    model=model,
+                    temperature=temperature,
+                    num_ctx=num_ctx,
+                    keep_alive=self.keep_alive,
+                    base_url=base_url,
+                    client_kwargs={"timeout": timeout} if timeout else {}
+                )
+            return self._clients[key]
+
+    # Load the model with the given context size ahead of the first request, on `base_url` or the default endpoint.
+    # Returns Ollama's load time in seconds.
+    def preload(self, model: str, num_ctx: int, base_url: str | None = None) -> float:
+        from ollama import Client
+        response = Client(host=base_url or self.base_url).generate(model=model, prompt="", keep_alive=self.keep_alive, options={"num_ctx": num_ctx})
+        return (response.get("load_duration") or 0) / 1e9
+
+    # Preload in the background so the model load overlaps with reading and filtering the scrape
+    def preload_async(self, model: str, num_ctx: int, base_url: str | None = None) -> threading.Thread:
+        def run():
+            try: self.record_timing("preload", model, num_ctx, None, {"load_duration": self.preload(model, num_ctx, base_url) * 1e9})
+            except Exception as e: print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Could not preload {model} on {base_url or self.base_url or 'the default Ollama host'}: {e}")
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    # Ollama reports durations in nanoseconds in the response metadata. Streamed calls also pass the time to the
+    # first token and their chunk count, which stands in for eval_count when a stream was aborted before Ollama's totals.
+    def record_timing(self, stage: str, model: str, num_ctx: int, wall_seconds: float | None, metadata: dict, first_token_seconds: float | None = None, streamed_chunks: int = 0, aborted: bool = False) -> dict:
+        eval_count = metadata.get("eval_count") or 0
+        eval_seconds = (metadata.get("eval_duration") or 0) / 1e9
+        if eval_count and eval_seconds: tokens_per_second = eval_count / eval_seconds
+        elif streamed_chunks > 1 and wall_seconds and first_token_seconds is not None and wall_seconds > first_token_seconds:
+            tokens_per_second = (streamed_chunks - 1) / (wall_seconds - first_token_seconds)
+        else: tokens_per_second = None
+        entry = {
+            "stage": stage,
+            "model": model,
+            "num_ctx": num_ctx,
+            "wall_s": wall_seconds,
+            "load_s": (metadata.get("load_duration") or 0) / 1e9,
+            "prompt_eval_s": (metadata.get("prompt_eval_duration") or 0) / 1e9,
+            "eval_s": (metadata.get("eval_duration") or 0) / 1e9,
+            "prompt_tokens": metadata.get("prompt_eval_count") or 0,
+            "completion_tokens": eval_count or streamed_chunks,
+            "ttft_s": first_token_seconds,
+            "tokens_per_s": tokens_per_second,
+            "aborted": aborted
+        }
+        with self._lock: self.timings.append(entry)
+        return entry
+
+    def timing_summary(self) -> dict:
+        stages = {}
+        with self._lock: timings = list(self.timings)
+        for entry in timings:
+            stage = stages.setdefault(entry["stage"], {"calls": 0, "aborted": 0, "wall_s": 0.0, "load_s": 0.0, "prompt_eval_s": 0.0, "eval_s": 0.0, "completion_tokens": 0, "num_ctx": set(), "ttft_s": [], "tokens_per_s": []})
+            stage["calls"] += 1
+            stage["aborted"] += int(entry.get("aborted", False))
+            for key in ["wall_s", "load_s", "prompt_eval_s", "eval_s"]: stage[key] += entry[key] or 0.0
+            stage["completion_tokens"] += entry["completion_tokens"]
+            stage["num_ctx"].add(entry["num_ctx"])
+            for key in ["ttft_s", "tokens_per_s"]:
+                if entry.get(key) is not None: stage[key].append(entry[key])
+        for stage in stages.values():
+            for key in ["wall_s", "load_s", "prompt_eval_s", "eval_s"]: stage[key] = round(stage[key], 2)
+            stage["num_ctx"] = sorted(stage["num_ctx"])
+            # Mean over the calls that streamed
+            for key in ["ttft_s", "tokens_per_s"]: stage[key] = round(sum(stage[key]) / len(stage[key]), 2) if stage[key] else None
+        return stages
+
+    def reset_timings(self) -> None:
+        with self._lock: self.timings = []
+
+
+# Shared instance used by ai_chat_models
+llm_clients = LLMClientRegistry()
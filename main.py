@@ -1,37 +1,180 @@
 import argparse
-from report import pipeline
+from review_store import parse_period_args
+from llm_clients import OLLAMA_KEEP_ALIVE, parse_keep_alive
+from token_budget import MIN_NUM_CTX
+from search_cache import SEARCH_CACHE_TTL_HOURS
+from api_queries import SERPAPI_MAX_WORKERS, SERPAPI_REQUESTS_PER_SECOND
+from run_store import STAGES
+from job_queue import OLLAMA_ENDPOINTS, parse_endpoints
+from model_routing import MODEL_ROUTING_PATH, load_routing
 from datetime import datetime
 
 parser = argparse.ArgumentParser(
-        description="Generate LDV review report",
+        description="Generate dealership review reports",
         epilog="""
 Example usage:
     python main.py
     or
     python main.py -m 9 -reuse-cache -scrape_dir ./cache_data/LDV_places.jsonl
+    python main.py -q 3 -y 2025 -reuse-cache
+    python main.py -last-days 30 -reuse-cache
+    python main.py -from 2025-01-01 -to 2025-06-30 -reuse-cache
+    python main.py -batch jobs.json -reuse-cache
 
 Arguments:
     -m            Month as integer (1-12). Default is 'current' (uses current month).
+    -y            Year of the month or quarter. Default is the latest year in which it has started.
+    -q            Quarter as integer (1-4) instead of a month.
+    -last-days    Rolling period of the last N days up to today instead of a month.
+    -from, -to    Custom inclusive date range (YYYY-MM-DD) instead of a month.
     -reuse-cache  If set, reuses cached data for process_input. Default is False.
     -scrape_dir   Directory to scrape data from. Default is './cache_data/LDV_places.jsonl'.
     -include-car-models   If set, includes car models review in the report. Default is False.
+    -summary-workers      Number of dealership summaries requested from Ollama in parallel. Default is 4.
+                          Match it to the OLLAMA_NUM_PARALLEL setting of your Ollama host.
+    -no-llm-cache         If set, always calls the models instead of reusing cached responses. Default is False.
+    -no-incremental       If set, re-summarizes every dealership even when its reviews are unchanged since the last run. Default is False.
+    -keep-alive           How long Ollama keeps the model loaded after a request (e.g. 30m, -1 for forever). Default is 30m.
+    -min-num-ctx          Smallest context size for every call. Set it to the largest stage's size (e.g. 8192) so Ollama never reloads the model to resize it. Default is 1024.
+    -preload              If set, loads the model in the background while the scrape is being read. Default is False.
+    -car-model-workers    Number of car models searched at once with -include-car-models. Default is 4.
+    -car-model-timeout    Seconds before a single car model search is abandoned. Default is 180.
+    -search-cache-ttl     Hours a cached Tavily search result stays valid. Use 0 to always search again. Default is 168 (one week).
+    -serpapi-workers      Places whose reviews are backfilled from SerpAPI at the same time after a scrape. Default is 4.
+    -serpapi-rate         Maximum SerpAPI requests per second across all backfill workers. Use 0 for no limit. Default is 2.
+    -full-rescrape        Rebuild the scrape file from this scrape alone instead of merging new reviews into it. Default is False.
+    -resume               Run id (or "latest") of a previous run in ./cache_data/runs. Completed stages are loaded instead of rerun.
+    -from-stage           With -resume, rerun this stage and every stage after it.
+    -only-stage           With -resume, rerun only this stage (e.g. "pdf" to re-render the PDF, "analysis" to regenerate the analysis).
+                          Stages: input, metrics, summaries, analysis, car_reviews, models_analysis, report, pdf.
+    -client               Client (brand) named in the report. Default is 'LDV'.
+    -location             Location named in the report. Default is 'New South Wales, Australia'.
+    -max-llm-requests     Model requests sent to Ollama at once across all stages. Default is unlimited (4 in batch mode).
+    -batch                JSON file with a list of (client, location, file_path, period) jobs to run in one process.
+                          Each input file is loaded once and all jobs share one queue of model requests.
+                          Period flags, -client, -location, -scrape_dir and -include-car-models are ignored in batch mode.
+    -batch-workers        Number of batch jobs run at once. Default is 4.
+    -verbose              If set, prints every stage's full output (dealers input, analysis, car reviews, models analysis, markdown report). Default is False.
+    -metrics-dir          Directory where each run's Prometheus metrics are written (e.g. node_exporter's textfile collector directory).
+                          The trace (trace.jsonl) and metrics (metrics.prom) are always written to the run directory.
+    -ollama-hosts         Comma-separated Ollama endpoints, each URL or URL=jobs at once (e.g. http://gpu1:11434=2,http://gpu2:11434=2).
+                          Model calls and car model searches become jobs in ./cache_data/llm_jobs.db, run by workers over these endpoints.
+                          Default is $OLLAMA_ENDPOINTS, or a single Ollama host without the job queue.
+    -external-workers     If set, only queues the jobs; they are run by separate `python job_queue.py -endpoints ...` processes, and a job fails if none is alive for 60s. Default is False.
+    -routing              JSON file routing each model stage to a model tier, with an optional fallback tier and timeout (see README).
+                          E.g. review summaries on a fast model that falls back to qwen2.5:32b. Default is $MODEL_ROUTING, or every stage on qwen2.5:32b.
 
 Details:
-    This script generates a review report for LDV places. You can specify the month, reuse cached data, and provide a custom scrape directory.
+    This script generates a review report for a client's dealerships (LDV by default). You can specify the month, reuse cached data, and provide a custom scrape directory.
     If no arguments are provided, defaults will be used.
 """
 )
-parser.add_argument("-m", type=int, help="Month as integer (1-12)", default=datetime.now().month)
+period_group = parser.add_mutually_exclusive_group()
+period_group.add_argument("-m", type=int, help="Month as integer (1-12)", default=datetime.now().month)
+period_group.add_argument("-q", type=int, help="Quarter as integer (1-4)", default=None)
+period_group.add_argument("-last-days", type=int, help="Rolling period of the last N days", default=None)
+period_group.add_argument("-from", dest="date_from", type=str, help="Start date (YYYY-MM-DD) of a custom period", default=None)
+parser.add_argument("-to", dest="date_to", type=str, help="End date (YYYY-MM-DD) of a custom period", default=None)
+parser.add_argument("-y", type=int, help="Year of the month or quarter", default=None)
 parser.add_argument("-reuse-cache", action="store_true", help="Reuse cached data for process_input")
 parser.add_argument("-scrape_dir", type=str, help="Directory to scrape data from", default=None)
 parser.add_argument("-include-car-models", action="store_true", help="Include car models review in the report")
+parser.add_argument("-summary-workers", type=int, help="Number of parallel review summary requests", default=4)
+parser.add_argument("-no-llm-cache", action="store_true", help="Bypass the cached LLM responses in ./cache_data/llm_cache.db")
+parser.add_argument("-no-incremental", action="store_true", help="Re-summarize every dealership instead of only those with changed reviews")
+parser.add_argument("-keep-alive", type=str, help="How long Ollama keeps the model loaded (e.g. 30m, -1)", default=str(OLLAMA_KEEP_ALIVE))
+parser.add_argument("-min-num-ctx", type=int, help="Smallest num_ctx used by every model call", default=MIN_NUM_CTX)
+parser.add_argument("-preload", action="store_true", help="Load the model in the background at startup")
+parser.add_argument("-car-model-workers", type=int, help="Number of car models searched at once", default=4)
+parser.add_argument("-car-model-timeout", type=float, help="Seconds before a car model search is abandoned", default=180)
+parser.add_argument("-search-cache-ttl", type=float, help="Hours a cached Tavily search result stays valid", default=SEARCH_CACHE_TTL_HOURS)
+parser.add_argument("-serpapi-workers", type=int, help="Places backfilled from SerpAPI concurrently", default=SERPAPI_MAX_WORKERS)
+parser.add_argument("-serpapi-rate", type=float, help="Maximum SerpAPI requests per second", default=SERPAPI_REQUESTS_PER_SECOND)
+parser.add_argument("-full-rescrape", action="store_true", help="Replace the scrape file instead of merging into it")
+parser.add_argument("-client", type=str, help="Client (brand) named in the report", default=None)
+parser.add_argument("-location", type=str, help="Location named in the report", default=None)
+parser.add_argument("-max-llm-requests", type=int, help="Model requests sent to Ollama at once", default=None)
+parser.add_argument("-batch", type=str, help="JSON file with a list of report jobs", default=None)
+parser.add_argument("-batch-workers", type=int, help="Number of batch jobs run at once", default=None)
+parser.add_argument("-verbose", action="store_true", help="Print every stage's full output")
+parser.add_argument("-metrics-dir", type=str, help="Directory for Prometheus textfile metrics of each run", default=None)
+parser.add_argument("-ollama-hosts", type=str, help="Comma-separated Ollama endpoints (URL or URL=jobs at once) served through the job queue", default=OLLAMA_ENDPOINTS)
+parser.add_argument("-external-workers", action="store_true", help="Queue model jobs for separate job_queue.py worker processes")
+parser.add_argument("-routing", type=str, help="JSON file routing each model stage to a model tier", default=MODEL_ROUTING_PATH)
+parser.add_argument("-resume", "--resume", type=str, help="Run id (or 'latest') to resume", default=None)
+stage_group = parser.add_mutually_exclusive_group()
+stage_group.add_argument("-from-stage", "--from-stage", type=str, choices=list(STAGES), help="Rerun from this stage onwards (needs -resume)", default=None)
+stage_group.add_argument("-only-stage", "--only-stage", type=str, choices=list(STAGES), help="Rerun only this stage (needs -resume)", default=None)
 args = parser.parse_args()
+try: ollama_hosts = parse_endpoints(args.ollama_hosts)
+except ValueError as e: parser.error(str(e))
+try: routing = load_routing(args.routing) if args.routing else None
+except (OSError, ValueError) as e: parser.error(f"-routing: {e}")
+# Period flags are ignored in batch mode, where every job names its own period
+try: period = None if args.batch else parse_period_args(args.m, args.y, args.q, args.last_days, args.date_from, args.date_to)
+except ValueError as e: parser.error(str(e))
+if (args.from_stage or args.only_stage) and not args.resume: parser.error("-from-stage and -only-stage need -resume")
+if args.batch and args.resume: parser.error("-resume resumes a single run; pass one of the batch's run ids without -batch")
+
+if __name__ == "__main__" and args.batch:
+    from batch import run_batch, load_jobs, BATCH_JOB_WORKERS, BATCH_MAX_LLM_REQUESTS
+
+    run_batch(
+        load_jobs(args.batch),
+        reuse_cache=args.reuse_cache,
+        job_workers=args.batch_workers or BATCH_JOB_WORKERS,
+        max_llm_requests=args.max_llm_requests or BATCH_MAX_LLM_REQUESTS,
+        summary_workers=args.summary_workers,
+        use_llm_cache=not args.no_llm_cache,
+        incremental=not args.no_incremental,
+        keep_alive=parse_keep_alive(args.keep_alive),
+        min_num_ctx=args.min_num_ctx,
+        preload=args.preload,
+        car_model_workers=args.car_model_workers,
+        car_model_timeout=args.car_model_timeout,
+        search_cache_ttl_hours=args.search_cache_ttl,
+        serpapi_workers=args.serpapi_workers,
+        serpapi_rate=args.serpapi_rate,
+        incremental_scrape=not args.full_rescrape,
+        verbose=args.verbose,
+        metrics_dir=args.metrics_dir,
+        ollama_hosts=ollama_hosts,
+        external_workers=args.external_workers,
+        routing=routing
+    )
+
+elif __name__ == "__main__":
+    # Imported after argument parsing so `-h` and bad arguments return immediately
+    from report import pipeline
 
-if __name__ == "__main__":
     # Run the pipeline with the provided arguments
     pipeline(
         month=args.m,
+        period=period,
         file_path=args.scrape_dir if args.scrape_dir else "./cache_data/LDV_places.jsonl",
         reuse_cache=args.reuse_cache,
-        search_car_models=args.include_car_models
+        search_car_models=args.include_car_models,
+        summary_workers=args.summary_workers,
+        use_llm_cache=not args.no_llm_cache,
+        incremental=not args.no_incremental,
+        keep_alive=parse_keep_alive(args.keep_alive),
+        min_num_ctx=args.min_num_ctx,
+        preload=args.preload,
+        car_model_workers=args.car_model_workers,
+        car_model_timeout=args.car_model_timeout,
+        search_cache_ttl_hours=args.search_cache_ttl,
+        serpapi_workers=args.serpapi_workers,
+        serpapi_rate=args.serpapi_rate,
+        incremental_scrape=not args.full_rescrape,
+        resume=args.resume,
+        from_stage=args.from_stage,
+        only_stage=args.only_stage,
+        client=args.client,
+        location=args.location,
+        max_llm_requests=args.max_llm_requests,
+        verbose=args.verbose,
+        metrics_dir=args.metrics_dir,
+        ollama_hosts=ollama_hosts,
+        external_workers=args.external_workers,
+        routing=routing
     )
@@ -0,0 +1,103 @@
+import json
+
+# Rating metrics computed with NumPy instead of asking the analysis model to do the arithmetic.
+# Lifetime figures come from each dealership's `review_count`, `review_rating` and `reviews_per_rating`;
+# period figures come from the date-filtered review ratings of the report period and the one before it.
+STARS = [1, 2, 3, 4, 5]
+
+def _round(value, digits: int = 2):
+    return None if value is None else round(float(value), digits)
+
+# Dealers x 5 matrix of lifetime review counts per star
+def rating_matrix(dealers: list[dict]):
+    import numpy as np
+    return np.array([[(dealer.get("reviews_per_rating") or {}).get(str(star), 0) or 0 for star in STARS] for dealer in dealers], dtype=np.int64).reshape(len(dealers), len(STARS))
+
+# A whole star from 1 to 5, or 0 for anything else (missing, text, half stars)
+def _star(rating) -> int:
+    try: star = float(rating)
+    except (TypeError, ValueError): return 0
+    return int(star) if star in STARS else 0
+
+# Per-dealer count, rating sum and distribution of ragged rating lists, vectorized over one flat array
+def period_rating_counts(ratings_per_dealer: list[list]) -> tuple:
+    import numpy as np
+    dealer_count = len(ratings_per_dealer)
+    lengths = np.array([len(ratings) for ratings in ratings_per_dealer], dtype=np.int64)
+    stars = np.fromiter((_star(rating) for ratings in ratings_per_dealer for rating in ratings), dtype=np.int64, count=int(lengths.sum()))
+    dealer_index = np.repeat(np.arange(dealer_count), lengths)
+    valid = stars > 0
+    distribution = np.bincount(dealer_index[valid] * len(STARS) + (stars[valid] - 1), minlength=dealer_count * len(STARS)).reshape(dealer_count, len(STARS))
+    return distribution.sum(axis=1), distribution @ np.array(STARS), distribution
+
+def _summary(counts, sums, distribution, label: str) -> dict:
+    total = int(counts.sum())
+    return {
+        "period": label,
+        "total_reviews": total,
+        "average_rating": _round(sums.sum() / total) if total else None,
+        "rating_distribution": {str(star): int(count) for star, count in zip(STARS, distribution.sum(axis=0))},
+        "one_star_share": _round(distribution[:, 0].sum() / total, 4) if total else None
+    }
+
+def _delta(current, previous, digits: int = 2):
+    return None if current is None or previous is None else round(current - previous, digits)
+
+# `current_ratings` / `previous_ratings` hold, per dealer in `dealers` order, the ratings of that period's reviews
+def compute_metrics(dealers: list[dict], current_ratings: list[list], previous_ratings: list[list], current_label: str, previous_label: str) -> dict:
+    import numpy as np
+    if not (len(dealers) == len(current_ratings) == len(previous_ratings)):
+        raise ValueError("Dealers and period ratings must have the same length.")
+
+    matrix = rating_matrix(dealers)
+    review_counts = np.array([dealer.get("review_count") or 0 for dealer in dealers], dtype=np.float64)
+    review_ratings = np.array([dealer.get("review_rating") or np.nan for dealer in dealers], dtype=np.float64)
+    rated = ~np.isnan(review_ratings) & (review_counts > 0)
+    matrix_totals = matrix.sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        one_star_share = np.where(matrix_totals > 0, matrix[:, 0] / matrix_totals, np.nan)
+
+    current = period_rating_counts(current_ratings)
+    previous = period_rating_counts(previous_ratings)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        current_average = np.where(current[0] > 0, current[1] / current[0], np.nan)
+        previous_average = np.where(previous[0] > 0, previous[1] / previous[0], np.nan)
+
+    current_summary = _summary(*current, current_label)
+    previous_summary = _summary(*previous, previous_label)
+    nan_to_none = lambda value, digits=2: None if np.isnan(value) else _round(value, digits)
+    return {
+        "overall_metrics": {
+            "average_rating": _round(np.average(review_ratings[rated], weights=review_counts[rated])) if rated.any() else None,
+            "total_reviews": int(review_counts.sum()),
+            "rating_distribution": {str(star): int(count) for star, count in zip(STARS, matrix.sum(axis=0))},
+            "one_star_share": _round(matrix[:, 0].sum() / matrix.sum(), 4) if matrix.sum() else None
+        },
+        "period_metrics": current_summary,
+        "previous_period_metrics": previous_summary,
+        "change_from_previous_period": {
+            "total_reviews": current_summary["total_reviews"] - previous_summary["total_reviews"],
+            "average_rating": _delta(current_summary["average_rating"], previous_summary["average_rating"]),
+            "one_star_share": _delta(current_summary["one_star_share"], previous_summary["one_star_share"], 4)
+        },
+        "dealership_metrics": [{
+            "title": dealer.get("title"),
+            "review_count": int(review_counts[i]),
+            "review_rating": nan_to_none(review_ratings[i]),
+            "one_star_share": nan_to_none(one_star_share[i], 4),
+            "period_reviews": int(current[0][i]),
+            "period_average_rating": nan_to_none(current_average[i]),
+            "previous_period_reviews": int(previous[0][i]),
+            "previous_period_average_rating": nan_to_none(previous_average[i]),
+            "average_rating_change": nan_to_none(current_average[i] - previous_average[i])
+        } for i, dealer in enumerate(dealers)]
+    }
+
+# Put the computed numbers into the model's analysis JSON, replacing any numbers the model produced itself
+# (overall_metrics and the themes' supporting_count, which the stream check lets through; see ANALYSIS_IGNORED_KEYS)
+def merge_metrics(analysis_json: str, metrics: dict) -> str:
+    analysis = json.loads(analysis_json)
+    analysis.pop("overall_metrics", None)
+    for theme in analysis.get("themes") or []:
+        if isinstance(theme, dict): theme.pop("supporting_count", None)
+    return json.dumps({**metrics, **analysis}, ensure_ascii=False)
@@ -0,0 +1,142 @@
+from datetime import datetime
+import json, os, threading, time
+
+# Which model answers each model stage. A stage is routed to a tier (a model and the provider that serves it) and
+# optionally to a fallback tier, which takes over when the first one times out, fails or returns an unusable answer.
+# Latency and failures are recorded per model, so the routing table can be tuned from real runs, and a model that
+# keeps failing is skipped for a while so its stages go straight to their fallback.
+# The routing can be changed with a JSON file (see load_routing):
+#   {"tiers": {"fast": {"model": "qwen2.5:7b"}},
+#    "stages": {"review_summary": {"tier": "fast", "fallback": "large", "timeout_s": 60}}}
+
+DEFAULT_MODEL = "qwen2.5:32b"
+
+# "ollama" models run on the Ollama host(s) (and through the job queue when it is on); "google" models on the
+# Gemini API, which needs GOOGLE_API_KEY
+PROVIDERS = ["ollama", "google"]
+MODEL_TIERS = {
+    "fast": {"model": "qwen2.5:7b", "provider": "ollama"},
+    "large": {"model": DEFAULT_MODEL, "provider": "ollama"},
+    "gemini": {"model": "gemini-2.0-flash", "provider": "google"}
+}
+MODEL_STAGES = ["review_summary", "review_summary_merge", "reviews_analysis", "reviews_analysis_merge", "models_analysis", "report_digest", "report_digest_merge", "md_report"]
+# Every stage stays on the large model unless a routing file says otherwise. `timeout_s` bounds how long the
+# tier's client waits on the model (None waits as long as it takes); the fallback tier waits `fallback_timeout_s`.
+DEFAULT_ROUTE = {"tier": "large", "fallback": None, "timeout_s": None, "fallback_timeout_s": None}
+STAGE_ROUTES = {stage: dict(DEFAULT_ROUTE) for stage in MODEL_STAGES}
+MODEL_ROUTING_PATH = os.getenv("MODEL_ROUTING")
+# After this many failed calls in a row a model is skipped for ROUTE_SKIP_SECONDS wherever it has a fallback
+ROUTE_SKIP_AFTER_FAILURES = 3
+ROUTE_SKIP_SECONDS = 300
+OUTCOMES = ["ok", "timeout", "error", "bad_output"]
+
+# An answer that came back but can't be used (empty, or no valid JSON after every attempt)
+class ModelOutputError(ValueError):
+    pass
+
+# Read and check a routing file. Raises ValueError on unknown tiers, stages, providers or keys.
+def load_routing(file_path: str) -> dict:
+    with open(file_path, "r", encoding="utf-8") as f: routing = json.load(f)
+    if not isinstance(routing, dict) or set(routing) - {"tiers", "stages"}:
+        raise ValueError(f"{file_path}: expected an object with 'tiers' and/or 'stages'")
+    tiers = {**MODEL_TIERS, **{name: {"provider": "ollama", **tier} for name, tier in routing.get("tiers", {}).items()}}
+    for name, tier in tiers.items():
+        if not tier.get("model"): raise ValueError(f"{file_path}: tier '{name}' has no model")
+        if tier["provider"] not in PROVIDERS: raise ValueError(f"{file_path}: tier '{name}' has unknown provider '{tier['provider']}'. Providers: {', '.join(PROVIDERS)}")
+    for stage, route in routing.get("stages", {}).items():
+        if stage not in MODEL_STAGES: raise ValueError(f"{file_path}: unknown stage '{stage}'. Stages: {', '.join(MODEL_STAGES)}")
+        if set(route) - set(DEFAULT_ROUTE): raise ValueError(f"{file_path}: stage '{stage}' has unknown keys {sorted(set(route) - set(DEFAULT_ROUTE))}")
+        if route.get("tier", "large") is None: raise ValueError(f"{file_path}: stage '{stage}' has no tier")
+        for key in ["tier", "fallback"]:
+            if route.get(key) is not None and route[key] not in tiers: raise ValueError(f"{file_path}: stage '{stage}' uses unknown tier '{route[key]}'. Tiers: {', '.join(tiers)}")
+    return routing
+
+# Job queue failures carry the worker's exception as "Type: message", so the text is checked as well as the type
+def failure_kind(error: BaseException) -> str:
+    if isinstance(error, ModelOutputError): return "bad_output"
+    text = f"{type(error).__name__}: {error}".lower()
+    if "timeout" in text or "timed out" in text: return "timeout"
+    return "error"
+
+def _percentile(values: list[float], q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class ModelRouter:
+    def __init__(self, tiers: dict = MODEL_TIERS, routes: dict = STAGE_ROUTES):
+        self._lock = threading.Lock()
+        self.configure(tiers=tiers, routes=routes)
+
+    # Start from the built-in tiers and routes, with `routing` (see load_routing) applied on top. Also resets the statistics.
+    def configure(self, routing: dict | None = None, tiers: dict = MODEL_TIERS, routes: dict = STAGE_ROUTES) -> None:
+        routing = routing or {}
+        self.tiers = {name: dict(tier) for name, tier in tiers.items()}
+        for name, tier in routing.get("tiers", {}).items(): self.tiers[name] = {"provider": "ollama", **tier}
+        self.routes = {stage: dict(route) for stage, route in routes.items()}
+        for stage, route in routing.get("stages", {}).items(): self.routes[stage] = {**DEFAULT_ROUTE, **route}
+        self.reset()
+
+    # The model a stage is routed to first, e.g. to preload it
+    def primary_model(self, stage: str) -> str:
+        return self.targets(stage)[0]["model"]
+
+    # The models the stage is routed to, its tier's then its fallback's, even while one is being skipped
+    def stage_models(self, stage: str) -> list[str]:
+        route = self.routes.get(stage, DEFAULT_ROUTE)
+        return [self.tiers[tier]["model"] for tier in [route["tier"], route.get("fallback")] if tier]
+
+    # What to try for the stage, in order: its tier, then its fallback. A model being skipped goes last.
+    def targets(self, stage: str) -> list[dict]:
+        route = self.routes.get(stage, DEFAULT_ROUTE)
+        targets = [{**self.tiers[route["tier"]], "tier": route["tier"], "timeout_s": route.get("timeout_s")}]
+        if route.get("fallback") and self.tiers[route["fallback"]]["model"] != targets[0]["model"]:
+            targets.append({**self.tiers[route["fallback"]], "tier": route["fallback"], "timeout_s": route.get("fallback_timeout_s")})
+        now = time.monotonic()
+        with self._lock: healthy = [target for target in targets if self._skip_until.get(target["model"], 0) <= now]
+        return healthy + [target for target in targets if target not in healthy]
+
+    # A model named directly by the caller, with the provider of the tier that uses it (Ollama if none does)
+    def target(self, model: str) -> dict:
+        tier = next((name for name, tier in self.tiers.items() if tier["model"] == model), None)
+        return {"model": model, "provider": self.tiers[tier]["provider"] if tier else "ollama", "tier": tier, "timeout_s": None}
+
+    # One model call (not a cache hit) and how it ended: ok, timeout, error or bad_output
+    def record(self, stage: str, model: str, seconds: float, outcome: str, fallback: bool = False) -> None:
+        with self._lock:
+            self.calls.append({"stage": stage, "model": model, "seconds": seconds, "outcome": outcome, "fallback": fallback})
+            self._failures_in_row[model] = 0 if outcome == "ok" else self._failures_in_row.get(model, 0) + 1
+            if self._failures_in_row[model] < ROUTE_SKIP_AFTER_FAILURES: return
+            self._failures_in_row[model] = 0
+            self._skip_until[model] = time.monotonic() + ROUTE_SKIP_SECONDS
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | {model} failed {ROUTE_SKIP_AFTER_FAILURES} calls in a row; using the fallbacks for {ROUTE_SKIP_SECONDS}s")
+
+    # Calls, outcomes and latency (mean, p50, p95 of calls that succeeded) per model, and the calls answered by a fallback
+    def summary(self) -> dict:
+        models = {}
+        with self._lock: calls = list(self.calls)
+        for call in calls:
+            model = models.setdefault(call["model"], {"calls": 0, **{outcome: 0 for outcome in OUTCOMES}, "fallback_calls": 0, "stages": set(), "seconds": []})
+            model["calls"] += 1
+            model[call["outcome"]] += 1
+            model["fallback_calls"] += int(call["fallback"])
+            model["stages"].add(call["stage"])
+            if call["outcome"] == "ok": model["seconds"].append(call["seconds"])
+        for model in models.values():
+            seconds = model.pop("seconds")
+            model["stages"] = sorted(model["stages"])
+            model["failure_rate"] = round(1 - model["ok"] / model["calls"], 3)
+            model["mean_s"] = round(sum(seconds) / len(seconds), 2) if seconds else None
+            model["p50_s"] = round(_percentile(seconds, 0.5), 2) if seconds else None
+            model["p95_s"] = round(_percentile(seconds, 0.95), 2) if seconds else None
+        return models
+
+    def reset(self) -> None:
+        with self._lock:
+            self.calls = []
+            self._failures_in_row = {}
+            self._skip_until = {}
+
+
+# Shared instance used by ai_chat_models
+model_router = ModelRouter()
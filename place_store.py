@@ -0,0 +1,93 @@
+from datetime import date, datetime, timedelta
+from review_store import parse_review_date
+import hashlib, json, os, re
+
+# Reviews older than this are dropped when the store is merged, so the file only grows with the review window
+PLACE_STORE_RETENTION_DAYS = 3 * 365
+# Places the scraper didn't return for this long are refreshed from SerpAPI instead
+STALE_PLACE_DAYS = 7
+# A stale place is refreshed back to its last scrape, or to its newest stored review if it was never stamped,
+# but never further back than this many days
+STALE_REFRESH_MAX_DAYS = 90
+
+# cid is stable across scrapes; data_id and title are fallbacks for SerpAPI-only or partial records
+def place_key(place: dict) -> str | None:
+    return place.get("cid") or place.get("data_id") or place.get("title")
+
+# The same review scraped twice (or once by the scraper and once from SerpAPI, which writes ISO dates)
+# hashes the same: author, calendar date and whitespace-normalized text.
+def review_key(review: dict) -> str:
+    when = parse_review_date(review.get("When"))
+    text = re.sub(r"\s+", " ", review.get("Description") or "").strip().lower()
+    payload = json.dumps([(review.get("Name") or "").strip().lower(), when.isoformat() if when else review.get("When"), text], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# Newest first, undated reviews last
+def sort_reviews(reviews: list[dict]) -> list[dict]:
+    return sorted(reviews, key=lambda review: parse_review_date(review.get("When")) or date.min, reverse=True)
+
+# Append the reviews of `new` that `existing` doesn't have yet. Returns the merged list and how many were added.
+def merge_reviews(existing: list[dict] | None, new: list[dict] | None, retention_days: int | None = PLACE_STORE_RETENTION_DAYS) -> tuple[list[dict], int]:
+    cutoff = date.today() - timedelta(days=retention_days) if retention_days is not None else date.min
+    # Undated reviews are always kept
+    retained = lambda review: (parse_review_date(review.get("When")) or date.max) >= cutoff
+    merged = [review for review in existing or [] if retained(review)]
+    seen = {review_key(review) for review in merged}
+    added = 0
+    for review in new or []:
+        key = review_key(review)
+        if key in seen or not retained(review): continue
+        seen.add(key)
+        merged.append(review)
+        added += 1
+    return sort_reviews(merged), added
+
+# Merge one scrape into the store (keyed by place_key), in place. Place details come from the latest scrape;
+# reviews accumulate. Every scraped place gets `last_scraped_at`.
+def merge_places(store: dict[str, dict], scraped: list[dict], scraped_at: datetime | None = None) -> dict:
+    scraped_at = (scraped_at or datetime.now()).isoformat(timespec="seconds")
+    stats = {"new_places": 0, "updated_places": 0, "new_reviews": 0}
+    for place in scraped:
+        key = place_key(place)
+        if key is None: continue
+        previous = store.get(key)
+        reviews, added = merge_reviews(previous.get("user_reviews_extended") if previous else None, place.get("user_reviews_extended"))
+        store[key] = {**place, "user_reviews_extended": reviews, "last_scraped_at": scraped_at}
+        stats["new_places" if previous is None else "updated_places"] += 1
+        stats["new_reviews"] += added
+    return stats
+
+# Places not refreshed within `max_age_days`, oldest first. Places never stamped count as stale.
+def stale_places(store: dict[str, dict], max_age_days: float = STALE_PLACE_DAYS, now: datetime | None = None) -> list[dict]:
+    cutoff = ((now or datetime.now()) - timedelta(days=max_age_days)).isoformat(timespec="seconds")
+    return sorted((place for place in store.values() if (place.get("last_scraped_at") or "") < cutoff), key=lambda place: place.get("last_scraped_at") or "")
+
+# How far back a stale place's reviews are refreshed from SerpAPI
+def refresh_since(place: dict, max_days: float = STALE_REFRESH_MAX_DAYS, today: date | None = None) -> date:
+    today = today or date.today()
+    since = parse_review_date(place.get("last_scraped_at"))
+    if since is None: since = max((when for when in (parse_review_date(review.get("When")) for review in place.get("user_reviews_extended") or []) if when is not None), default=None)
+    return max(since or date.min, today - timedelta(days=max_days))
+
+def load_place_store(file_path: str) -> dict[str, dict]:
+    store = {}
+    if not os.path.exists(file_path): return store
+    with open(file_path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line: continue
+            try: place = json.loads(line)
+            except json.JSONDecodeError as e: raise ValueError(f"Error parsing line: {e}")
+            key = place_key(place)
+            if key is not None: store[key] = place
+    return store
+
+# Atomic write; the previous version is kept as a single `.bak` instead of one timestamped backup per run
+def save_place_store(store: dict[str, dict], file_path: str) -> None:
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    tmp_path = f"{file_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for place in store.values():
+            f.write(json.dumps(place, ensure_ascii=False) + "\n")
+    if os.path.exists(file_path): os.replace(file_path, f"{file_path}.bak")
+    os.replace(tmp_path, file_path)
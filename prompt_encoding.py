@@ -0,0 +1,71 @@
+from token_budget import estimate_tokens
+import json, threading
+
+# Prompts used to be f-strings over Python objects, whose repr repeats every key on every row and adds
+# quoting and escaping. These encoders carry the same data in fewer prefill tokens.
+
+# Minified JSON, for nested data such as the report payload or partial analyses
+def encode_json(obj) -> str:
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"))
+
+# One table cell: scalars as text, nested values as minified JSON, with the separator and newlines escaped
+def encode_cell(value) -> str:
+    if value is None: return ""
+    if isinstance(value, (dict, list)): value = encode_json(value)
+    return str(value).replace("|", "/").replace("\r", " ").replace("\n", " ").strip()
+
+# Header row of column names followed by one "|"-separated row per record.
+# Columns default to the keys of the first record, in order.
+def encode_table(records: list[dict], columns: list[str] | None = None) -> str:
+    if not records: return "(no rows)"
+    columns = columns or list(records[0].keys())
+    lines = ["|".join(columns)]
+    lines.extend("|".join(encode_cell(record.get(column)) for column in columns) for record in records)
+    return "\n".join(lines)
+
+# Characters and estimated tokens of the same records under each encoding
+def compare_encodings(records: list[dict]) -> dict:
+    encodings = {
+        "python_repr": f"{records}",
+        "json": encode_json(records),
+        "table": encode_table(records)
+    }
+    return {name: {"chars": len(text), "tokens": estimate_tokens(text)} for name, text in encodings.items()}
+
+
+# Per-call record of what was sent to the models, aggregated per stage for the end-of-run summary
+class PromptAccounting:
+    def __init__(self):
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def record(self, stage: str, system_prompt: str, user_prompt: str, num_ctx: int, cached: bool) -> dict:
+        entry = {
+            "stage": stage,
+            "system_chars": len(system_prompt),
+            "user_chars": len(user_prompt),
+            "input_tokens": estimate_tokens(system_prompt) + estimate_tokens(user_prompt),
+            "num_ctx": num_ctx,
+            "cached": cached
+        }
+        with self._lock: self.calls.append(entry)
+        return entry
+
+    def summary(self) -> dict:
+        stages = {}
+        with self._lock: calls = list(self.calls)
+        for entry in calls:
+            stage = stages.setdefault(entry["stage"], {"calls": 0, "cached_calls": 0, "input_chars": 0, "input_tokens": 0, "max_num_ctx": 0})
+            stage["calls"] += 1
+            stage["cached_calls"] += entry["cached"]
+            stage["input_chars"] += entry["system_chars"] + entry["user_chars"]
+            stage["input_tokens"] += entry["input_tokens"]
+            stage["max_num_ctx"] = max(stage["max_num_ctx"], entry["num_ctx"])
+        return stages
+
+    def reset(self) -> None:
+        with self._lock: self.calls = []
+
+
+# Shared instance used by ai_chat_models
+prompt_accounting = PromptAccounting()
@@ -1,59 +1,240 @@
-from ai_chat_models import generate_review_summary, generate_reviews_analysis, generate_md_report, generate_models_analysis
-from algorithms import filter_out_keys, process_input, convert_to_report_data, make_pdf
-from ai_search_agent import search_and_summarize_model_reviews
-from datetime import datetime
-import json
-
-def pipeline(month: str | int = "current", file_path: str | None = "./cache_data/LDV_places.jsonl", reuse_cache: bool = False, search_car_models: bool = False) -> None:
-    # month can be "current" or an integer 1-12
-    if month == "current": month = datetime.now().month
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Running pipeline for month: {month} (reuse_cache={reuse_cache})")
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Path: {file_path} | Search Car Models: {search_car_models}")
+from ai_chat_models import generate_review_summaries, generate_dealers_analysis, generate_md_report_from_data, generate_models_analysis, summary_version
+from algorithms import filter_keys, filter_out_keys, load_review_store, convert_to_report_data, make_pdf, fingerprint_reviews, load_summary_state, save_summary_state, prune_summary_state, dedupe_reviews
+from llm_cache import llm_cache
+from llm_clients import llm_clients, OLLAMA_KEEP_ALIVE
+from token_budget import MIN_NUM_CTX
+from search_cache import search_cache, SEARCH_CACHE_TTL_HOURS
+from api_queries import serpapi_client, SERPAPI_MAX_WORKERS, SERPAPI_REQUESTS_PER_SECOND
+from job_queue import job_queue
+from model_routing import model_router, MODEL_STAGES
+from prompt_encoding import encode_json, prompt_accounting
+from review_store import Period, ReviewStore, month_period, previous_period
+from metrics import compute_metrics, merge_metrics
+from run_store import PipelineRun, slugify
+from tracing import tracer, slowest_items
+from datetime import datetime, date
+import json, threading
+
+DEFAULT_CLIENT = "LDV"
+DEFAULT_LOCATION = "New South Wales, Australia"
+_summary_state_lock = threading.Lock()
+
+# Collapse duplicate, near-duplicate and rating-only reviews of each dealer before they are summarized,
+# printing the estimated prompt tokens saved (per dealer in the trace)
+def deduplicate_dealers(dealers: list[dict]) -> list[list[dict]]:
+    reviews_per_dealer, saved = [], {}
+    for dealer in dealers:
+        with tracer.span("dedup", item=dealer["title"]) as span:
+            rows, stats = dedupe_reviews(dealer["user_reviews_extended"])
+            span.set(**stats, tokens_saved=stats["tokens_before"] - stats["tokens_after"])
+        reviews_per_dealer.append(rows)
+        saved[dealer["title"]] = stats["tokens_before"] - stats["tokens_after"]
+    if dealers:
+        top = dict(sorted(((title, tokens) for title, tokens in saved.items() if tokens), key=lambda entry: entry[1], reverse=True)[:5])
+        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Deduplicated reviews: {sum(len(dealer['user_reviews_extended']) for dealer in dealers)} reviews to {sum(len(rows) for rows in reviews_per_dealer)} rows, ~{sum(saved.values())} prompt tokens saved{f' | Most saved: {top}' if top else ''}")
+    return reviews_per_dealer
+
+# Summarize every dealer's reviews, replacing user_reviews_extended with review_summary.
+# With incremental=True only dealers whose reviews have no summary yet are sent to the model, or all of them when
+# the summary prompts or their models changed (see ai_chat_models.summary_version). Summaries are looked up by the
+# reviews' fingerprint, so batch jobs over several clients or periods each find their own.
+def summarize_dealers(dealers_input: list[dict], summary_workers: int = 4, incremental: bool = True) -> list[dict]:
+    state = load_summary_state()
+    version = summary_version()
+    fingerprints = [fingerprint_reviews(dealer) for dealer in dealers_input]
+    pending = [i for i in range(len(dealers_input))
+               if not incremental or state.get(fingerprints[i], {}).get("version") != version]
+    pending_set = set(pending)
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Summarizing {len(pending)} of {len(dealers_input)} dealerships ({len(dealers_input) - len(pending)} unchanged)")
+
+    reviews_per_dealer = deduplicate_dealers([dealers_input[i] for i in pending])
+    generated_review_summaries = generate_review_summaries(
+        reviews_per_dealer,
+        max_workers=summary_workers,
+        labels=[dealers_input[i]["title"] for i in pending]
+    )
+    now = datetime.now().isoformat(timespec="seconds")
+    summaries = {i: state[fingerprints[i]]["review_summary"] for i in range(len(dealers_input)) if i not in pending_set}
+    updates = {fingerprints[i]: {**state[fingerprints[i]], "used_at": now} for i in summaries}
+    failed_count = 0
+    for i, generated_review_summary in zip(pending, generated_review_summaries):
+        title = dealers_input[i]["title"]
+        if isinstance(generated_review_summary, Exception):
+            print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Failed to summarize reviews for {title}: {generated_review_summary}")
+            summaries[i] = "Review summary unavailable."
+            failed_count += 1
+            continue
+        summaries[i] = generated_review_summary
+        updates[fingerprints[i]] = {
+            "title": title,
+            "version": version,
+            "review_summary": generated_review_summary,
+            "updated_at": now,
+            "used_at": now
+        }
+    if pending and failed_count == len(pending):
+        raise RuntimeError("Failed to summarize reviews for every dealership. Is Ollama running?")
+    # Batch jobs summarize concurrently, so merge into the latest state on disk instead of overwriting it
+    if updates:
+        with _summary_state_lock:
+            state = load_summary_state()
+            state.update(updates)
+            save_summary_state(prune_summary_state(state))
 
-    #* Step 1: Get dealer input and generate review summaries
-    dealers_input = process_input(month, file_path, reuse_cache)
+    results = []
     for i, dealer in enumerate(dealers_input):
-        generated_review_summary = generate_review_summary(f"{dealer['user_reviews_extended']}")
-        dealers_input[i]["review_summary"] = generated_review_summary
-        dealers_input[i] = filter_out_keys(dealers_input[i], ["user_reviews_extended"])        
+        dealer["review_summary"] = summaries[i]
+        results.append(filter_out_keys(dealer, ["user_reviews_extended"]))
+    return results
+
+# Settings shared by every report in the process. Also resets the per-run statistics.
+def configure_clients(use_llm_cache: bool = True, keep_alive: str | int = OLLAMA_KEEP_ALIVE, min_num_ctx: int = MIN_NUM_CTX, max_llm_requests: int | None = None, search_cache_ttl_hours: float = SEARCH_CACHE_TTL_HOURS, serpapi_workers: int = SERPAPI_MAX_WORKERS, serpapi_rate: float = SERPAPI_REQUESTS_PER_SECOND, metrics_dir: str | None = None, ollama_hosts: list[tuple[str, int]] | None = None, external_workers: bool = False, routing: dict | None = None) -> None:
+    llm_cache.enabled = use_llm_cache
+    prompt_accounting.reset()
+    llm_clients.keep_alive = keep_alive
+    llm_clients.min_num_ctx = min_num_ctx
+    llm_clients.set_max_concurrent_requests(max_llm_requests)
+    llm_clients.reset_timings()
+    search_cache.ttl_hours = search_cache_ttl_hours
+    serpapi_client.max_workers = serpapi_workers
+    serpapi_client.requests_per_second = serpapi_rate
+    tracer.metrics_dir = metrics_dir
+    tracer.reset()
+    job_queue.configure(ollama_hosts, external_workers)
+    model_router.configure(routing)
+
+# Load the Ollama models the stages are routed to first, in the background, in the order the stages run. With the job
+# queue on, every endpoint a job may run on is warmed; otherwise the default one.
+def preload_models(min_num_ctx: int) -> None:
+    models = dict.fromkeys(target["model"] for target in (model_router.targets(stage)[0] for stage in MODEL_STAGES) if target["provider"] == "ollama")
+    hosts = job_queue.hosts() or [None]
+    for model in models:
+        for host in hosts: llm_clients.preload_async(model, min_num_ctx, host)
+
+def print_run_stats() -> None:
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | LLM cache: {llm_cache.stats()}")
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Prompt sizes per stage: {prompt_accounting.summary()}")
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Model load vs. generation time per stage: {llm_clients.timing_summary()}")
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Calls, failures and latency per model: {model_router.summary()}")
+
+# Where the run's time went: seconds per stage (from the trace just written) and the dealers with the slowest model calls
+def print_trace_summary(spans: list[dict], run_dir: str) -> None:
+    stages = {span["attributes"]["stage"]: f"{span['duration_s']:.2f}s{' (loaded)' if span['attributes'].get('loaded') else ''}" for span in spans if span["name"] == "stage"}
+    errors = sum(span["status"] == "error" for span in spans)
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Trace: {len(spans)} spans, {errors} errors, written to {run_dir}/trace.jsonl | Stages: {stages}")
+    slowest = slowest_items(spans)
+    if slowest: print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Slowest dealerships (model seconds): {dict(slowest)}")
 
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | STEP 1 - DEALERS INPUT:\n{dealers_input}")
-    print('=' * 20)
+# One report for one client and period, run as checkpointed stages. Returns the run id.
+# `review_store` lets batch jobs share reviews that were already loaded; otherwise `file_path` is read (or scraped).
+# The run is traced to `trace.jsonl` and `metrics.prom` in its run directory; `verbose` also prints every stage's output.
+def generate_report(period: Period, client: str, location: str, file_path: str | None, reuse_cache: bool = False, search_car_models: bool = False, car_models: list[str] | None = None, summary_workers: int = 4, incremental: bool = True, car_model_workers: int = 4, car_model_timeout: float = 180, incremental_scrape: bool = True, review_store: ReviewStore | None = None, resume: str | None = None, from_stage: str | None = None, only_stage: str | None = None, verbose: bool = False) -> str:
+    # Every stage's output is saved to the run directory; a resumed run keeps its original period and inputs
+    run = PipelineRun(resume, from_stage=from_stage, only_stage=only_stage, name=f"{client} {period.label}")
+    if run.resumed:
+        params = run.load_manifest()["params"]
+        period = Period(date.fromisoformat(params["period_start"]), date.fromisoformat(params["period_end"]), params["period_label"])
+        file_path, search_car_models = params["file_path"], params["search_car_models"]
+        client, location, car_models = params.get("client", client), params.get("location", location), params.get("car_models", car_models)
+    else:
+        run.save_manifest({"period_start": period.start.isoformat(), "period_end": period.end.isoformat(), "period_label": period.label, "file_path": file_path, "search_car_models": search_car_models, "client": client, "location": location, "car_models": car_models})
 
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Running pipeline for {client} ({location}), period: {period.label} ({period.start} to {period.end}) (reuse_cache={reuse_cache})")
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Path: {file_path} | Search Car Models: {search_car_models} | Summary Workers: {summary_workers} | LLM Cache: {llm_cache.enabled} | Incremental: {incremental}")
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Run: {run.run_id} ({run.run_dir}){' resumed' if run.resumed else ''}")
 
-    #* Step 2: Generate reviews analysis
-    generated_analysis = generate_reviews_analysis(f"{dealers_input}")
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | STEP 2 - ANALYSIS:\n{json.loads(generated_analysis)}")
-    print('=' * 20)
+    labels = {"client": client, "period": period.label}
+    with tracer.record_run(run.run_id, run.run_dir, labels, slugify(f"{client} {period.label}")) as spans:
+        # Loaded only by the stages that need it; a resumed run reads the same file instead of scraping again
+        previous = previous_period(period)
+        store = review_store
+        def get_store() -> ReviewStore:
+            nonlocal store
+            if store is None: store = load_review_store(file_path, reuse_cache or run.resumed, previous.start, incremental_scrape)
+            return store
+
+        #* Step 1: Get dealer input, compute rating metrics and generate review summaries
+        dealers_input = run.stage("input", lambda: get_store().query(period))
+        metrics = run.stage("metrics", lambda: compute_metrics(dealers_input, get_store().ratings(period), get_store().ratings(previous), period.label, previous.label))
+        if run.wants("summaries"):
+            dealers_input = run.stage("summaries", lambda: summarize_dealers(dealers_input, summary_workers, incremental))
+            if verbose:
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | STEP 1 - DEALERS INPUT:\n{dealers_input}")
+                print('=' * 20)
+
+
+        #* Step 2: Generate reviews analysis; the model only gets the summaries and the numbers come from metrics
+        if run.wants("analysis"):
+            generated_analysis = run.stage("analysis", lambda: merge_metrics(generate_dealers_analysis([filter_keys(dealer, ["title", "review_summary"]) for dealer in dealers_input], summary_workers), metrics))
+            if verbose:
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | STEP 2 - ANALYSIS:\n{json.loads(generated_analysis)}")
+                print('=' * 20)
     
     
-    #* Step 3(Optional): Add car model reviews
-    generated_models_analysis = None
-    if search_car_models:
-        car_reviews = search_and_summarize_model_reviews()
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | OPTIONAL STEP 3 - CAR REVIEWS:\n{car_reviews}")
-        print('=' * 20)
-
-        #* Step 4(Optional): Generate models analysis
-        generated_models_analysis = generate_models_analysis(f"{car_reviews}")
-        print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | STEP 4 - MODELS ANALYSIS:\n{json.loads(generated_models_analysis)}")
-        print('=' * 20)
-
-    #* Last step: Convert to report data and generate markdown
-    month_name = datetime(1900, int(month), 1).strftime('%B')
-    report_data = convert_to_report_data(
-        client="LDV",
-        loc="New South Wales, Australia",
-        desc=f"Customer reviews analysis report for the month of {month_name}",
-        report_title=f"LDV Dealerships{'' if not search_car_models else 'and Car Models'} Review {month_name} Report",
-        processed_data=dealers_input,
-        analysis_of_processed_data=f"For year {datetime.now().year}, {generated_models_analysis}"
-    )
+        #* Step 3(Optional): Add car model reviews
+        generated_models_analysis = None
+        if search_car_models and run.wants("car_reviews"):
+            def search_car_reviews():
+                from ai_search_agent import search_and_summarize_model_reviews, MODELS
+                return search_and_summarize_model_reviews(models=car_models or MODELS, max_concurrency=car_model_workers, timeout=car_model_timeout, verbose=verbose)
+            car_reviews = run.stage("car_reviews", search_car_reviews)
+            if verbose:
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | OPTIONAL STEP 3 - CAR REVIEWS:\n{car_reviews}")
+                print('=' * 20)
+
+            #* Step 4(Optional): Generate models analysis
+            if run.wants("models_analysis"):
+                generated_models_analysis = run.stage("models_analysis", lambda: generate_models_analysis(encode_json(car_reviews)))
+                if verbose:
+                    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | STEP 4 - MODELS ANALYSIS:\n{json.loads(generated_models_analysis)}")
+                    print('=' * 20)
 
-    generated_md_report = generate_md_report(f"{report_data}")
-    make_pdf(month, generated_md_report)
+        #* Last step: Convert to report data and generate markdown
+        is_month_period = period == month_period(period.start.month, period.start.year)
+        if run.wants("report"):
+            def write_report():
+                report_data = convert_to_report_data(
+                    client=client,
+                    loc=location,
+                    desc=f"Customer reviews analysis report for {'the month of ' if is_month_period else ''}{period.label}",
+                    report_title=f"{client} Dealerships{'' if not search_car_models else ' and Car Models'} Review {period.label} Report",
+                    processed_data=dealers_input,
+                    analysis_of_processed_data=json.loads(generated_analysis),
+                    analysis_of_car_models=json.loads(generated_models_analysis) if generated_models_analysis else None
+                )
+                return generate_md_report_from_data(report_data, summary_workers)
+            generated_md_report = run.stage("report", write_report)
+            if verbose: print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | STEP 3 - MARKDOWN REPORT:\n{generated_md_report}")
 
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | STEP 3 - MARKDOWN REPORT:\n{generated_md_report}")
+        if run.wants("pdf"): run.stage("pdf", lambda: make_pdf(period.start.month if is_month_period else period.label, generated_md_report, client))
+    print_trace_summary(spans, run.run_dir)
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Run {run.run_id} saved to {run.run_dir}. Resume with: python main.py -resume {run.run_id}")
+    return run.run_id
+
+def pipeline(month: str | int = "current", file_path: str | None = "./cache_data/LDV_places.jsonl", reuse_cache: bool = False, search_car_models: bool = False, summary_workers: int = 4, use_llm_cache: bool = True, incremental: bool = True, period: Period | None = None, keep_alive: str | int = OLLAMA_KEEP_ALIVE, min_num_ctx: int = MIN_NUM_CTX, preload: bool = False, car_model_workers: int = 4, car_model_timeout: float = 180, search_cache_ttl_hours: float = SEARCH_CACHE_TTL_HOURS, serpapi_workers: int = SERPAPI_MAX_WORKERS, serpapi_rate: float = SERPAPI_REQUESTS_PER_SECOND, incremental_scrape: bool = True, resume: str | None = None, from_stage: str | None = None, only_stage: str | None = None, client: str | None = None, location: str | None = None, max_llm_requests: int | None = None, verbose: bool = False, metrics_dir: str | None = None, ollama_hosts: list[tuple[str, int]] | None = None, external_workers: bool = False, routing: dict | None = None) -> str:
+    # month can be "current" or an integer 1-12; period (quarter, rolling or custom range) takes precedence
+    if month == "current": month = datetime.now().month
+    if period is None: period = month_period(month)
+
+    configure_clients(use_llm_cache, keep_alive, min_num_ctx, max_llm_requests, search_cache_ttl_hours, serpapi_workers, serpapi_rate, metrics_dir, ollama_hosts, external_workers, routing)
+    # Load the model while the scrape is read and filtered
+    if preload: preload_models(min_num_ctx)
+    run_id = generate_report(
+        period, client or DEFAULT_CLIENT, location or DEFAULT_LOCATION, file_path,
+        reuse_cache=reuse_cache,
+        search_car_models=search_car_models,
+        summary_workers=summary_workers,
+        incremental=incremental,
+        car_model_workers=car_model_workers,
+        car_model_timeout=car_model_timeout,
+        incremental_scrape=incremental_scrape,
+        resume=resume,
+        from_stage=from_stage,
+        only_stage=only_stage,
+        verbose=verbose
+    )
+    print_run_stats()
+    return run_id
 
 if __name__ == "__main__":
     pipeline()
\ No newline at end of file
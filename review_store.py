@@ -0,0 +1,132 @@
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from bisect import bisect_left, bisect_right
+
+# An inclusive date range the report covers, e.g. September 2025 or 2025-Q3
+@dataclass(frozen=True)
+class Period:
+    start: date
+    end: date
+    label: str
+
+    def __post_init__(self):
+        if self.start > self.end: raise ValueError(f"Period start {self.start} is after its end {self.end}")
+
+# Month of a given year. Without a year, picks the latest one where the month has already started
+# (running in January with month=12 reports last December).
+def month_period(month: int | str, year: int | None = None) -> Period:
+    try: month_int = int(month)
+    except Exception: raise ValueError(f"Month must be an integer from 1 to 12. Got {month}")
+    if not (1 <= month_int <= 12): raise ValueError(f"Month must be in the range 1 to 12. Got {month}")
+
+    today = date.today()
+    if year is None: year = today.year if month_int <= today.month else today.year - 1
+    start = date(year, month_int, 1)
+    end = date(year + month_int // 12, month_int % 12 + 1, 1) - timedelta(days=1)
+    return Period(start, end, start.strftime("%B %Y"))
+
+def quarter_period(quarter: int | str, year: int | None = None) -> Period:
+    try: quarter_int = int(quarter)
+    except Exception: raise ValueError(f"Quarter must be an integer from 1 to 4. Got {quarter}")
+    if not (1 <= quarter_int <= 4): raise ValueError(f"Quarter must be in the range 1 to 4. Got {quarter}")
+
+    today = date.today()
+    if year is None: year = today.year if quarter_int <= (today.month - 1) // 3 + 1 else today.year - 1
+    first = month_period(3 * quarter_int - 2, year)
+    last = month_period(3 * quarter_int, year)
+    return Period(first.start, last.end, f"Q{quarter_int} {year}")
+
+# The last `days` days up to and including `until` (default today)
+def rolling_period(days: int, until: date | None = None) -> Period:
+    if days < 1: raise ValueError(f"Rolling period must be at least 1 day. Got {days}")
+    end = until or date.today()
+    return Period(end - timedelta(days=days - 1), end, f"last {days} days to {end.isoformat()}")
+
+def custom_period(start: str | date, end: str | date) -> Period:
+    if isinstance(start, str): start = date.fromisoformat(start)
+    if isinstance(end, str): end = date.fromisoformat(end)
+    return Period(start, end, f"{start.isoformat()} to {end.isoformat()}")
+
+# The period just before `period` for period-over-period comparisons: the previous month or quarter,
+# otherwise a window of the same length ending the day before. Only the dates count, so a custom period spanning
+# a whole month is a month.
+def previous_period(period: Period) -> Period:
+    day_before = period.start - timedelta(days=1)
+    dates = lambda other: (other.start, other.end)
+    if dates(period) == dates(month_period(period.start.month, period.start.year)):
+        return month_period(day_before.month, day_before.year)
+    quarter = (period.start.month - 1) // 3 + 1
+    if dates(period) == dates(quarter_period(quarter, period.start.year)):
+        return quarter_period((day_before.month - 1) // 3 + 1, day_before.year)
+    return custom_period(day_before - (period.end - period.start), day_before)
+
+# Parse a review's `When` value: scraper format 'YYYY-M-D' or SerpAPI's ISO 'YYYY-MM-DDTHH:MM:SSZ'.
+# Returns None for empty or malformed dates.
+def parse_review_date(when: str | None) -> date | None:
+    if not when: return None
+    parts = when.split("T", 1)[0].split("-")
+    if len(parts) != 3: return None
+    try: return date(int(parts[0]), int(parts[1]), int(parts[2]))
+    except ValueError: return None
+
+
+# Reviews of every dealership, parsed once and kept sorted by date so any period is two bisects away.
+# `dealerships` are process_input-style dicts; their `user_reviews_extended` must carry `When`.
+class ReviewStore:
+    def __init__(self, dealerships: list[dict], review_keys: list[str] | None = None):
+        self.review_keys = review_keys or ["Rating", "Description"]
+        self.dealerships = []
+        self._ordinals = []
+        self._reviews = []
+        self.undated_count = 0
+
+        for dealership in dealerships:
+            dated = []
+            for review in dealership.get("user_reviews_extended") or []:
+                review_date = parse_review_date(review.get("When"))
+                if review_date is None:
+                    self.undated_count += 1
+                    continue
+                dated.append((review_date.toordinal(), review))
+            dated.sort(key=lambda item: item[0])
+
+            self.dealerships.append({key: value for key, value in dealership.items() if key != "user_reviews_extended"})
+            self._ordinals.append([ordinal for ordinal, _ in dated])
+            self._reviews.append([review for _, review in dated])
+
+    def __len__(self) -> int:
+        return len(self.dealerships)
+
+    def reviews_between(self, index: int, start: date, end: date) -> list[dict]:
+        ordinals = self._ordinals[index]
+        lo = bisect_left(ordinals, start.toordinal())
+        hi = bisect_right(ordinals, end.toordinal())
+        return self._reviews[index][lo:hi]
+
+    # Same shape process_input always returned: dealership fields plus that period's reviews (newest first)
+    def query(self, period: Period) -> list[dict]:
+        results = []
+        for i, dealership in enumerate(self.dealerships):
+            reviews = self.reviews_between(i, period.start, period.end)
+            results.append({
+                **dealership,
+                "user_reviews_extended": [{key: review[key] for key in self.review_keys} for review in reversed(reviews)]
+            })
+        return results
+
+    # Just the ratings of each dealership's reviews in the period, for metrics
+    def ratings(self, period: Period) -> list[list]:
+        return [[review.get("Rating") for review in self.reviews_between(i, period.start, period.end)] for i in range(len(self.dealerships))]
+
+    def review_counts(self, period: Period) -> list[int]:
+        return [len(self.reviews_between(i, period.start, period.end)) for i in range(len(self.dealerships))]
+
+
+def parse_period_args(month: int | str | None = None, year: int | None = None, quarter: int | None = None, last_days: int | None = None, date_from: str | None = None, date_to: str | None = None) -> Period:
+    if date_from or date_to:
+        if not (date_from and date_to): raise ValueError("Both a start and an end date are required for a custom period.")
+        return custom_period(date_from, date_to)
+    if last_days is not None: return rolling_period(last_days)
+    if quarter is not None: return quarter_period(quarter, year)
+    if month is None or month == "current": month = datetime.now().month
+    return month_period(month, year)
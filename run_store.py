@@ -0,0 +1,110 @@
+from datetime import datetime
+from typing import Any, Callable
+from tracing import tracer
+import json, os, re, time
+
+RUNS_DIR = "./cache_data/runs"
+
+# Pipeline stages in order. Bump a stage's version when its artifact format changes;
+# artifacts of another version are treated as missing.
+STAGES = {
+    "input": 1,             # dealerships with the period's reviews
+    "metrics": 1,           # rating metrics for the period and the one before it
+    "summaries": 1,         # dealerships with review_summary instead of reviews
+    "analysis": 2,          # dealers analysis JSON string, with the metrics merged in
+    "car_reviews": 1,       # search agent result (optional)
+    "models_analysis": 1,   # models analysis JSON string (optional)
+    "report": 1,            # markdown report
+    "pdf": 1                # path of the saved PDF
+}
+
+# Timestamp first so runs sort by start time; the name keeps concurrent batch jobs apart
+def slugify(name: str) -> str:
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-")
+
+def new_run_id(name: str | None = None) -> str:
+    run_id = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    if name: run_id += "_" + slugify(name)
+    return run_id
+
+def latest_run_id(runs_dir: str = RUNS_DIR) -> str | None:
+    if not os.path.isdir(runs_dir): return None
+    runs = sorted(name for name in os.listdir(runs_dir) if os.path.exists(os.path.join(runs_dir, name, "run.json")))
+    return runs[-1] if runs else None
+
+
+# One pipeline run on disk: a run.json manifest plus one JSON artifact per completed stage.
+# Stages before `from_stage` / `only_stage` must already have artifacts and are loaded;
+# `only_stage` also stops the run after that stage. Resuming without either loads every stage that has an artifact.
+class PipelineRun:
+    def __init__(self, run_id: str | None = None, runs_dir: str = RUNS_DIR, from_stage: str | None = None, only_stage: str | None = None, name: str | None = None):
+        for stage in [from_stage, only_stage]:
+            if stage is not None and stage not in STAGES: raise ValueError(f"Unknown stage '{stage}'. Stages: {', '.join(STAGES)}")
+        if from_stage and only_stage: raise ValueError("Use either from_stage or only_stage, not both.")
+        self.resumed = run_id is not None
+        if run_id == "latest":
+            run_id = latest_run_id(runs_dir)
+            if run_id is None: raise ValueError(f"No runs to resume in {runs_dir}")
+        self.run_id = run_id or new_run_id(name)
+        self.run_dir = os.path.join(runs_dir, self.run_id)
+        if self.resumed and not os.path.exists(os.path.join(self.run_dir, "run.json")):
+            raise ValueError(f"Run '{self.run_id}' not found in {runs_dir}")
+        if (from_stage or only_stage) and not self.resumed:
+            raise ValueError("from_stage and only_stage need a run to resume.")
+        self.from_stage = from_stage or only_stage
+        self.only_stage = only_stage
+
+    def artifact_path(self, stage: str) -> str:
+        return os.path.join(self.run_dir, f"{stage}.v{STAGES[stage]}.json")
+
+    def has(self, stage: str) -> bool:
+        return os.path.exists(self.artifact_path(stage))
+
+    def load(self, stage: str) -> Any:
+        with open(self.artifact_path(stage), "r", encoding="utf-8") as f: return json.load(f)["data"]
+
+    # Compute time of every stage saved in this run, in pipeline order
+    def stage_seconds(self) -> dict[str, float | None]:
+        seconds = {}
+        for stage in STAGES:
+            if not self.has(stage): continue
+            with open(self.artifact_path(stage), "r", encoding="utf-8") as f: seconds[stage] = json.load(f).get("seconds")
+        return seconds
+
+    # `seconds` is how long the stage took to compute
+    def save(self, stage: str, data: Any, seconds: float | None = None) -> None:
+        os.makedirs(self.run_dir, exist_ok=True)
+        path = self.artifact_path(stage)
+        with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+            json.dump({"stage": stage, "version": STAGES[stage], "created_at": datetime.now().isoformat(timespec="seconds"), "seconds": seconds, "data": data}, f, ensure_ascii=False)
+        os.replace(f"{path}.tmp", path)
+
+    # Parameters the run was started with; a resumed run keeps them
+    def load_manifest(self) -> dict:
+        with open(os.path.join(self.run_dir, "run.json"), "r", encoding="utf-8") as f: return json.load(f)
+
+    def save_manifest(self, params: dict) -> None:
+        os.makedirs(self.run_dir, exist_ok=True)
+        with open(os.path.join(self.run_dir, "run.json"), "w", encoding="utf-8") as f:
+            json.dump({"run_id": self.run_id, "created_at": datetime.now().isoformat(timespec="seconds"), "params": params}, f, ensure_ascii=False, indent=2)
+
+    # Whether a stage runs (or is loaded) at all; with only_stage nothing after it does
+    def wants(self, stage: str) -> bool:
+        order = list(STAGES)
+        return self.only_stage is None or order.index(stage) <= order.index(self.only_stage)
+
+    # Load the stage's artifact or compute and save it
+    def stage(self, name: str, compute: Callable[[], Any]) -> Any:
+        order = list(STAGES)
+        forced = self.from_stage is not None and order.index(name) >= order.index(self.from_stage)
+        required = self.from_stage is not None and not forced
+        with tracer.span("stage", stage=name) as span:
+            if not forced and self.resumed and self.has(name):
+                print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}] | Loaded stage '{name}' from run {self.run_id}")
+                span.set(loaded=True)
+                return self.load(name)
+            if required: raise ValueError(f"Run '{self.run_id}' has no '{name}' artifact. Resume without a stage flag to rebuild it.")
+            start = time.perf_counter()
+            data = compute()
+            self.save(name, data, round(time.perf_counter() - start, 4))
+            return data
@@ -0,0 +1,137 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Callable, Iterator
+from tracing import tracer
+import hashlib, json, os, re, sqlite3, threading
+
+SEARCH_CACHE_PATH = "./cache_data/search_cache.db"
+SEARCH_CACHE_TTL_HOURS = 24 * 7
+# Counters of the search run in progress (see CachedSearch.run). A context variable, so concurrent runs (e.g. batch
+# jobs in their own threads) each count their own searches.
+_run_stats: ContextVar[dict | None] = ContextVar("search_run_stats", default=None)
+
+# Lowercase and collapse whitespace so "LDV  eDeliver 7 review" and "ldv edeliver 7 review" share a cache entry
+def normalize_query(query: str) -> str:
+    return re.sub(r"\s+", " ", query).strip().lower()
+
+def normalize_url(url: str) -> str:
+    url = re.sub(r"^https?://(www\.)?", "", url.strip().lower())
+    return url.split("#", 1)[0].rstrip("/")
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(re.sub(r"\s+", " ", text or "").strip().lower().encode("utf-8")).hexdigest()
+
+# Keep only what the agent reads from a Tavily response (drops scores, images, raw content and timings)
+def normalize_results(response: dict | str) -> dict:
+    if not isinstance(response, dict): return {"results": [], "error": str(response)}
+    return {
+        "query": response.get("query"),
+        "results": [{
+            "url": result.get("url"),
+            "title": result.get("title"),
+            "content": result.get("content")
+        } for result in response.get("results") or []]
+    }
+
+
+# Search results on disk with a TTL. Pages are deduplicated per agent conversation, against the `seen` set the
+# caller keeps, so what one car model's agent reads never depends on the others.
+# `backend` takes the tool-call arguments and returns a Tavily-style response; it defaults to TavilySearch.
+class CachedSearch:
+    def __init__(self, backend: Callable[[dict], dict] | None = None, path: str = SEARCH_CACHE_PATH, ttl_hours: float = SEARCH_CACHE_TTL_HOURS, max_results: int = 3):
+        self.backend = backend
+        self.path = path
+        self.ttl_hours = ttl_hours
+        self.max_results = max_results
+        self.hits = 0
+        self.misses = 0
+        self.duplicates_removed = 0
+        self._lock = threading.Lock()
+        self._initialized = False
+
+    def get_backend(self) -> Callable[[dict], dict]:
+        if self.backend is None:
+            from langchain_tavily import TavilySearch
+            self.backend = TavilySearch(max_results=self.max_results).invoke
+        return self.backend
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        if not self._initialized: os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            if not self._initialized:
+                conn.execute("CREATE TABLE IF NOT EXISTS search_cache (key TEXT PRIMARY KEY, response TEXT NOT NULL, created_at TEXT NOT NULL)")
+                self._initialized = True
+            with conn: yield conn
+        finally:
+            conn.close()
+
+    def make_key(self, args: dict) -> str:
+        normalized = {**args, "query": normalize_query(args.get("query", ""))}
+        payload = json.dumps([self.max_results, normalized], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    # Cached (or fresh) normalized results for one tool call
+    def search(self, args: dict) -> dict:
+        with tracer.span("search.tavily", query=args.get("query")) as span:
+            key = self.make_key(args)
+            cutoff = (datetime.now() - timedelta(hours=self.ttl_hours)).isoformat()
+            with self._lock, self._connect() as conn:
+                row = conn.execute("SELECT response FROM search_cache WHERE key = ? AND created_at >= ?", (key, cutoff)).fetchone()
+                if row is not None:
+                    self._count("hits")
+                    span.set(cache_hit=True)
+                    return json.loads(row[0])
+                self._count("misses")
+
+            response = normalize_results(self.get_backend()(args))
+            if "error" not in response:
+                with self._lock, self._connect() as conn:
+                    conn.execute("INSERT OR REPLACE INTO search_cache VALUES (?, ?, ?)", (key, json.dumps(response, ensure_ascii=False), datetime.now().isoformat()))
+                    conn.execute("DELETE FROM search_cache WHERE created_at < ?", (cutoff,))
+            return response
+
+    # Adds one to a lifetime counter and to the same counter of the current run, if any. Call with the lock held.
+    def _count(self, name: str) -> None:
+        setattr(self, name, getattr(self, name) + 1)
+        run = _run_stats.get()
+        if run is not None: run[name] += 1
+
+    # Drop pages already in `seen` (the URLs and content hashes one agent conversation has read) and add the rest to it
+    def drop_seen(self, response: dict, seen: set[str]) -> dict:
+        results = []
+        for result in response.get("results", []):
+            keys = [normalize_url(result.get("url") or ""), content_hash(result.get("content") or "")]
+            if any(key in seen for key in keys):
+                with self._lock: self._count("duplicates_removed")
+                continue
+            seen.update(keys)
+            results.append(result)
+        return {**response, "results": results}
+
+    def search_unseen(self, args: dict, seen: set[str]) -> dict:
+        return self.drop_seen(self.search(args), seen)
+
+    # Counts the hits, misses and duplicates of the searches made inside the block, apart from any other run
+    @contextmanager
+    def run(self) -> Iterator[dict]:
+        token = _run_stats.set({"hits": 0, "misses": 0, "duplicates_removed": 0})
+        try: yield _run_stats.get()
+        finally: _run_stats.reset(token)
+
+    # Adds the counters of a search made elsewhere (e.g. by a job queue worker) to the current run, if any
+    def add_to_run(self, stats: dict) -> None:
+        run = _run_stats.get()
+        if run is None: return
+        with self._lock:
+            for name, value in stats.items(): run[name] += value
+
+    # Lifetime counters of this instance
+    def stats(self) -> dict:
+        with self._lock: return {"hits": self.hits, "misses": self.misses, "duplicates_removed": self.duplicates_removed}
+
+
+# Shared instance used by the search agent graph
+search_cache = CachedSearch()
@@ -0,0 +1,79 @@
+from ai_chat_models import map_reduce, decode_partial, stream_json_model, ANALYSIS_SCHEMA
+from benchmarks.fakes import FakeMessage
+from llm_cache import llm_cache
+from llm_clients import llm_clients
+import json, threading, pytest
+
+# map_reduce with fake map and reduce calls: how partial results are batched and passed to the reduce step.
+# stream_json_model with a fake streaming model: which answers are cached under which temperature.
+
+def run(groups: list[list], map_fn, batch_tokens: int = 20) -> tuple[list, list[str]]:
+    reduce_prompts, lock = [], threading.Lock()
+
+    def reduce_fn(prompt: str) -> str:
+        with lock: reduce_prompts.append(prompt)
+        return json.dumps({"merged": len(json.loads(prompt))})
+
+    return map_reduce(groups, map_fn, reduce_fn, batch_tokens, max_workers=2), reduce_prompts
+
+def test_json_partials_reach_the_reduce_step_as_objects():
+    results, prompts = run([[{"text": "x" * 40} for _ in range(3)]], lambda prompt: json.dumps({"themes": ["a \"quoted\" theme"], "rows": prompt.count("\n")}))
+    assert json.loads(results[0])["merged"] >= 2
+    partials = json.loads(prompts[0])
+    assert len(partials) >= 2 and all(isinstance(partial, dict) for partial in partials)
+    # Only the quotes inside the values are escaped, not every quote of the partial answers
+    assert prompts[0].count('\\"') == 2 * len(partials)
+
+def test_text_partials_stay_strings():
+    results, prompts = run([[{"text": "x" * 40} for _ in range(2)]], lambda prompt: "Friendly staff, slow paperwork.")
+    assert json.loads(prompts[0]) == ["Friendly staff, slow paperwork."] * 2
+
+def test_a_single_batch_is_not_reduced():
+    results, prompts = run([[{"text": "short"}]], lambda prompt: "Only summary")
+    assert results == ["Only summary"] and prompts == []
+
+def test_a_failed_batch_fails_only_its_group():
+    def map_fn(prompt: str) -> str:
+        if "bad" in prompt: raise RuntimeError("model failed")
+        return "ok"
+
+    results, _ = run([[{"text": "bad"}], [{"text": "good"}]], map_fn)
+    assert isinstance(results[0], RuntimeError) and results[1] == "ok"
+
+def test_decode_partial():
+    assert decode_partial('{"a": 1}') == {"a": 1}
+    assert decode_partial("[1, 2]") == [1, 2]
+    assert decode_partial("Plain text") == "Plain text"
+    # JSON scalars are text answers that happen to parse, kept as written
+    assert decode_partial("42") == "42"
+
+
+ANALYSIS = json.dumps({"brief_sentiment_analysis_summary": "Mostly positive", "themes": [], "recommendations": [], "confidence_and_gaps": "Few reviews"})
+
+# Streams prose at temperature 0 and a valid analysis when warmer, like a model that needs the retry
+class ProseAtZero:
+    def __init__(self, temperature: float, calls: list):
+        self.temperature = temperature
+        self.calls = calls
+
+    def stream(self, messages: list):
+        self.calls.append(self.temperature)
+        answer = "Sure! Here is a detailed analysis of the reviews you sent me." if self.temperature == 0 else ANALYSIS
+        for i in range(0, len(answer), 7): yield FakeMessage(answer[i:i + 7])
+
+@pytest.fixture
+def prose_at_zero(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(llm_cache, "path", str(tmp_path / "llm_cache.db"))
+    monkeypatch.setattr(llm_cache, "_initialized", False)
+    monkeypatch.setattr(llm_cache, "enabled", True)
+    monkeypatch.setattr(llm_clients, "_clients", {})
+    monkeypatch.setattr(llm_clients, "client_factory", lambda model, temperature, num_ctx, base_url=None, timeout=None: ProseAtZero(temperature, calls))
+    return calls
+
+def test_a_retry_answer_is_not_cached_as_the_first_attempt(prose_at_zero):
+    assert stream_json_model("reviews_analysis", "system", "reviews", 256, ANALYSIS_SCHEMA) == ANALYSIS
+    assert prose_at_zero == [0, 0.3]
+    # The next run tries temperature 0 again, then finds the retry's answer under its own temperature
+    assert stream_json_model("reviews_analysis", "system", "reviews", 256, ANALYSIS_SCHEMA) == ANALYSIS
+    assert prose_at_zero == [0, 0.3, 0]
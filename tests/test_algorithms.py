@@ -0,0 +1,64 @@
+from algorithms import dedupe_reviews, near_duplicate_groups
+import pytest
+
+# dedupe_reviews and the MinHash LSH grouping behind it: which reviews collapse, which survive, and which review
+# represents a group
+
+LONG = "The sales team were friendly and patient, the van was ready on time and the handover was thorough. Highly recommend this dealer to anyone after a new LDV."
+# One word changed and different punctuation: near-identical, but not the same text
+NEAR = LONG.replace("patient", "helpful").replace(".", "!")
+OTHER = "Waited three weeks for a warranty part and nobody returned my calls. The workshop manager was rude when I finally got through on the phone."
+
+def review(rating: int, text: str | None, when: str = "2025-03-01") -> dict:
+    return {"When": when, "Rating": rating, "Description": text}
+
+def test_near_duplicates_collapse_to_one_row():
+    rows, stats = dedupe_reviews([review(5, LONG), review(5, NEAR), review(1, OTHER)])
+    assert [(row["Description"], row["count"]) for row in rows] == [(LONG, 2), (OTHER, None)]
+    assert stats["near_duplicates"] == 1 and stats["exact_duplicates"] == 0
+    assert stats["tokens_after"] < stats["tokens_before"]
+
+def test_exact_duplicates_ignore_case_and_punctuation():
+    rows, stats = dedupe_reviews([review(5, LONG), review(5, LONG.upper().replace(",", "")), review(5, LONG)])
+    assert [row["count"] for row in rows] == [3]
+    assert stats["exact_duplicates"] == 2
+
+def test_distinct_reviews_survive():
+    reviews = [review(5, LONG), review(1, OTHER), review(3, "Average experience overall, nothing special about the service or the price.")]
+    # Nothing to collapse, so the count column would only add tokens
+    rows, stats = dedupe_reviews(reviews)
+    assert rows == reviews and stats["rows"] == 3 and stats["tokens_after"] == stats["tokens_before"]
+
+def test_same_text_with_another_rating_is_kept():
+    rows, _ = dedupe_reviews([review(5, LONG), review(1, LONG), review(5, LONG)])
+    assert [(row["Rating"], row["count"]) for row in rows] == [(5, 2), (1, None)]
+
+def test_rows_keep_the_order_of_their_first_review():
+    rows, _ = dedupe_reviews([review(1, OTHER, "2025-03-01"), review(5, LONG, "2025-03-02"), review(1, OTHER, "2025-03-03"), review(5, NEAR, "2025-03-04")])
+    assert [row["Description"] for row in rows] == [OTHER, LONG]
+
+def test_longest_text_represents_the_group_and_ties_keep_the_first():
+    longer = LONG + " Thanks again"
+    rows, _ = dedupe_reviews([review(5, LONG, "2025-03-01"), review(5, longer, "2025-03-02"), review(5, LONG, "2025-03-03")])
+    assert rows[0]["Description"] == longer and rows[0]["When"] == "2025-03-02"
+    rows, _ = dedupe_reviews([review(5, LONG, "2025-03-01"), review(5, NEAR, "2025-03-02")])
+    assert rows[0]["When"] == "2025-03-01"
+
+def test_the_same_input_gives_the_same_rows():
+    reviews = [review(rating, text) for rating in [1, 5] for text in [LONG, NEAR, OTHER, OTHER + " Never again."]]
+    assert dedupe_reviews(reviews) == dedupe_reviews(reviews)
+    assert near_duplicate_groups([LONG, OTHER, NEAR]) == [[0, 2], [1]]
+
+def test_rating_only_reviews_become_one_row_per_rating():
+    reviews = [review(5, None) for _ in range(20)] + [review(4, "") for _ in range(10)]
+    rows, stats = dedupe_reviews(reviews)
+    assert [(row["Rating"], row["Description"], row["count"]) for row in rows] == [(5, None, 20), (4, None, 10)]
+    assert stats["rating_only"] == 30
+
+@pytest.mark.parametrize("texts", [[], ["ok"], ["good", "bad"], ["a", "ab", "a"]])
+def test_empty_and_very_short_texts(texts):
+    # Texts shorter than a shingle are one shingle of their own
+    rows, stats = dedupe_reviews([review(5, text) for text in texts])
+    assert stats["reviews"] == len(texts)
+    assert sum(row.get("count") or 1 for row in rows) == len(texts)
+    assert near_duplicate_groups(texts) == ([[0, 2], [1]] if texts == ["a", "ab", "a"] else [[i] for i in range(len(texts))])
@@ -0,0 +1,94 @@
+from datetime import date
+from api_queries import SerpApiClient
+from benchmarks.fakes import FakeSerpApiServer
+import socket, pytest
+
+# SerpApiClient against the local fake SerpAPI server: pagination down to `since`, and retries of rate limits,
+# server errors and connection errors with exponential backoff
+
+DATA_ID = "0x1:0x2"
+
+# 35 reviews, one a day from 2025-09-30 back to 2025-08-27, served 10 per page
+def make_place(count: int = 35) -> dict:
+    return {"data_id": DATA_ID, "user_reviews_extended": [{"Name": f"User {i}", "Rating": 5, "Description": f"Review {i}", "When": date.fromordinal(date(2025, 9, 30).toordinal() - i).isoformat()} for i in range(count)]}
+
+def make_client(server: FakeSerpApiServer, retries: int = 3) -> SerpApiClient:
+    return SerpApiClient(api_key="test", base_url=server.url, requests_per_second=0, retries=retries, timeout=5, backoff_seconds=0.01)
+
+def test_pagination_stops_at_first_page_past_since():
+    with FakeSerpApiServer([make_place()], latency_s=0) as server:
+        reviews = make_client(server).fetch_reviews(DATA_ID, since=date(2025, 9, 15))
+        # Page 1 reaches 2025-09-21, page 2 reaches 2025-09-11, which is past `since`
+        assert server.requests == 2
+    assert len(reviews) == 20
+    assert reviews[0]["iso_date"] == "2025-09-30"
+
+def test_pagination_follows_every_page_back_to_an_old_since():
+    with FakeSerpApiServer([make_place()], latency_s=0) as server:
+        reviews = make_client(server).fetch_reviews(DATA_ID, since=date(2020, 1, 1))
+        assert server.requests == 4
+    assert len(reviews) == 35
+
+def test_without_since_only_the_first_page_is_read():
+    with FakeSerpApiServer([make_place()], latency_s=0) as server:
+        reviews = make_client(server).fetch_reviews(DATA_ID)
+        assert server.requests == 1
+    assert len(reviews) == 10
+
+def test_max_pages_bounds_pagination():
+    with FakeSerpApiServer([make_place()], latency_s=0) as server:
+        reviews = make_client(server).fetch_reviews(DATA_ID, since=date(2020, 1, 1), max_pages=2)
+        assert server.requests == 2
+    assert len(reviews) == 20
+
+def test_rate_limit_and_server_errors_are_retried():
+    with FakeSerpApiServer([make_place()], latency_s=0, fail_statuses=[429, 503]) as server:
+        client = make_client(server)
+        reviews = client.fetch_reviews(DATA_ID)
+        assert server.requests == 3
+    assert client.requests_made == 3
+    assert len(reviews) == 10
+
+def test_backoff_doubles_between_attempts(monkeypatch):
+    delays = []
+    monkeypatch.setattr("api_queries.time.sleep", lambda seconds: delays.append(seconds))
+    with FakeSerpApiServer([make_place()], latency_s=0, fail_statuses=[500, 502, 503]) as server:
+        make_client(server).fetch_reviews(DATA_ID)
+    assert [delay for delay in delays if delay] == [0.01, 0.02, 0.04]
+
+def test_retry_after_of_a_rate_limit_is_used(monkeypatch):
+    delays = []
+    monkeypatch.setattr("api_queries.time.sleep", lambda seconds: delays.append(seconds))
+    with FakeSerpApiServer([make_place()], latency_s=0, fail_statuses=[429]) as server:
+        make_client(server).fetch_reviews(DATA_ID)
+    # The fake server sends `Retry-After: 0` instead of the 0.01s backoff
+    assert 0.0 in delays and 0.01 not in delays
+
+def test_gives_up_after_the_retries():
+    with FakeSerpApiServer([make_place()], latency_s=0, fail_statuses=[500] * 10) as server:
+        with pytest.raises(RuntimeError, match="status 500"): make_client(server, retries=2).fetch_reviews(DATA_ID)
+        assert server.requests == 3
+
+def test_client_errors_are_not_retried():
+    with FakeSerpApiServer([make_place()], latency_s=0, fail_statuses=[401]) as server:
+        with pytest.raises(RuntimeError, match="status 401"): make_client(server).fetch_reviews(DATA_ID)
+        assert server.requests == 1
+
+def test_connection_errors_are_retried():
+    import requests
+    # A port nothing listens on
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    client = SerpApiClient(api_key="test", base_url=f"http://127.0.0.1:{port}/search.json", requests_per_second=0, retries=2, timeout=1, backoff_seconds=0.01)
+    with pytest.raises(requests.ConnectionError): client.fetch_reviews(DATA_ID)
+    assert client.requests_made == 3
+
+def test_backfill_maps_a_failed_place_to_its_exception():
+    with FakeSerpApiServer([make_place()], latency_s=0) as server:
+        server.fail_statuses = [404]
+        client = make_client(server)
+        client.max_workers = 1
+        results = client.backfill(["missing", DATA_ID])
+    assert isinstance(results["missing"], RuntimeError)
+    assert len(results[DATA_ID]) == 10
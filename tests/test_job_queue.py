@@ -0,0 +1,189 @@
+from job_queue import JobQueue, JobFailed, QueueWorker
+import threading, time, pytest
+
+# JobQueue and QueueWorker on a temporary database, with fake runners standing in for the model calls and fake
+# endpoint URLs: lease expiry, heartbeats, failover to another endpoint, waiting without workers, orphaned jobs
+
+ENDPOINT_A = "http://fake-a:11434"
+ENDPOINT_B = "http://fake-b:11434"
+
+# Runners, resolved by the workers as f"{__name__}:<name>"
+def echo(payload: dict, host: str) -> dict:
+    return {**payload, "host": host}
+
+def fails_on_a(payload: dict, host: str) -> dict:
+    if host == ENDPOINT_A: raise ConnectionError(f"{host} is down")
+    return {**payload, "host": host}
+
+# Hangs on A until the test releases it
+unhang = threading.Event()
+
+def hangs_on_a(payload: dict, host: str) -> dict:
+    if host == ENDPOINT_A: unhang.wait(10)
+    return {**payload, "host": host}
+
+def make_queue(tmp_path, **options) -> JobQueue:
+    return JobQueue(path=str(tmp_path / "jobs.db"), **options)
+
+def status(queue: JobQueue, job_id: int) -> str:
+    with queue._connect() as conn: return conn.execute("SELECT status FROM jobs WHERE id = ?", (job_id,)).fetchone()[0]
+
+@pytest.fixture
+def workers():
+    started = []
+    yield started
+    for worker in started: worker.stop(timeout=5)
+
+def test_expired_lease_goes_to_another_worker(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=0.2)
+    job_id = queue.submit(f"{__name__}:echo", {"n": 1})
+    assert queue.lease("crashed", ENDPOINT_A, 1)["attempt"] == 1
+    assert queue.lease("live", ENDPOINT_B, 1) is None
+    time.sleep(0.3)
+    job = queue.lease("live", ENDPOINT_B, 1)
+    assert job["id"] == job_id and job["attempt"] == 2
+    # The first worker lost the job, so its late result is not stored
+    assert not queue.complete(job_id, "crashed", {"n": 1})
+    assert queue.complete(job_id, "live", {"n": 1})
+
+def test_expired_lease_of_the_last_attempt_fails_the_job(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=0.1, max_attempts=1)
+    job_id = queue.submit(f"{__name__}:echo", {})
+    queue.lease("crashed", ENDPOINT_A, 1)
+    time.sleep(0.2)
+    assert queue.lease("live", ENDPOINT_B, 1) is None
+    with pytest.raises(JobFailed, match="Lease expired on http://fake-a:11434"): queue.wait(job_id)
+
+def test_heartbeat_keeps_the_lease(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=0.3)
+    job_id = queue.submit(f"{__name__}:echo", {})
+    queue.lease("slow", ENDPOINT_A, 1)
+    for _ in range(3):
+        time.sleep(0.15)
+        assert queue.heartbeat("slow", [job_id]) == [job_id]
+    assert queue.lease("other", ENDPOINT_B, 1) is None
+    # Another worker's heartbeat doesn't extend it
+    assert queue.heartbeat("other", [job_id]) == []
+
+def test_endpoint_slots_are_shared_by_workers(tmp_path):
+    queue = make_queue(tmp_path)
+    for n in range(3): queue.submit(f"{__name__}:echo", {"n": n})
+    assert queue.lease("w1", ENDPOINT_A, 2) is not None
+    assert queue.lease("w2", ENDPOINT_A, 2) is not None
+    assert queue.lease("w3", ENDPOINT_A, 2) is None
+    assert queue.lease("w3", ENDPOINT_B, 2) is not None
+
+def test_job_of_a_crashed_worker_fails_over_to_a_live_one(tmp_path, workers):
+    queue = make_queue(tmp_path, lease_seconds=0.3)
+    job_id = queue.submit(f"{__name__}:echo", {"n": 7})
+    queue.lease("crashed", ENDPOINT_A, 1)
+    workers.append(QueueWorker(queue, [(ENDPOINT_B, 1)], heartbeat_seconds=0.1).start())
+    result, host = queue.wait(job_id, timeout=10)
+    assert result == {"n": 7, "host": ENDPOINT_B} and host == ENDPOINT_B
+
+def test_failed_job_is_retried_on_another_endpoint(tmp_path, workers, monkeypatch):
+    monkeypatch.setattr("job_queue.RETRY_BACKOFF_SECONDS", 0.2)
+    queue = make_queue(tmp_path)
+    job_id = queue.submit(f"{__name__}:fails_on_a", {"n": 1})
+    # The first attempt runs on A, which fails it; B is only up for the retry
+    workers.append(QueueWorker(queue, [(ENDPOINT_A, 1)], heartbeat_seconds=0.1).start())
+    while status(queue, job_id) != "queued" or queue.stats()["hosts"].get(ENDPOINT_A) is None: time.sleep(0.01)
+    workers.pop().stop(timeout=5)
+    workers.append(QueueWorker(queue, [(ENDPOINT_B, 1)], heartbeat_seconds=0.1).start())
+    result, host = queue.wait(job_id, timeout=10)
+    assert host == ENDPOINT_B and result["host"] == ENDPOINT_B
+    with queue._connect() as conn: assert conn.execute("SELECT attempts FROM jobs WHERE id = ?", (job_id,)).fetchone()[0] == 2
+
+def test_waiting_without_a_live_worker_gives_up(tmp_path):
+    queue = make_queue(tmp_path, no_worker_seconds=0.3)
+    start = time.monotonic()
+    with pytest.raises(JobFailed, match="no job queue worker"): queue.run(f"{__name__}:echo", {})
+    assert time.monotonic() - start < 5
+    assert queue.stats()["jobs"] == {"cancelled": 1}
+
+def test_job_of_the_only_worker_that_crashed_fails_the_wait(tmp_path):
+    queue = make_queue(tmp_path, lease_seconds=0.2, no_worker_seconds=0.3)
+    job_id = queue.submit(f"{__name__}:echo", {})
+    queue.lease("crashed", ENDPOINT_A, 1)
+    # No live worker is left to release the expired lease; wait() does it and then gives up
+    with pytest.raises(JobFailed, match="no job queue worker"): queue.wait(job_id, timeout=10)
+    assert status(queue, job_id) == "cancelled"
+
+def test_hung_job_goes_to_another_worker_after_its_run_time_limit(tmp_path, workers):
+    queue = make_queue(tmp_path, lease_seconds=0.2)
+    job_id = queue.submit(f"{__name__}:hangs_on_a", {"n": 3}, max_seconds=0.3)
+    workers.append(QueueWorker(queue, [(ENDPOINT_A, 1)], heartbeat_seconds=0.05).start())
+    while status(queue, job_id) != "running": time.sleep(0.01)
+    # The hung worker keeps sending heartbeats, but they stop renewing the lease after 0.3s
+    workers.append(QueueWorker(queue, [(ENDPOINT_B, 1)], heartbeat_seconds=0.05).start())
+    try: result, host = queue.wait(job_id, timeout=10)
+    finally: unhang.set()
+    assert host == ENDPOINT_B and result == {"n": 3, "host": ENDPOINT_B}
+
+def test_a_live_worker_keeps_the_caller_waiting(tmp_path):
+    queue = make_queue(tmp_path, stale_seconds=0.4, no_worker_seconds=0.2)
+    # Alive (it keeps sending heartbeats), but never takes the job
+    queue.register_worker("busy", [(ENDPOINT_A, 1)])
+    stop = threading.Event()
+
+    def heartbeats():
+        while not stop.wait(0.05): queue.heartbeat("busy", [])
+
+    beats = threading.Thread(target=heartbeats)
+    beats.start()
+    try:
+        with pytest.raises(TimeoutError): queue.run(f"{__name__}:echo", {}, timeout=1)
+    finally:
+        stop.set()
+        beats.join()
+
+def test_stopped_worker_is_no_longer_alive(tmp_path):
+    queue = make_queue(tmp_path)
+    worker = QueueWorker(queue, [(ENDPOINT_A, 1)], heartbeat_seconds=0.05).start()
+    assert list(queue.live_workers()) == [worker.worker_id]
+    worker.stop(timeout=5)
+    assert queue.live_workers() == {}
+
+def test_hosts_are_the_endpoints_of_live_workers(tmp_path, workers):
+    queue = make_queue(tmp_path, stale_seconds=0.3)
+    assert queue.hosts() == []
+    queue.configure(None, external_workers=True)
+    queue.register_worker("external", [(ENDPOINT_B, 2), (ENDPOINT_A, 1)])
+    workers.append(QueueWorker(queue, [(ENDPOINT_A, 1)], heartbeat_seconds=0.05).start())
+    assert queue.hosts() == [ENDPOINT_B, ENDPOINT_A]
+    # The external worker stops sending heartbeats
+    time.sleep(0.4)
+    assert queue.hosts() == [ENDPOINT_A]
+
+def test_queued_jobs_of_a_dead_run_are_cancelled(tmp_path):
+    crashed = make_queue(tmp_path, stale_seconds=0.2)
+    orphan_id = crashed.submit(f"{__name__}:echo", {"n": 1})
+    time.sleep(0.3)
+    queue = make_queue(tmp_path, stale_seconds=0.2)
+    job_id = queue.submit(f"{__name__}:echo", {"n": 2})
+    # The orphan is older, but the lease skips it
+    assert queue.lease("live", ENDPOINT_A, 2)["id"] == job_id
+    assert status(queue, orphan_id) == "cancelled"
+
+def test_configure_cancels_jobs_of_earlier_runs(tmp_path):
+    crashed = make_queue(tmp_path, stale_seconds=0.2)
+    orphan_id = crashed.submit(f"{__name__}:echo", {})
+    time.sleep(0.3)
+    queue = make_queue(tmp_path, stale_seconds=0.2)
+    queue.configure(None, external_workers=True)
+    assert status(queue, orphan_id) == "cancelled"
+    assert queue.run_id != crashed.run_id
+
+def test_a_waiting_run_keeps_its_queued_jobs(tmp_path):
+    waiting = make_queue(tmp_path, stale_seconds=0.2, no_worker_seconds=10)
+    job_id = waiting.submit(f"{__name__}:echo", {"n": 1})
+    results = []
+    thread = threading.Thread(target=lambda: results.append(waiting.wait(job_id, timeout=5)))
+    thread.start()
+    time.sleep(0.4)
+    worker = make_queue(tmp_path, stale_seconds=0.2)
+    job = worker.lease("late", ENDPOINT_A, 1)
+    assert job["id"] == job_id
+    worker.complete(job_id, "late", echo(job["payload"], job["host"]))
+    thread.join()
+    assert results == [({"n": 1, "host": ENDPOINT_A}, ENDPOINT_A)]
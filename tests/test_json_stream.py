@@ -0,0 +1,48 @@
+from json_stream import JSONStreamValidator, JSONStreamError, parse_json_response
+import json, pytest
+
+# JSONStreamValidator fed the way a model streams: chunks that split strings and escapes, answers that go wrong
+# part way (an unexpected key, a wrong value type, prose) and answers that end early
+
+SCHEMA = {"summary": str, "themes": list, "confidence_and_gaps": str}
+ANSWER = json.dumps({"summary": 'Says "great \\ fast" service}', "themes": [{"name": "Service", "quotes": ["{[ ok"]}], "confidence_and_gaps": "Few\nreviews"})
+
+def stream(text: str, size: int, **options) -> str:
+    validator = JSONStreamValidator(SCHEMA, **options)
+    for i in range(0, len(text), size): validator.feed(text[i:i + size])
+    return validator.result()
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_chunks_split_inside_strings_and_escapes(size):
+    # Quotes, backslashes and brackets inside strings don't end the string or the object
+    assert json.loads(stream(ANSWER, size)) == json.loads(ANSWER)
+
+def test_fence_and_short_preamble_are_skipped():
+    assert stream("Here is the JSON:\n```json\n" + ANSWER + "\n```", 5) == ANSWER
+
+def test_missing_key_fails_when_the_object_closes():
+    validator = JSONStreamValidator(SCHEMA)
+    validator.feed('{"summary": "Good", "themes": []}')
+    with pytest.raises(JSONStreamError, match="Missing keys: confidence_and_gaps"): validator.result()
+
+def test_extra_key_fails_as_soon_as_it_is_streamed():
+    validator = JSONStreamValidator(SCHEMA)
+    with pytest.raises(JSONStreamError, match="Unexpected key 'overall_metrics'"): validator.feed('{"summary": "Good", "overall_metrics": {')
+
+def test_ignored_key_is_let_through_with_any_value():
+    answer = {**json.loads(ANSWER), "overall_metrics": {"average_rating": 4.5}}
+    assert json.loads(parse_json_response(json.dumps(answer), SCHEMA, ["overall_metrics"])) == answer
+
+def test_wrong_value_type_fails_on_its_first_character():
+    validator = JSONStreamValidator(SCHEMA)
+    with pytest.raises(JSONStreamError, match="Key 'themes' should be list"): validator.feed('{"summary": "Good", "themes": "')
+
+def test_prose_fails_before_the_object():
+    with pytest.raises(JSONStreamError, match="starts with prose"): JSONStreamValidator(SCHEMA).feed("Sure! Here is a detailed analysis of the reviews you sent.")
+
+@pytest.mark.parametrize("cut", [1, 20, len(ANSWER) // 2, len(ANSWER) - 1])
+def test_truncated_output_fails(cut):
+    with pytest.raises(JSONStreamError, match="ended before the JSON object was closed"): stream(ANSWER[:cut], 4)
+
+def test_empty_output_fails():
+    with pytest.raises(JSONStreamError, match="contains no JSON object"): stream("", 4)
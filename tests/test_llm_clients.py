@@ -0,0 +1,31 @@
+from llm_clients import LLMClientRegistry
+import re
+
+# LLMClientRegistry with a fake client factory: clients per endpoint and timeout, and background preloads
+
+def test_clients_are_built_per_endpoint_and_timeout():
+    built = []
+    registry = LLMClientRegistry(base_url="http://default:11434", client_factory=lambda *args: built.append(args) or len(built))
+    assert registry.get("qwen3:8b", 0, 4096, timeout=30) == registry.get("qwen3:8b", 0, 4096, timeout=30) == 1
+    registry.get("qwen3:8b", 0, 4096, "http://other:11434", 30)
+    registry.get("qwen3:8b", 0, 4096)
+    assert built == [("qwen3:8b", 0, 4096, "http://default:11434", 30), ("qwen3:8b", 0, 4096, "http://other:11434", 30), ("qwen3:8b", 0, 4096, "http://default:11434", None)]
+
+def test_preload_runs_on_the_given_endpoint(monkeypatch):
+    registry = LLMClientRegistry(base_url="http://default:11434")
+    loaded = []
+    monkeypatch.setattr(registry, "preload", lambda model, num_ctx, base_url=None: loaded.append(base_url) or 1.5)
+    for host in [None, "http://other:11434"]: registry.preload_async("qwen3:8b", 8192, host).join(5)
+    assert loaded == [None, "http://other:11434"]
+    assert [entry["load_s"] for entry in registry.timings] == [1.5, 1.5]
+
+def test_failed_preload_is_logged_with_a_timestamp(monkeypatch, capsys):
+    registry = LLMClientRegistry(base_url="http://default:11434")
+
+    def preload(model, num_ctx, base_url=None):
+        raise ConnectionError("refused")
+
+    monkeypatch.setattr(registry, "preload", preload)
+    registry.preload_async("qwen3:8b", 8192, "http://other:11434").join(5)
+    assert re.fullmatch(r"\[\d{4}-\d\d-\d\d \d\d:\d\d:\d\d\] \| Could not preload qwen3:8b on http://other:11434: refused\n", capsys.readouterr().out)
+    assert registry.timings == []
@@ -0,0 +1,73 @@
+from datetime import date, datetime, timedelta
+from place_store import merge_places, merge_reviews, load_place_store, save_place_store, PLACE_STORE_RETENTION_DAYS
+
+# merge_places / merge_reviews: places matched by cid, reviews deduplicated across scrapes and date formats, and the
+# retention cutoff; plus a save and load round trip
+
+def days_ago(days: int) -> str:
+    when = date.today() - timedelta(days=days)
+    return f"{when.year}-{when.month}-{when.day}"
+
+def review(name: str, text: str, when: str, rating: int = 5) -> dict:
+    return {"Name": name, "When": when, "Rating": rating, "Description": text}
+
+def place(cid: str, title: str, reviews: list[dict], **fields) -> dict:
+    return {"cid": cid, "title": title, "review_count": len(reviews), "user_reviews_extended": reviews, **fields}
+
+def test_places_are_new_updated_or_merged_by_cid():
+    store = {}
+    first = review("Ann", "Great service", days_ago(10))
+    stats = merge_places(store, [place("1", "LDV North", [first]), place("2", "LDV South", [])], datetime(2025, 3, 1))
+    assert stats == {"new_places": 2, "updated_places": 0, "new_reviews": 1}
+
+    # A renamed place with the same cid, one review seen before and one new
+    second = review("Bob", "Slow paperwork", days_ago(2), rating=2)
+    stats = merge_places(store, [place("1", "LDV North Auckland", [first, second], review_rating=4.1)], datetime(2025, 3, 8))
+    assert stats == {"new_places": 0, "updated_places": 1, "new_reviews": 1}
+    assert list(store) == ["1", "2"]
+    # Details come from the latest scrape; reviews accumulate, newest first
+    assert store["1"]["title"] == "LDV North Auckland" and store["1"]["review_rating"] == 4.1
+    assert store["1"]["user_reviews_extended"] == [second, first]
+    assert store["1"]["last_scraped_at"] == "2025-03-08T00:00:00" and store["2"]["last_scraped_at"] == "2025-03-01T00:00:00"
+
+def test_places_without_cid_fall_back_to_data_id_or_title():
+    store = {}
+    merge_places(store, [{"data_id": "0x1", "title": "A"}, {"title": "B"}, {"review_count": 3}])
+    assert list(store) == ["0x1", "B"]
+
+def test_reviews_seen_before_are_not_added_again():
+    when = date.today() - timedelta(days=5)
+    scraped = review("Ann", "Great  service", f"{when.year}-{when.month}-{when.day}")
+    # The same review from SerpAPI: ISO date, other case and spacing
+    serpapi = review("ann ", "great service ", f"{when.isoformat()}T08:30:00Z")
+    merged, added = merge_reviews([scraped], [serpapi, scraped])
+    assert merged == [scraped] and added == 0
+
+def test_undated_reviews_are_deduplicated_by_author_and_text():
+    reviews = [review("Ann", "Great service", ""), review("Bob", "Great service", ""), review("Ann", "Friendly staff", "")]
+    merged, added = merge_reviews(reviews[:1], reviews + [review("ANN", "great service", "")])
+    assert added == 2 and len(merged) == 3
+    # An undated review is a different review from a dated one with the same author and text
+    merged, added = merge_reviews(merged, [review("Ann", "Great service", days_ago(1))])
+    assert added == 1 and merged[0]["When"] == days_ago(1)
+
+def test_reviews_older_than_the_retention_window_are_dropped():
+    assert PLACE_STORE_RETENTION_DAYS == 3 * 365
+    kept = review("Ann", "Kept", days_ago(PLACE_STORE_RETENTION_DAYS))
+    expired = review("Bob", "Expired", days_ago(PLACE_STORE_RETENTION_DAYS + 1))
+    undated = review("Cy", "Undated", "")
+    # Both stored and newly scraped reviews are cut
+    merged, added = merge_reviews([kept, expired], [review("Dee", "Also expired", days_ago(PLACE_STORE_RETENTION_DAYS + 30)), undated])
+    assert merged == [kept, undated] and added == 1
+    # Without a window everything is kept
+    merged, _ = merge_reviews([kept, expired], [], retention_days=None)
+    assert merged == [kept, expired]
+
+def test_store_survives_a_save_and_load(tmp_path):
+    path = str(tmp_path / "places" / "store.jsonl")
+    store = {}
+    merge_places(store, [place("1", "LDV Ōtāhuhu", [review("Ann", "Kia ora", days_ago(1))]), place("2", "LDV South", [])])
+    save_place_store(store, path)
+    save_place_store(store, path)
+    assert load_place_store(path) == store
+    assert load_place_store(f"{path}.bak") == store
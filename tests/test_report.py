@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta
+from algorithms import load_summary_state, prune_summary_state
+import report, pytest
+
+# summarize_dealers with the model calls replaced: which dealers are sent to the model on each run, given the
+# summary state in cache_data/summary_state.json
+
+@pytest.fixture
+def summarized(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    calls = []
+
+    def generate_review_summaries(reviews_per_dealer, max_workers=4, labels=None):
+        calls.append(labels)
+        return [f"Summary of {len(reviews)} reviews" for reviews in reviews_per_dealer]
+
+    monkeypatch.setattr(report, "generate_review_summaries", generate_review_summaries)
+    return calls
+
+def dealers(*texts: str) -> list[dict]:
+    return [{"title": f"Dealer {i}", "user_reviews_extended": [{"Rating": 5, "Description": text, "When": "2025-09-01"}]} for i, text in enumerate(texts)]
+
+def test_unchanged_dealers_reuse_their_summary(summarized):
+    report.summarize_dealers(dealers("Great service", "Slow paperwork"))
+    results = report.summarize_dealers(dealers("Great service", "Rude staff"))
+    assert summarized == [["Dealer 0", "Dealer 1"], ["Dealer 1"]]
+    assert [result["review_summary"] for result in results] == ["Summary of 1 reviews"] * 2
+    assert "user_reviews_extended" not in results[0]
+
+def test_alternating_periods_both_reuse_their_summaries(summarized):
+    # Same dealers, different reviews in each period, as in a batch over two periods
+    august, september = dealers("Great service", "Slow paperwork"), dealers("Quick handover", "Friendly staff")
+    for period in [august, september, august, september]: report.summarize_dealers([dict(dealer) for dealer in period])
+    assert summarized == [["Dealer 0", "Dealer 1"], ["Dealer 0", "Dealer 1"], [], []]
+    assert len(load_summary_state()) == 4
+
+def test_no_incremental_summarizes_every_dealer(summarized):
+    report.summarize_dealers(dealers("Great service"))
+    report.summarize_dealers(dealers("Great service"), incremental=False)
+    assert summarized == [["Dealer 0"], ["Dealer 0"]]
+
+def test_a_changed_summary_version_summarizes_again(summarized, monkeypatch):
+    report.summarize_dealers(dealers("Great service"))
+    monkeypatch.setattr(report, "summary_version", lambda: "another")
+    report.summarize_dealers(dealers("Great service"))
+    assert summarized == [["Dealer 0"], ["Dealer 0"]]
+
+def test_prune_drops_entries_not_used_for_the_retention():
+    old = (datetime.now() - timedelta(days=400)).isoformat(timespec="seconds")
+    recent = datetime.now().isoformat(timespec="seconds")
+    state = {"a": {"used_at": old}, "b": {"updated_at": old, "used_at": recent}, "c": {"updated_at": old}, "d": {"updated_at": recent}}
+    assert sorted(prune_summary_state(state, days=365)) == ["b", "d"]
@@ -0,0 +1,69 @@
+from datetime import date
+from review_store import ReviewStore, Period, month_period, quarter_period, rolling_period, custom_period, previous_period, parse_review_date, parse_period_args
+import pytest
+
+# Report periods, their previous periods across month, quarter and year boundaries, and ReviewStore's date index
+
+def dealer(title: str, whens: list[str]) -> dict:
+    return {"title": title, "user_reviews_extended": [{"When": when, "Rating": i % 5 + 1, "Description": f"{title} {when}"} for i, when in enumerate(whens)]}
+
+def test_month_period_covers_the_whole_month():
+    assert month_period(2, 2024) == Period(date(2024, 2, 1), date(2024, 2, 29), "February 2024")
+    assert month_period("12", 2025) == Period(date(2025, 12, 1), date(2025, 12, 31), "December 2025")
+    with pytest.raises(ValueError): month_period(13, 2025)
+
+def test_quarter_period_covers_three_months():
+    assert quarter_period(4, 2025) == Period(date(2025, 10, 1), date(2025, 12, 31), "Q4 2025")
+    with pytest.raises(ValueError): quarter_period(0, 2025)
+
+def test_rolling_period_includes_both_ends():
+    period = rolling_period(7, date(2026, 1, 3))
+    assert (period.start, period.end) == (date(2025, 12, 28), date(2026, 1, 3))
+    with pytest.raises(ValueError): rolling_period(0)
+
+@pytest.mark.parametrize("period, expected", [
+    (month_period(3, 2024), month_period(2, 2024)),
+    (month_period(1, 2026), month_period(12, 2025)),
+    (quarter_period(3, 2025), quarter_period(2, 2025)),
+    (quarter_period(1, 2026), quarter_period(4, 2025)),
+    # A window of the same length ending the day before, across the new year
+    (rolling_period(7, date(2026, 1, 3)), custom_period("2025-12-21", "2025-12-27")),
+    # Whole months and quarters given as dates
+    (custom_period("2025-03-01", "2025-03-31"), month_period(2, 2025)),
+    (custom_period("2025-04-01", "2025-06-30"), quarter_period(1, 2025)),
+    # Not a whole month: a same-length window, not the previous month
+    (custom_period("2025-03-01", "2025-03-10"), custom_period("2025-02-19", "2025-02-28")),
+])
+def test_previous_period(period, expected):
+    assert previous_period(period) == expected
+
+def test_review_dates_in_both_formats():
+    assert parse_review_date("2025-3-7") == parse_review_date("2025-03-07T10:00:00Z") == date(2025, 3, 7)
+    assert [parse_review_date(when) for when in [None, "", "a year ago", "2025-02-30"]] == [None, None, None, None]
+
+def test_reviews_between_includes_both_ends():
+    store = ReviewStore([dealer("A", ["2025-12-31", "2026-1-1", "2025-11-30", "2026-01-31T23:00:00Z", "2026-2-1"])])
+    assert [review["When"] for review in store.reviews_between(0, date(2026, 1, 1), date(2026, 1, 31))] == ["2026-1-1", "2026-01-31T23:00:00Z"]
+    assert store.reviews_between(0, date(2024, 1, 1), date(2024, 12, 31)) == []
+
+def test_query_matches_a_linear_filter():
+    whens = [f"{year}-{month}-{day}" for year in [2025, 2026] for month in range(1, 13) for day in [1, 15, 28]]
+    store = ReviewStore([dealer("A", whens), dealer("B", whens[::3]), dealer("C", [])])
+    for period in [month_period(12, 2025), quarter_period(1, 2026), rolling_period(20, date(2026, 1, 10))]:
+        for i, reviews in enumerate(store.query(period)):
+            expected = [review for review in dealer("ABC"[i], [whens, whens[::3], []][i])["user_reviews_extended"] if period.start <= parse_review_date(review["When"]) <= period.end]
+            # Newest first, with only the review keys
+            assert reviews["user_reviews_extended"] == [{"Rating": review["Rating"], "Description": review["Description"]} for review in reversed(expected)]
+        assert store.review_counts(period) == [len(reviews["user_reviews_extended"]) for reviews in store.query(period)]
+
+def test_undated_reviews_are_counted_and_left_out():
+    store = ReviewStore([dealer("A", ["2025-6-1", "", "last week"])])
+    assert store.undated_count == 2
+    assert store.ratings(custom_period("2025-01-01", "2025-12-31")) == [[1]]
+    assert store.dealerships == [{"title": "A"}]
+
+def test_period_args():
+    assert parse_period_args(month=9, year=2025) == month_period(9, 2025)
+    assert parse_period_args(quarter=1, year=2026) == quarter_period(1, 2026)
+    assert parse_period_args(date_from="2025-01-01", date_to="2025-01-31").label == "2025-01-01 to 2025-01-31"
+    with pytest.raises(ValueError): parse_period_args(date_from="2025-01-01")
@@ -0,0 +1,72 @@
+from run_store import PipelineRun, STAGES, latest_run_id
+import os, pytest
+
+# PipelineRun on a temporary runs directory: a run that fails part way is resumed, stage flags force or require
+# artifacts, and artifacts of another stage version are not loaded
+
+STEPS = ["input", "metrics", "summaries", "analysis"]
+
+# Runs the first pipeline stages like report.generate_report does; `fail` makes that stage raise.
+# Returns the stages that were computed rather than loaded, and the run's results.
+def run_pipeline(run: PipelineRun, fail: str | None = None) -> tuple[list[str], list]:
+    computed = []
+
+    def compute(stage: str, value):
+        computed.append(stage)
+        if stage == fail: raise RuntimeError(f"{stage} failed")
+        return value
+
+    results = [run.stage(stage, lambda stage=stage: compute(stage, {"stage": stage, "n": n})) for n, stage in enumerate(STEPS) if run.wants(stage)]
+    return computed, results
+
+def start(runs_dir: str) -> PipelineRun:
+    run = PipelineRun(runs_dir=runs_dir, name="Acme Motors March 2026")
+    run.save_manifest({"client": "Acme Motors"})
+    return run
+
+def test_resume_skips_completed_stages_and_reruns_the_failed_one(tmp_path):
+    runs_dir = str(tmp_path)
+    first = start(runs_dir)
+    with pytest.raises(RuntimeError, match="summaries failed"): run_pipeline(first, fail="summaries")
+    assert [stage for stage in STAGES if first.has(stage)] == ["input", "metrics"]
+
+    resumed = PipelineRun(first.run_id, runs_dir=runs_dir)
+    computed, results = run_pipeline(resumed)
+    assert computed == ["summaries", "analysis"]
+    assert results == [{"stage": stage, "n": n} for n, stage in enumerate(STEPS)]
+    assert resumed.load_manifest()["params"] == {"client": "Acme Motors"}
+    assert list(resumed.stage_seconds()) == STEPS
+
+    # Nothing is left to compute
+    assert run_pipeline(PipelineRun("latest", runs_dir=runs_dir))[0] == []
+
+def test_from_stage_recomputes_that_stage_and_the_ones_after(tmp_path):
+    run = start(str(tmp_path))
+    run_pipeline(run)
+    assert run_pipeline(PipelineRun(run.run_id, runs_dir=str(tmp_path), from_stage="summaries"))[0] == ["summaries", "analysis"]
+
+def test_only_stage_stops_after_that_stage(tmp_path):
+    run = start(str(tmp_path))
+    run_pipeline(run)
+    computed, results = run_pipeline(PipelineRun(run.run_id, runs_dir=str(tmp_path), only_stage="metrics"))
+    assert computed == ["metrics"] and len(results) == 2
+
+def test_stage_flag_needs_the_earlier_artifacts(tmp_path):
+    run = start(str(tmp_path))
+    with pytest.raises(RuntimeError): run_pipeline(run, fail="input")
+    with pytest.raises(ValueError, match="has no 'input' artifact"): run_pipeline(PipelineRun(run.run_id, runs_dir=str(tmp_path), from_stage="metrics"))
+
+def test_artifact_of_another_version_is_recomputed(tmp_path, monkeypatch):
+    run = start(str(tmp_path))
+    run_pipeline(run)
+    monkeypatch.setitem(STAGES, "analysis", STAGES["analysis"] + 1)
+    assert run_pipeline(PipelineRun(run.run_id, runs_dir=str(tmp_path)))[0] == ["analysis"]
+
+def test_resume_errors(tmp_path):
+    with pytest.raises(ValueError, match="No runs to resume"): PipelineRun("latest", runs_dir=str(tmp_path))
+    with pytest.raises(ValueError, match="not found"): PipelineRun("2026-03-01_00-00-00", runs_dir=str(tmp_path))
+    with pytest.raises(ValueError, match="need a run to resume"): PipelineRun(runs_dir=str(tmp_path), from_stage="analysis")
+    with pytest.raises(ValueError, match="Unknown stage"): PipelineRun(runs_dir=str(tmp_path), only_stage="summary")
+    # A run without a manifest (e.g. one that crashed before saving it) is not resumable
+    os.makedirs(tmp_path / "2026-03-02_00-00-00")
+    assert latest_run_id(str(tmp_path)) is None
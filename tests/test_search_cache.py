@@ -0,0 +1,66 @@
+from concurrent.futures import ThreadPoolExecutor
+from search_cache import CachedSearch
+import re, threading
+
+# CachedSearch: the on-disk TTL cache, pages dropped only when the same conversation reads them again, and
+# counters scoped to each search run
+
+# Three pages per query, each with its own text
+class FakeTavily:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, args: dict) -> dict:
+        self.calls += 1
+        slug = re.sub(r"\W+", "-", args["query"].lower()).strip("-")
+        return {"query": args["query"], "results": [{"url": f"https://reviews.example.com/{slug}/{i}", "title": f"Review {i}", "content": f"Review {i} of {args['query']}", "score": 0.9} for i in range(3)]}
+
+def make_search(tmp_path) -> tuple[CachedSearch, FakeTavily]:
+    backend = FakeTavily()
+    return CachedSearch(backend=backend, path=str(tmp_path / "search_cache.db")), backend
+
+def test_repeated_query_is_served_from_disk(tmp_path):
+    search, backend = make_search(tmp_path)
+    first = search.search({"query": "LDV Deliver 7 review"})
+    assert search.search({"query": "ldv  deliver 7 REVIEW"}) == first
+    assert backend.calls == 1
+    assert search.stats() == {"hits": 1, "misses": 1, "duplicates_removed": 0}
+
+def test_pages_are_dropped_only_within_one_conversation(tmp_path):
+    search, _ = make_search(tmp_path)
+    args = {"query": "LDV Deliver 7 review"}
+    seen = set()
+    assert len(search.search_unseen(args, seen)["results"]) == 3
+    assert search.search_unseen(args, seen)["results"] == []
+    # Another model's conversation gets the same pages, unchanged: there is no deduplication across models
+    assert search.search_unseen(args, set()) == search.search(args)
+    assert search.stats()["duplicates_removed"] == 3
+
+def test_same_content_at_another_url_is_a_duplicate(tmp_path):
+    search, _ = make_search(tmp_path)
+    seen = set()
+    page = {"url": "https://a.example.com/review", "title": "Review", "content": "Solid  van."}
+    search.drop_seen({"results": [page]}, seen)
+    assert search.drop_seen({"results": [{**page, "url": "https://b.example.com/copy", "content": "solid van."}]}, seen)["results"] == []
+
+def test_concurrent_runs_count_their_own_searches(tmp_path):
+    search, _ = make_search(tmp_path)
+    barrier = threading.Barrier(2)
+
+    def run(queries: list[str]) -> dict:
+        with search.run() as stats:
+            barrier.wait()
+            for query in queries: search.search_unseen({"query": query}, set())
+            barrier.wait()
+        return stats
+
+    with ThreadPoolExecutor(2) as pool: first, second = pool.map(run, [["a", "a"], ["b", "c", "d"]])
+    assert first == {"hits": 1, "misses": 1, "duplicates_removed": 0}
+    assert second == {"hits": 0, "misses": 3, "duplicates_removed": 0}
+    assert search.stats() == {"hits": 1, "misses": 4, "duplicates_removed": 0}
+
+def test_counters_of_a_remote_job_are_added_to_the_run(tmp_path):
+    search, _ = make_search(tmp_path)
+    search.add_to_run({"hits": 2, "misses": 1, "duplicates_removed": 0})
+    with search.run() as stats: search.add_to_run({"hits": 2, "misses": 1, "duplicates_removed": 1})
+    assert stats == {"hits": 2, "misses": 1, "duplicates_removed": 1}
@@ -0,0 +1,36 @@
+import math
+
+# No tokenizer is installed for the local models, so token counts are estimated from characters.
+# Qwen averages ~3.5-4 characters per token on English review text; 3 keeps the estimate on the safe side
+# so a prompt is never silently truncated by Ollama.
+CHARS_PER_TOKEN = 3
+MIN_NUM_CTX = 1024
+MAX_NUM_CTX = 32768
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+# Smallest power-of-two context that holds the prompts plus the expected output.
+# Rounding to a few sizes lets Ollama keep reusing a loaded context instead of resizing per call.
+def fit_num_ctx(system_prompt: str, user_prompt: str, output_tokens: int, min_ctx: int = MIN_NUM_CTX) -> int:
+    needed = estimate_tokens(system_prompt) + estimate_tokens(user_prompt) + output_tokens
+    if needed > MAX_NUM_CTX:
+        raise ValueError(f"Prompt needs ~{needed} tokens, more than the {MAX_NUM_CTX} token context limit. Split the input first.")
+    num_ctx = max(MIN_NUM_CTX, min_ctx)
+    while num_ctx < needed: num_ctx *= 2
+    return num_ctx
+
+# Greedily pack records, in order, into batches whose encoded size stays within max_tokens.
+# A single record larger than the budget gets a batch of its own.
+def chunk_records(records: list, max_tokens: int, encode=str) -> list[list]:
+    batches = []
+    batch, batch_tokens = [], 0
+    for record in records:
+        record_tokens = estimate_tokens(encode(record)) + 1  # separator
+        if batch and batch_tokens + record_tokens > max_tokens:
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(record)
+        batch_tokens += record_tokens
+    if batch: batches.append(batch)
+    return batches
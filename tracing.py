@@ -0,0 +1,191 @@
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Iterator
+import contextvars, itertools, json, os, threading, time
+
+# Lightweight spans around the expensive parts of a run (pipeline stages, model calls, searches, SerpAPI, PDF).
+# Each span records its duration, status and attributes such as tokens and cache hits. A run's spans are written
+# to `trace.jsonl` in its run directory, plus a Prometheus textfile summary (`metrics.prom`) there and, if set,
+# in `metrics_dir` for node_exporter's textfile collector.
+# The current run and span live in context variables, so spans opened in worker threads and asyncio tasks
+# attach to the right run as long as the work is submitted with the caller's context (see `in_context`).
+
+METRIC_PREFIX = "review_insights"
+
+_current_run = contextvars.ContextVar("trace_run", default=None)
+_current_span = contextvars.ContextVar("trace_span", default=None)
+_attributes = contextvars.ContextVar("trace_attributes", default={})
+_span_ids = itertools.count(1)
+
+class Span:
+    def __init__(self, name: str, run_id: str | None, parent_id: str | None, attributes: dict):
+        self.name = name
+        self.run_id = run_id
+        self.span_id = f"{next(_span_ids):x}"
+        self.parent_id = parent_id
+        self.attributes = attributes
+        self.started_at = datetime.now().isoformat(timespec="milliseconds")
+        self.duration_s = None
+        self.status = "ok"
+        self.error = None
+
+    def set(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    # Mark the span as failed without raising, for errors that are returned as values
+    def fail(self, error: BaseException | str) -> None:
+        self.status = "error"
+        self.error = f"{type(error).__name__}: {error}" if isinstance(error, BaseException) else error
+
+    def to_dict(self) -> dict:
+        return {"run_id": self.run_id, "span_id": self.span_id, "parent_id": self.parent_id, "name": self.name, "started_at": self.started_at, "duration_s": self.duration_s, "status": self.status, "error": self.error, **({"attributes": self.attributes} if self.attributes else {})}
+
+
+class Tracer:
+    def __init__(self, enabled: bool = True, metrics_dir: str | None = None):
+        self.enabled = enabled
+        self.metrics_dir = metrics_dir
+        self.spans = []
+        self._lock = threading.Lock()
+
+    # Time the block. An exception marks the span as an error and is re-raised.
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[Span]:
+        parent = _current_span.get()
+        span = Span(name, _current_run.get(), parent.span_id if parent else None, {**_attributes.get(), **attributes})
+        if not self.enabled:
+            yield span
+            return
+        token = _current_span.set(span)
+        start = time.perf_counter()
+        try: yield span
+        except BaseException as e:
+            span.status, span.error = "error", f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.duration_s = round(time.perf_counter() - start, 6)
+            _current_span.reset(token)
+            with self._lock: self.spans.append(span.to_dict())
+
+    # Spans opened inside the block belong to `run_id`
+    @contextmanager
+    def run(self, run_id: str) -> Iterator[None]:
+        token = _current_run.set(run_id)
+        try: yield
+        finally: _current_run.reset(token)
+
+    # Attributes (e.g. the dealer) added to every span opened inside the block
+    @contextmanager
+    def attributes(self, **attributes: Any) -> Iterator[None]:
+        token = _attributes.set({**_attributes.get(), **attributes})
+        try: yield
+        finally: _attributes.reset(token)
+
+    # Remove and return the finished spans of one run (None for spans outside any run)
+    def pop_spans(self, run_id: str | None) -> list[dict]:
+        with self._lock:
+            spans = [span for span in self.spans if span["run_id"] == run_id]
+            self.spans = [span for span in self.spans if span["run_id"] != run_id]
+        return spans
+
+    # Write the run's spans to `{run_dir}/trace.jsonl` (appended, so a resumed run continues its trace) and the
+    # Prometheus summary next to it and to metrics_dir. Returns the spans written.
+    def flush_run(self, run_id: str, run_dir: str, labels: dict[str, str], metrics_name: str) -> list[dict]:
+        spans = self.pop_spans(run_id)
+        if not self.enabled: return spans
+        write_trace(spans, os.path.join(run_dir, "trace.jsonl"))
+        text = prometheus_text(spans, labels)
+        write_atomic(os.path.join(run_dir, "metrics.prom"), text)
+        if self.metrics_dir: write_atomic(os.path.join(self.metrics_dir, f"{metrics_name}.prom"), text)
+        return spans
+
+    # Trace the block as one run: its spans are flushed to the run directory even if the run fails
+    @contextmanager
+    def record_run(self, run_id: str, run_dir: str, labels: dict[str, str], metrics_name: str) -> Iterator[list[dict]]:
+        spans = []
+        with self.run(run_id):
+            try:
+                with self.span("run", **labels): yield spans
+            finally: spans.extend(self.flush_run(run_id, run_dir, labels, metrics_name))
+
+    def reset(self) -> None:
+        with self._lock: self.spans = []
+
+
+# Wrap fn so it runs in the caller's context; use when submitting work to a thread pool
+def in_context(fn):
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+def write_trace(spans: list[dict], file_path: str) -> None:
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    with open(file_path, "a", encoding="utf-8") as f:
+        for span in spans: f.write(json.dumps(span, ensure_ascii=False, default=str) + "\n")
+
+# The textfile collector may read at any moment, so the file is replaced rather than rewritten
+def write_atomic(file_path: str, text: str) -> None:
+    os.makedirs(os.path.dirname(file_path) or ".", exist_ok=True)
+    with open(f"{file_path}.tmp", "w", encoding="utf-8") as f: f.write(text)
+    os.replace(f"{file_path}.tmp", file_path)
+
+def _label_value(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(labels: dict) -> str:
+    return ",".join(f'{key}="{_label_value(value)}"' for key, value in labels.items())
+
+# Per-run gauges: time, calls and errors per span name, time per pipeline stage, model tokens and cache hits per model stage,
+# and calls and time per model
+def prometheus_text(spans: list[dict], labels: dict[str, str]) -> str:
+    metrics = {
+        "span_seconds": ("Time spent in spans of each name", {}),
+        "span_calls": ("Spans of each name", {}),
+        "span_errors": ("Spans of each name that ended in an error", {}),
+        "stage_seconds": ("Time per pipeline stage (loaded stages count as loaded)", {}),
+        "llm_tokens": ("Model prompt and completion tokens per model stage", {}),
+        "llm_cache_hits": ("Model calls answered from the LLM cache per model stage", {}),
+        "model_calls": ("Model calls (not cache hits) per model and status, including the ones a fallback model answered", {}),
+        "model_seconds": ("Time spent in model calls (not cache hits) per model", {}),
+        "dedup_tokens_saved": ("Estimated summary prompt tokens saved by collapsing duplicate reviews", {}),
+        "run_timestamp_seconds": ("When the run's metrics were written", {})
+    }
+    def add(metric: str, value: float, **extra) -> None:
+        series = metrics[metric][1]
+        key = tuple(sorted(extra.items()))
+        series[key] = series.get(key, 0) + value
+
+    for span in spans:
+        attributes = span.get("attributes") or {}
+        add("span_seconds", span["duration_s"] or 0, span=span["name"])
+        add("span_calls", 1, span=span["name"])
+        add("span_errors", int(span["status"] == "error"), span=span["name"])
+        if span["name"] == "stage": add("stage_seconds", span["duration_s"] or 0, stage=attributes.get("stage"), loaded=str(bool(attributes.get("loaded"))).lower())
+        if span["name"] == "llm":
+            add("llm_tokens", attributes.get("prompt_tokens") or 0, stage=attributes.get("stage"), type="prompt")
+            add("llm_tokens", attributes.get("completion_tokens") or 0, stage=attributes.get("stage"), type="completion")
+            add("llm_cache_hits", int(bool(attributes.get("cache_hit"))), stage=attributes.get("stage"))
+            if not attributes.get("cache_hit"):
+                add("model_calls", 1, model=attributes.get("model"), status=span["status"])
+                add("model_seconds", span["duration_s"] or 0, model=attributes.get("model"))
+        if span["name"] == "dedup": add("dedup_tokens_saved", attributes.get("tokens_saved") or 0)
+    add("run_timestamp_seconds", time.time())
+
+    lines = []
+    for metric, (help_text, series) in metrics.items():
+        name = f"{METRIC_PREFIX}_{metric}"
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} gauge"]
+        for key, value in series.items():
+            lines.append(f"{name}{{{_labels({**labels, **dict(key)})}}} {round(value, 6)}")
+    return "\n".join(lines) + "\n"
+
+# Seconds per dealer (or other `item`) over the spans that carry one, slowest first
+def slowest_items(spans: list[dict], top: int = 5) -> list[tuple[str, float]]:
+    totals = {}
+    for span in spans:
+        item = (span.get("attributes") or {}).get("item")
+        if item is not None and span["name"] == "llm": totals[item] = totals.get(item, 0) + (span["duration_s"] or 0)
+    return sorted(((item, round(seconds, 2)) for item, seconds in totals.items()), key=lambda entry: entry[1], reverse=True)[:top]
+
+
+# Shared instance used by every instrumented module
+tracer = Tracer()